@@ -0,0 +1,8 @@
+import logging
+
+interval = 600
+jitter = 30
+
+
+def cron_function() -> None:
+    logging.debug('test cron')
@@ -23,6 +23,14 @@ ERROR_INTERFACE_NO_SUCH_MATCH_RULE = (3629, 'NO-SUCH-MATCH-RULE')
 ERROR_INTERFACE_MATCH_RULE_EXISTED = (3630, 'MATCH-RULE-EXISTED')
 ERROR_INTERFACE_UNKNOWN = (3631, 'INTERFACE-UNKNOWN-ERROR')
 ERROR_INTERFACE_NOT_FINISHED = (3632, 'REQUEST-NOT-FINISHED')
+ERROR_INTERFACE_EXECUTION = (3633, 'INTERFACE-EXECUTION-INVALID')  # 接口声明的执行方式无效
+ERROR_INTERFACE_ATTRIBUTE = (3634, 'INTERFACE-ATTRIBUTE-INVALID')  # 接口声明的可选参数无效
+ERROR_INTERFACE_BUSY = (3635, 'INTERFACE-BUSY')  # 接口并发已满, 且等待队列已满
+ERROR_INTERFACE_BODY_TOO_LARGE = (3636, 'REQUEST-BODY-TOO-LARGE')  # 请求正文超过接口声明的 max_body_size
+ERROR_CRON_IMPORT_JOB = (3637, 'IMPORT-CRON-JOB-ERROR')  # 定时任务文件导入失败
+ERROR_CRON_JOB_INVALID = (3638, 'CRON-JOB-INVALID')  # 定时任务文件缺少 cron_function 或参数无效
+ERROR_CRON_JOB_NOT_FOUND = (3639, 'CRON-JOB-NOT-FOUND')  # 定时任务不存在
+ERROR_CRON_UNKNOWN = (3640, 'CRON-UNKNOWN-ERROR')
 
 __code_dic = {}
 __msg_dic = {}
@@ -42,6 +50,10 @@ def err_by_code(code):
         return ERROR_SERVICE
 
 
+def all_errors():
+    return list(__code_dic.values())
+
+
 def err_by_msg(msg):
     if msg in __msg_dic:
         return __msg_dic[msg]
@@ -0,0 +1,29 @@
+import hashlib
+from twisted.web.http import Request
+
+from error_code import ErrorException, ERROR_INTERFACE_METHOD, OP_SUCCEEDED
+from lib.interface_manager import REQUEST_BODY_STREAM
+from lib.response import write_json
+
+match_rule = '/upload/digest'
+request_body = REQUEST_BODY_STREAM
+max_body_size = 1024 * 1024 * 1024
+
+
+def interface_body_chunk(request: Request, data: bytes):
+    # 在 reactor 线程中逐块调用, 此时只有请求头可用
+    digest = getattr(request, 'digest', None)
+    if digest is None:
+        digest = request.digest = hashlib.sha256()
+    digest.update(data)
+
+
+def interface_function(request: Request):
+    if request.method.decode() != 'POST':
+        raise ErrorException(ERROR_INTERFACE_METHOD)
+
+    digest = getattr(request, 'digest', None) or hashlib.sha256()
+
+    res_obj = ErrorException(OP_SUCCEEDED).to_dict()
+    res_obj['data'] = {"match_rule": match_rule, "size": request.body_size, "sha256": digest.hexdigest()}
+    write_json(request, res_obj)
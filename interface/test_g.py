@@ -0,0 +1,20 @@
+import os
+from twisted.web.http import Request
+
+from error_code import ErrorException, ERROR_INTERFACE_METHOD, ERROR_INTERFACE_PARAM
+from lib.response_stream import stream_response
+
+match_rule = '/download/{}'
+
+
+def interface_function(request: Request):
+    if request.method.decode() not in ('GET', 'HEAD'):
+        raise ErrorException(ERROR_INTERFACE_METHOD)
+
+    # 仅作示例: 下载工程目录下 docs 中的文件
+    name = request.path.decode().rsplit('/', 1)[-1]
+    path = os.path.join(os.path.abspath('.'), 'docs', name)
+    if name.startswith('.') or not os.path.isfile(path):
+        raise ErrorException(ERROR_INTERFACE_PARAM)
+
+    stream_response(request, path)
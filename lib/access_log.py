@@ -0,0 +1,141 @@
+"""
+SServer 的结构化访问日志, 每条为一行 json:
+    {"time", "method", "path", "rule", "status", "code", "bytes_in", "bytes_out", "queue_wait", "handler", "reason"}
+
+    0.按 sample_rate 抽样; 出错 (status >= 400 或返回了非 0 的错误码) 与慢请求 (queue_wait + handler >= slow_ms) 总是记录,
+      reason 为 sample/error/slow
+    1.记录在 reactor 线程中进行, 先放入内存缓冲, 满 buffer_size 条或每 flush_interval 秒交给写线程批量写入文件;
+      写线程积压超过 max_pending 批时丢弃新的批次
+    2.每批写入都重新以追加方式打开文件, 可以直接配合 logrotate 等外部工具移动日志文件
+"""
+import logging
+import queue
+import random
+import threading
+import time
+
+from twisted.internet import reactor, task
+
+from lib import json_tool
+
+REASON_SAMPLE = 'sample'
+REASON_ERROR = 'error'
+REASON_SLOW = 'slow'
+
+
+class _BatchWriter(threading.Thread):
+    __stop = object()
+
+    def __init__(self, path: str, max_pending: int):
+        super().__init__(name='access-log-writer', daemon=True)
+        self.path = path
+        self.__queue = queue.Queue(max_pending)
+        self.dropped = 0
+        self.written = 0
+
+    def submit(self, lines) -> bool:
+        try:
+            self.__queue.put_nowait(lines)
+            return True
+        except queue.Full:
+            return False
+
+    def stop(self):
+        self.__queue.put(self.__stop)
+        self.join()
+
+    def run(self):
+        while True:
+            lines = self.__queue.get()
+            if lines is self.__stop:
+                return
+            try:
+                with open(self.path, 'ab') as file:
+                    file.write(b''.join(lines))
+                self.written += len(lines)
+            except OSError as e:
+                self.dropped += len(lines)
+                logging.error('Access log write failed path:%s error:%r', self.path, e)
+
+
+class AccessLog:
+    """
+    除 stats 外只能在 reactor 线程中使用
+    """
+
+    def __init__(self, path: str, sample_rate: float = 0.01, slow_ms: float = 1000, buffer_size: int = 1000,
+                 flush_interval: float = 1.0, max_pending: int = 100):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow = slow_ms / 1000
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.__buffer = []
+        self.__writer = _BatchWriter(path, max_pending)
+        self.__flusher = task.LoopingCall(self.flush)
+        self.__random = random.random
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def start(self):
+        self.__writer.start()
+        self.__flusher.start(self.flush_interval, now=False)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        logging.info('Access log started path:%s sample_rate:%s slow_ms:%s', self.path, self.sample_rate,
+                     self.slow * 1000)
+
+    def stop(self):
+        if self.__flusher.running:
+            self.__flusher.stop()
+        self.flush()
+        self.__writer.stop()
+
+    def record(self, request, rule, error_code, queue_wait: float = None, handler_time: float = None):
+        """
+        request 结束 (或客户端断开) 后调用, queue_wait/handler_time 为秒, 请求未执行接口时为 None
+        """
+        status = request.code
+        if (error_code is not None and error_code != 0) or status >= 400:
+            reason = REASON_ERROR
+        elif (queue_wait or 0) + (handler_time or 0) >= self.slow:
+            reason = REASON_SLOW
+        elif self.__random() < self.sample_rate:
+            reason = REASON_SAMPLE
+        else:
+            self.sampled_out += 1
+            return
+
+        line = json_tool.dumps({
+            "time": round(time.time(), 3),
+            "method": request.method.decode(errors='replace'),
+            "path": request.path.decode(errors='replace'),
+            "rule": rule,
+            "status": status,
+            "code": error_code,
+            "bytes_in": getattr(request, 'body_size', None),
+            "bytes_out": request.sentLength,
+            "queue_wait": None if queue_wait is None else round(queue_wait, 6),
+            "handler": None if handler_time is None else round(handler_time, 6),
+            "reason": reason,
+        })
+        self.__buffer.append(line + b'\n')
+        if len(self.__buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.__buffer:
+            return
+        lines, self.__buffer = self.__buffer, []
+        if not self.__writer.submit(lines):
+            self.dropped += len(lines)
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow * 1000,
+            "buffered": len(self.__buffer),
+            "written": self.__writer.written,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped + self.__writer.dropped,
+        }
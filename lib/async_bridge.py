@@ -0,0 +1,38 @@
+import asyncio
+import inspect
+
+from twisted.internet import defer
+
+
+def as_deferred(result) -> defer.Deferred:
+    """
+    将函数返回值统一转换为 Deferred:
+        0.Deferred 原样返回
+        1.协程等 awaitable 在 asyncio reactor 的事件循环中作为 Task 执行,
+          未安装 asyncio reactor 时退化为 ensureDeferred (仅能 await Deferred)
+        2.其余视为同步结果
+    需要在 reactor 线程中调用.
+    """
+    if isinstance(result, defer.Deferred):
+        return result
+
+    if inspect.isawaitable(result):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return defer.ensureDeferred(result)
+        return defer.Deferred.fromFuture(asyncio.ensure_future(result, loop=loop))
+
+    return defer.succeed(result)
+
+
+def call_on_reactor(function, *args, **kwargs) -> defer.Deferred:
+    """
+    在当前 (reactor) 线程中调用 function, 同步异常同样以 errback 的形式返回.
+    """
+    try:
+        result = function(*args, **kwargs)
+    except BaseException:
+        return defer.fail()
+
+    return as_deferred(result)
@@ -0,0 +1,283 @@
+"""
+不阻塞线程的外部命令执行, 代替 subprocess.getstatusoutput:
+    0.run_command 在 reactor 线程中以 spawnProcess 启动子进程, 返回 Deferred; async 接口中使用 async_command
+    1.参数为列表时不经过 shell; 为字符串时按 shlex 拆分, 含有管道/重定向等 shell 语法或为 shell 内置命令时才交给 /bin/sh 执行
+    2.timeout 秒后发送 SIGTERM, 再过 kill_grace 秒仍未退出时发送 SIGKILL
+    3.同时运行的子进程数不超过 max_concurrency (set_max_concurrency), 超出的命令排队等待
+    4.on_stdout/on_stderr 在 reactor 线程中收到每一块输出, keep_output 为 False 时不再缓存输出
+    5.退出码非 0/被信号终止/超时/命令不存在时以 ErrorException(err_code) 结束, check 为 False 时返回 CommandResult
+    6.run_command_sync 供线程池中的接口及 common.do_command 使用, 与 getstatusoutput 一样返回合并的输出
+"""
+import asyncio
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+
+from twisted.internet import reactor, protocol, defer, error, threads
+from twisted.python import threadable
+
+import error_code
+from error_code import ErrorException
+
+# 出现以下字符时字符串命令需要 shell 解释
+_SHELL_CHARS = frozenset('|&;<>()$`\\"\'*?[]#~={}\n')
+
+DEFAULT_MAX_CONCURRENCY = 32
+
+_limit = defer.DeferredSemaphore(DEFAULT_MAX_CONCURRENCY)
+# reactor 未运行时 (如进程池的子进程中) 的同步执行使用的并发限制
+_sync_limit = threading.BoundedSemaphore(DEFAULT_MAX_CONCURRENCY)
+_counts = {"finished": 0, "failed": 0, "timed_out": 0}
+
+
+def set_max_concurrency(max_concurrency: int):
+    """
+    须在启动 reactor 之前调用
+    """
+    global _limit, _sync_limit
+    _limit = defer.DeferredSemaphore(max_concurrency)
+    _sync_limit = threading.BoundedSemaphore(max_concurrency)
+
+
+def stats():
+    """
+    只能在 reactor 线程中调用
+    """
+    result = {
+        "max_concurrency": _limit.limit,
+        "running": _limit.limit - _limit.tokens,
+        "waiting": len(_limit.waiting),
+    }
+    result.update(_counts)
+    return result
+
+
+def command_args(cmd):
+    """
+    字符串命令转换为参数列表, 需要 shell 时为 ['/bin/sh', '-c', cmd]
+    """
+    if not isinstance(cmd, str):
+        return [os.fsdecode(item) if isinstance(item, bytes) else str(item) for item in cmd]
+    if _SHELL_CHARS.isdisjoint(cmd):
+        args = shlex.split(cmd)
+        # exit/cd 等 shell 内置命令仍交给 shell
+        if args and shutil.which(args[0]) is not None:
+            return args
+    return ['/bin/sh', '-c', cmd]
+
+
+class CommandResult:
+    __slots__ = ('args', 'exit_code', 'signal', 'stdout', 'stderr', 'output', 'elapsed', 'timed_out')
+
+    def __init__(self, args):
+        self.args = args
+        self.exit_code = None
+        self.signal = None
+        self.stdout = b''
+        self.stderr = b''
+        self.output = b''  # 按到达顺序合并的 stdout 与 stderr
+        self.elapsed = 0.0
+        self.timed_out = False
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0 and not self.timed_out
+
+    @property
+    def text(self) -> str:
+        """
+        与 getstatusoutput 一致: 合并的输出, 去掉末尾的一个换行
+        """
+        text = self.output.decode(errors='replace')
+        return text[:-1] if text.endswith('\n') else text
+
+    def describe(self):
+        return 'cmd=%s exit_code=%s signal=%s timed_out=%s elapsed=%.3f' % (
+            self.args, self.exit_code, self.signal, self.timed_out, self.elapsed)
+
+
+class _CommandProtocol(protocol.ProcessProtocol):
+    def __init__(self, result: CommandResult, on_stdout, on_stderr, keep_output: bool, stdin: bytes):
+        self.result = result
+        self.done = defer.Deferred()
+        self.__on_stdout = on_stdout
+        self.__on_stderr = on_stderr
+        self.__keep_output = keep_output
+        self.__stdin = stdin
+        self.__stdout = []
+        self.__stderr = []
+        self.__output = []
+        self.__timers = []
+
+    def connectionMade(self):
+        if self.__stdin:
+            self.transport.write(self.__stdin)
+        self.transport.closeStdin()
+
+    def set_timeout(self, timeout: float, kill_grace: float):
+        def term():
+            self.result.timed_out = True
+            self.__signal('TERM')
+            self.__timers.append(reactor.callLater(kill_grace, self.__signal, 'KILL'))
+
+        self.__timers.append(reactor.callLater(timeout, term))
+
+    def __signal(self, name):
+        try:
+            self.transport.signalProcess(name)
+        except (OSError, error.ProcessExitedAlready):
+            pass
+
+    def outReceived(self, data: bytes):
+        if self.__keep_output:
+            self.__stdout.append(data)
+            self.__output.append(data)
+        if self.__on_stdout is not None:
+            self.__on_stdout(data)
+
+    def errReceived(self, data: bytes):
+        if self.__keep_output:
+            self.__stderr.append(data)
+            self.__output.append(data)
+        if self.__on_stderr is not None:
+            self.__on_stderr(data)
+
+    def processExited(self, reason):
+        if self.result.timed_out:
+            # 超时终止后不再等待仍持有输出管道的孙进程
+            self.transport.loseConnection()
+
+    def processEnded(self, reason):
+        for timer in self.__timers:
+            if timer.active():
+                timer.cancel()
+
+        result = self.result
+        result.exit_code = reason.value.exitCode
+        result.signal = reason.value.signal
+        result.stdout = b''.join(self.__stdout)
+        result.stderr = b''.join(self.__stderr)
+        result.output = b''.join(self.__output)
+        self.done.callback(result)
+
+
+def _spawn(args, timeout, kill_grace, env, path, on_stdout, on_stderr, keep_output, stdin):
+    result = CommandResult(args)
+    started_at = time.perf_counter()
+
+    executable = shutil.which(args[0]) if args else None
+    if executable is None:
+        result.exit_code = 127
+        result.output = result.stderr = b'command not found: %s' % (args[0] if args else '').encode()
+        return defer.succeed(result)
+
+    command = _CommandProtocol(result, on_stdout, on_stderr, keep_output, stdin)
+    try:
+        reactor.spawnProcess(command, executable, args, env=os.environ if env is None else env, path=path)
+    except OSError as e:
+        result.exit_code = 126
+        result.output = result.stderr = str(e).encode()
+        return defer.succeed(result)
+
+    if timeout is not None:
+        command.set_timeout(timeout, kill_grace)
+
+    def on_ended(result):
+        result.elapsed = time.perf_counter() - started_at
+        return result
+
+    return command.done.addCallback(on_ended)
+
+
+def _check(result: CommandResult, err_code, check: bool):
+    _counts["finished"] += 1
+    if result.timed_out:
+        _counts["timed_out"] += 1
+    if not result.ok:
+        _counts["failed"] += 1
+    if check and not result.ok:
+        logging.error('do_command failed %s output=%r err_code=%s',
+                      result.describe(), result.text[-1000:], ErrorException(err_code))
+        raise ErrorException(err_code)
+    return result
+
+
+def run_command(cmd, timeout: float = None, err_code=error_code.ERROR_INTERFACE_DO_COMMAND_ERROR, check: bool = True,
+                kill_grace: float = 5, env: dict = None, path: str = None, on_stdout=None, on_stderr=None,
+                keep_output: bool = True, stdin: bytes = None) -> defer.Deferred:
+    """
+    只能在 reactor 线程中调用, 结果为 CommandResult
+    """
+    args = command_args(cmd)
+    logging.debug('do_command cmd=%s', args)
+    d = _limit.run(_spawn, args, timeout, kill_grace, env, path, on_stdout, on_stderr, keep_output, stdin)
+    d.addCallback(_check, err_code, check)
+    return d
+
+
+async def async_command(cmd, **kwargs) -> CommandResult:
+    """
+    供 async def 接口使用: result = await async_command(['ls', '-l'], timeout=10)
+    """
+    return await run_command(cmd, **kwargs).asFuture(asyncio.get_running_loop())
+
+
+def _run_subprocess(args, timeout, kill_grace, env, path, stdin):
+    """
+    reactor 未运行或在 reactor 线程中时的同步执行
+    """
+    result = CommandResult(args)
+    started_at = time.perf_counter()
+    with _sync_limit:
+        try:
+            process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       env=env, cwd=path)
+        except OSError as e:
+            result.exit_code = 127 if isinstance(e, FileNotFoundError) else 126
+            result.output = result.stderr = str(e).encode()
+            return result
+
+        try:
+            output, _ = process.communicate(stdin, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            result.timed_out = True
+            process.terminate()
+            try:
+                output, _ = process.communicate(timeout=kill_grace)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                try:
+                    output, _ = process.communicate(timeout=kill_grace)
+                except subprocess.TimeoutExpired:
+                    # 孙进程仍持有输出管道, 放弃剩余的输出
+                    process.stdout.close()
+                    process.wait()
+                    output = b''
+
+    result.output = result.stdout = output
+    if process.returncode < 0:
+        result.signal = -process.returncode
+    else:
+        result.exit_code = process.returncode
+    result.elapsed = time.perf_counter() - started_at
+    return result
+
+
+def run_command_sync(cmd, timeout: float = None, err_code=error_code.ERROR_INTERFACE_DO_COMMAND_ERROR,
+                     check: bool = True, kill_grace: float = 5, env: dict = None, path: str = None,
+                     stdin: bytes = None) -> CommandResult:
+    """
+    阻塞当前线程直到命令结束. 在线程池中调用时由 reactor 启动子进程, 当前线程只等待结果;
+    reactor 未运行或在 reactor 线程中调用时直接以 subprocess 执行
+    """
+    if reactor.running and not threadable.isInIOThread():
+        return threads.blockingCallFromThread(reactor, run_command, cmd, timeout=timeout, err_code=err_code,
+                                              check=check, kill_grace=kill_grace, env=env, path=path, stdin=stdin)
+
+    args = command_args(cmd)
+    logging.debug('do_command cmd=%s', args)
+    return _check(_run_subprocess(args, timeout, kill_grace, env, path, stdin), err_code, check)
@@ -1,7 +1,5 @@
 import sqlite3
-import subprocess
 import threading
-import traceback
 
 import error_code
 import logging
@@ -100,30 +98,62 @@ class RWLock(object):
     write_release = unlock
 
 
-def do_command(cmd, err_code=error_code.ERROR_INTERFACE_DO_COMMAND_ERROR):
-    if log_on:
-        logging.debug(cmd)
-    err, res = subprocess.getstatusoutput(cmd)
-    if err != 0:
-        if log_on:
-            logging.error('do_command cmd=%s err=%s res=%s err_code=%s'
-                          % (cmd, err, res, error_code.ErrorException(err_code)))
-        raise error_code.ErrorException(err_code)
-    else:
-        return res
+def do_command(cmd, err_code=error_code.ERROR_INTERFACE_DO_COMMAND_ERROR, timeout=None):
+    """
+    同步执行命令, 返回合并的 stdout 与 stderr (与 subprocess.getstatusoutput 一致), 失败时抛出 ErrorException(err_code).
+    cmd 为列表时不经过 shell, 详见 lib.command
+    """
+    # lib.command 会导入 reactor, 不能在 http_server 安装 asyncioreactor 之前导入
+    from lib import command
+    return command.run_command_sync(cmd, timeout=timeout, err_code=err_code).text
 
 
 class SQLite:
+    """
+    每个线程对每个数据库文件复用同一个连接, 不再在每个 with 块中打开/关闭连接.
+    全部连接由 close 关闭 (http_server 在 reactor 停止前调用), 之后再使用时重新打开
+    """
+    __local = threading.local()
+    # 所有线程打开的连接, 供 close 使用
+    __connections = []
+    __connections_lock = threading.Lock()
+    __generation = 0
+
     def __init__(self, file='sqlite.db'):
         self.file = file
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.file)
+        local = self.__local
+        if getattr(local, 'generation', None) != SQLite.__generation:
+            # 本线程的连接已被 close 关闭
+            local.connections = {}
+            local.generation = SQLite.__generation
+
+        conn = local.connections.get(self.file)
+        if conn is None:
+            # 只在本线程中使用, check_same_thread=False 只是为了能由 close 在其它线程中关闭
+            conn = local.connections[self.file] = sqlite3.connect(self.file, check_same_thread=False)
+            with self.__connections_lock:
+                self.__connections.append(conn)
+        self.conn = conn
         return self.conn.cursor()
 
     def __exit__(self, type, value, traceback):
         self.conn.commit()
-        self.conn.close()
+
+    @classmethod
+    def close(cls):
+        """
+        关闭所有线程打开的连接, 须在没有线程正在使用连接时调用
+        """
+        with cls.__connections_lock:
+            connections, cls.__connections = cls.__connections, []
+            cls.__generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
 
 
 class ResultThread(threading.Thread):
@@ -162,13 +192,13 @@ def set_interval(interval_seconds):
                     function(*args, **kwargs)
                 except (Exception,):
                     if log_on:
-                        logging.debug('\nCron Function Exception:%s\n' % traceback.format_exc())
+                        logging.debug('\nCron Function Exception:', exc_info=True)
                 while not stopped.wait(interval_seconds):
                     try:
                         function(*args, **kwargs)
                     except (Exception,):
                         if log_on:
-                            logging.debug('\nCron Function Exception:%s\n' % traceback.format_exc())
+                            logging.debug('\nCron Function Exception:', exc_info=True)
 
             t = threading.Thread(target=loop)
             t.daemon = True
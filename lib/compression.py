@@ -0,0 +1,178 @@
+"""
+响应压缩, 按请求的 Accept-Encoding 协商编码:
+    gzip    标准库, 总是可用
+    br      安装了 brotli 时可用
+    zstd    安装了 zstandard 时可用
+
+    negotiate(request)                  返回选定的编码, 不压缩时为 None
+    compressible(code, headers, size)   响应是否值得压缩: 不小于 min_bytes, 未设置 Content-Encoding, 且为文本类 Content-Type
+    compress(encoding, body) -> bytes
+    compress_response(response, encoding) -> Response
+    compress_filter(request, response)  供 request.response_filter 使用
+
+压缩在线程池中进行, reactor 线程只负责协商与写出.
+"""
+import gzip
+
+from twisted.python import threadable
+
+from lib.response import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODING_BROTLI = 'br'
+ENCODING_ZSTD = 'zstd'
+ENCODING_GZIP = 'gzip'
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# 服务端的优先顺序, q 值相同时靠前者优先
+DEFAULT_ENCODINGS = (ENCODING_BROTLI, ENCODING_ZSTD, ENCODING_GZIP)
+
+_TEXT_TYPES = (b'text/', b'application/json', b'application/javascript', b'application/xml', b'image/svg+xml')
+
+encodings = ()
+min_bytes = 1024
+
+
+def available_encodings():
+    result = [ENCODING_GZIP]
+    if brotli is not None:
+        result.append(ENCODING_BROTLI)
+    if zstandard is not None:
+        result.append(ENCODING_ZSTD)
+    return result
+
+
+def configure(enabled_encodings=DEFAULT_ENCODINGS, min_size: int = 1024):
+    """
+    设置启用的编码 (按优先顺序, 未安装的编码被忽略) 与压缩的最小字节数, 返回实际启用的编码
+    """
+    global encodings, min_bytes
+    available = available_encodings()
+    encodings = tuple(encoding for encoding in enabled_encodings if encoding in available)
+    min_bytes = min_size
+    return encodings
+
+
+def negotiate(request):
+    """
+    按 Accept-Encoding 的 q 值选择编码, q 值相同时按 encodings 的顺序
+    """
+    if not encodings:
+        return None
+
+    values = request.requestHeaders.getRawHeaders(b'accept-encoding')
+    if not values:
+        return None
+
+    weights = {}
+    for value in values:
+        for item in value.split(b','):
+            name, _, params = item.partition(b';')
+            name = name.strip().lower().decode(errors='replace')
+            weight = 1.0
+            params = params.strip()
+            if params[:2] == b'q=':
+                try:
+                    weight = float(params[2:])
+                except ValueError:
+                    weight = 0.0
+            weights[name] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compressible(code: int, headers, size: int) -> bool:
+    """
+    :param headers: [(name, [value, ...]), ...]
+    """
+    if size < min_bytes or code in (204, 206, 304):
+        return False
+
+    content_type = None
+    for name, values in headers:
+        lower = name.lower()
+        if lower == b'content-encoding':
+            return False
+        if lower == b'content-type':
+            content_type = values[-1].lower()
+    return content_type is not None and content_type.startswith(_TEXT_TYPES)
+
+
+def compress(encoding: str, body: bytes) -> bytes:
+    if encoding == ENCODING_GZIP:
+        # mtime 固定为 0, 相同正文的压缩结果相同, 便于生成 ETag
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    elif encoding == ENCODING_BROTLI:
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == ENCODING_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    raise ValueError('unknown encoding %r' % encoding)
+
+
+def vary_headers(headers):
+    """
+    加上 Vary: Accept-Encoding, 可压缩的响应无论是否压缩都需要
+    """
+    result = []
+    vary = None
+    for name, values in headers:
+        if name.lower() == b'vary':
+            vary = values
+        else:
+            result.append((name, values))
+
+    if vary is None:
+        vary = [b'Accept-Encoding']
+    elif not any(b'accept-encoding' in value.lower() for value in vary):
+        vary = vary + [b'Accept-Encoding']
+    result.append((b'vary', vary))
+    return result
+
+
+def encoded_headers(headers, encoding: str, size: int):
+    """
+    压缩后的响应头: 替换 Content-Length, 加上 Content-Encoding 与 Vary
+    """
+    result = vary_headers([(name, values) for name, values in headers if name.lower() != b'content-length'])
+    result.append((b'content-encoding', [encoding.encode()]))
+    result.append((b'content-length', [b'%d' % size]))
+    return result
+
+
+def compress_response(response: Response, encoding: str) -> Response:
+    body = compress(encoding, response.body)
+    return Response(response.code, encoded_headers(response.headers, encoding, len(body)), body, response.message)
+
+
+def compress_filter(request, response: Response) -> Response:
+    """
+    request.response_filter: 按 request.response_encoding 压缩. 在 reactor 线程中调用时不压缩, 只加上 Vary.
+    压缩后未压缩的正文与编码记录在 request.identity_body/content_encoding 中, 供 lib.response_cache 保存
+    """
+    if not compressible(response.code, response.headers, len(response.body)):
+        return response
+
+    encoding = getattr(request, 'response_encoding', None)
+    if encoding is None or threadable.isInIOThread():
+        return Response(response.code, vary_headers(response.headers), response.body, response.message)
+
+    request.identity_body = response.body
+    request.content_encoding = encoding
+    return compress_response(response, encoding)
@@ -0,0 +1,341 @@
+"""
+定时任务, 从 cron_lib 目录载入任务文件, 载入方式与 InterfaceManager 载入接口相同:
+    0.任务文件中定义 cron_function 函数与 interval (正数, 秒), 可选 jitter (非负数, 秒, 默认 0)
+      与 run_at_start (默认 False, 为 True 时载入后立即执行一次)
+    1.所有任务共用一个 reactor 定时器: 按下次执行时间排成堆, 只为最早到期的任务设置 callLater
+    2.同步的 cron_function 在大小为 max_workers 的线程池中执行, async def 定义的 cron_function 在 reactor 线程中执行,
+      任务数量与线程数量无关
+    3.上一次执行尚未结束时跳过本次执行 (记入 skipped), 同一任务不会同时执行
+    4.每次执行结束后再过 interval 秒加上 0~jitter 秒的随机延迟执行下一次, 避免大量任务在同一时刻执行
+    5.重新载入只重新导入有变化的任务文件, 修改过的任务保留统计并按新的 interval 重新计时
+"""
+import heapq
+import inspect
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from types import FunctionType
+
+from twisted.internet import reactor, threads
+from twisted.python import threadable
+
+from error_code import ErrorException, OP_SUCCEEDED, ERROR_CRON_IMPORT_JOB, ERROR_CRON_JOB_INVALID, \
+    ERROR_CRON_UNKNOWN
+from lib.async_bridge import call_on_reactor
+from lib.interface_manager import ReloadTracker, reload_entry
+
+
+def check_cron_attribute(lib) -> bool:
+    """
+    校验任务文件:
+        cron_function       必须, 函数或 async def 函数, 无参数
+        interval            必须, 正数, 两次执行之间的间隔 (秒)
+        jitter              可选, 非负数, 每次执行前的随机延迟上限 (秒), 默认 0
+        run_at_start        可选, bool, 默认 False
+    """
+    if not isinstance(getattr(lib, 'cron_function', None), FunctionType):
+        return False
+
+    interval = getattr(lib, 'interval', None)
+    if type(interval) not in (int, float) or interval <= 0:
+        return False
+
+    jitter = getattr(lib, 'jitter', 0)
+    if type(jitter) not in (int, float) or jitter < 0:
+        return False
+
+    return type(getattr(lib, 'run_at_start', False)) is bool
+
+
+class CronJob:
+    """
+    已载入的任务及其执行统计, 只在 reactor 线程中修改
+    """
+    __slots__ = ('name', 'function', 'is_async', 'interval', 'jitter', 'run_at_start', 'generation', 'next_run',
+                 'running', 'runs', 'failures', 'skipped', 'last_start', 'last_duration', 'max_duration',
+                 'total_duration', 'last_error')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.generation = 0
+        self.next_run = None  # reactor.seconds() 时间
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_start = None
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_error = None
+
+    def define(self, lib):
+        self.function = lib.cron_function
+        self.is_async = inspect.iscoroutinefunction(lib.cron_function)
+        self.interval = lib.interval
+        self.jitter = getattr(lib, 'jitter', 0)
+        self.run_at_start = getattr(lib, 'run_at_start', False)
+        self.generation += 1
+
+    def stats(self):
+        next_run = None
+        if self.next_run is not None:
+            next_run = round(time.time() + self.next_run - reactor.seconds(), 3)
+        return {
+            "name": self.name,
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "async": self.is_async,
+            "running": self.running,
+            "next_run": next_run,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_start": self.last_start,
+            "last_duration": None if self.last_duration is None else round(self.last_duration, 6),
+            "max_duration": round(self.max_duration, 6),
+            "avg_duration": round(self.total_duration / self.runs, 6) if self.runs else None,
+            "last_error": self.last_error,
+        }
+
+
+def _run_job(function):
+    """
+    在线程池中执行, 返回 (耗时, 异常 repr, 堆栈)
+    """
+    started_at = time.perf_counter()
+    try:
+        function()
+    except BaseException as e:
+        return time.perf_counter() - started_at, repr(e), traceback.format_exc()
+    return time.perf_counter() - started_at, None, None
+
+
+class CronManager:
+    """
+    reload_cron/list_cron/run_cron 可以在任意线程中调用, 其余方法只在 reactor 线程中调用
+    """
+
+    def __init__(self, cron_dir_path: str, max_workers: int = 4):
+        self.__cron_dir_path = cron_dir_path
+        # 任务文件及其依赖的同目录模块的签名
+        self.__tracker = ReloadTracker(cron_dir_path)
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cron')
+        self.max_workers = max_workers
+        # {任务文件名: CronJob}, 只在 reactor 线程中修改
+        self.__jobs = {}
+        # {任务文件名: 上次载入的结果}
+        self.__results = {}
+        # [(下次执行时间, 序号, 任务文件名, generation)], 任务修改/删除后旧的条目在出堆时丢弃
+        self.__heap = []
+        self.__seq = 0
+        self.__timer = None
+        self.__stopped = False
+        self.__reload_lock = threading.Lock()
+        self.__random = random.random
+
+    def start(self):
+        self.reload_cron()
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def stop(self):
+        self.__stopped = True
+        if self.__timer is not None and self.__timer.active():
+            self.__timer.cancel()
+        self.__timer = None
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def __in_reactor(function, *args):
+        if reactor.running and not threadable.isInIOThread():
+            return threads.blockingCallFromThread(reactor, function, *args)
+        return function(*args)
+
+    def list_cron(self):
+        return self.__in_reactor(lambda: [job.stats() for _, job in sorted(self.__jobs.items())])
+
+    def run_cron(self, name: str) -> bool:
+        """
+        立即执行一次, 不影响下次执行的时间; 任务不存在时返回 False
+        """
+        def run():
+            job = self.__jobs.get(name)
+            if job is None:
+                return False
+            self.__fire(job)
+            return True
+
+        return self.__in_reactor(run)
+
+    def __load_cron_file(self, name: str):
+        """
+        :return: (任务模块或 None, 失败时的结果, 依赖的文件)
+        """
+        try:
+            lib, files = self.__tracker.import_file(name)
+        except (BaseException,):
+            logging.error('Load cron file failed name:%s\n %s' % (name, traceback.format_exc()))
+            return (None, reload_entry(ErrorException(ERROR_CRON_IMPORT_JOB), traceback.format_exc(), cron_file=name),
+                    {self.__tracker.file_path(name)})
+
+        if not check_cron_attribute(lib):
+            return None, reload_entry(ErrorException(ERROR_CRON_JOB_INVALID), cron_file=name), files
+        return lib, None, files
+
+    def reload_cron(self, force: bool = False):
+        """
+        增量重新载入, force 为 True 时重新导入全部任务文件. 返回格式与 reload_interface 相同
+        """
+        with self.__reload_lock:
+            reload_result = []
+            tracker = self.__tracker
+            try:
+                names = tracker.list_files() if os.path.isdir(self.__cron_dir_path) else []
+
+                loaded = {}
+                for name in tracker.scan(names, force):
+                    loaded[name] = self.__load_cron_file(name)
+
+                files = {}
+                for name in names:
+                    if name in loaded:
+                        state = tracker.state(name)
+                        lib, entry, files[name] = loaded[name]
+                        if entry is None:
+                            entry = reload_entry(ErrorException(OP_SUCCEEDED), cron_file=name)
+                        self.__results[name] = entry
+                    else:
+                        state = 'unchanged'
+                    entry = dict(self.__results[name])
+                    entry["state"] = state
+                    reload_result.append(entry)
+
+                removed = tracker.removed(names)
+                for name in removed:
+                    del self.__results[name]
+                    entry = reload_entry(ErrorException(OP_SUCCEEDED), cron_file=name)
+                    entry["state"] = 'removed'
+                    reload_result.append(entry)
+
+                tracker.commit(names, files)
+
+                self.__in_reactor(self.__apply, {name: item[0] for name, item in loaded.items()}, removed)
+            except (BaseException,):
+                logging.error(traceback.format_exc())
+                reload_result.append(reload_entry(ErrorException(ERROR_CRON_UNKNOWN), traceback.format_exc(),
+                                                  cron_file=None))
+            return reload_result
+
+    def __apply(self, loaded: dict, removed: list):
+        """
+        :param loaded: {任务文件名: 任务模块, 校验未通过时为 None}
+        """
+        now = reactor.seconds()
+        for name, lib in loaded.items():
+            if lib is None:
+                self.__jobs.pop(name, None)
+                continue
+
+            job = self.__jobs.get(name)
+            if job is None:
+                job = self.__jobs[name] = CronJob(name)
+                job.define(lib)
+                self.__schedule(job, now + (0 if job.run_at_start else job.interval))
+            else:
+                job.define(lib)
+                self.__schedule(job, now + job.interval)
+
+        for name in removed:
+            self.__jobs.pop(name, None)
+
+        self.__arm()
+        logging.info('Cron jobs loaded count:%d', len(self.__jobs))
+
+    def __schedule(self, job: CronJob, when: float):
+        job.next_run = when + self.__random() * job.jitter
+        self.__seq += 1
+        heapq.heappush(self.__heap, (job.next_run, self.__seq, job.name, job.generation))
+
+    def __valid(self, entry) -> bool:
+        job = self.__jobs.get(entry[2])
+        return job is not None and job.generation == entry[3] and job.next_run == entry[0]
+
+    def __arm(self):
+        """
+        为最早到期的任务设置定时器
+        """
+        while self.__heap and not self.__valid(self.__heap[0]):
+            heapq.heappop(self.__heap)
+
+        if self.__stopped or not self.__heap:
+            if self.__timer is not None and self.__timer.active():
+                self.__timer.cancel()
+            self.__timer = None
+            return
+
+        delay = max(0.0, self.__heap[0][0] - reactor.seconds())
+        if self.__timer is not None and self.__timer.active():
+            self.__timer.reset(delay)
+        else:
+            self.__timer = reactor.callLater(delay, self.__tick)
+
+    def __tick(self):
+        self.__timer = None
+        now = reactor.seconds()
+        while self.__heap and self.__heap[0][0] <= now:
+            entry = heapq.heappop(self.__heap)
+            if not self.__valid(entry):
+                continue
+            job = self.__jobs[entry[2]]
+            job.next_run = None
+            self.__fire(job)
+        self.__arm()
+
+    def __fire(self, job: CronJob):
+        if job.running:
+            job.skipped += 1
+            # 本次执行结束后会安排下一次执行
+            logging.warning('Cron job skipped, last run not finished name:%s', job.name)
+            return
+
+        job.running = True
+        job.last_start = time.time()
+
+        if job.is_async:
+            started_at = time.perf_counter()
+            d = call_on_reactor(job.function)
+            d.addCallbacks(lambda _: (time.perf_counter() - started_at, None, None),
+                           lambda failure: (time.perf_counter() - started_at, repr(failure.value),
+                                            failure.getTraceback()))
+            d.addCallback(lambda result: self.__finished(job, *result))
+            return
+
+        try:
+            future = self.__executor.submit(_run_job, job.function)
+        except RuntimeError:
+            # 线程池已关闭
+            job.running = False
+            return
+        future.add_done_callback(
+            lambda f: reactor.callFromThread(self.__finished, job, *f.result()) if not f.cancelled()
+            else None)
+
+    def __finished(self, job: CronJob, elapsed: float, error, tb):
+        job.running = False
+        job.runs += 1
+        job.last_duration = elapsed
+        job.total_duration += elapsed
+        job.max_duration = max(job.max_duration, elapsed)
+        if error is not None:
+            job.failures += 1
+            job.last_error = {"time": time.time(), "error": error, "traceback": tb}
+            logging.error('Cron job failed name:%s error:%s\n %s' % (job.name, error, tb))
+
+        if self.__jobs.get(job.name) is job and job.next_run is None:
+            # 下一次从本次执行结束时开始计时; 执行期间任务被修改时已按新的定义安排
+            self.__schedule(job, reactor.seconds() + job.interval)
+            self.__arm()
@@ -1,14 +1,28 @@
 import os
+import socket
 import logging
 
+# 须在其它模块导入 reactor 之前安装, 使 async def 接口可以直接运行在 reactor 线程中
+from twisted.internet import asyncioreactor
+asyncioreactor.install()
+
 from twisted.web import server
-from twisted.internet import reactor, endpoints
+from twisted.internet import reactor, endpoints, threads
 
+from lib import json_tool, command, compression, common
+from lib.access_log import AccessLog
 from lib.conf_tool import http_conf
-from lib.interface_manager import InterfaceManager
+from lib.cron_manager import CronManager
+from lib.interface_manager import InterfaceManager, EXECUTION_PROCESS
+from lib.interface_watcher import InterfaceWatcher
 from lib.log_utils import logging_init
+from lib.process_pool import ProcessPool
+from lib.profiler import Profiler
+from lib.request_body import InterfaceChannel, InterfaceRequest
+from lib.response_cache import ResponseCache
 from lib.servers.mgmt_server import MServer
 from lib.servers.service_server import SServer
+from lib.workers import WorkerSupervisor, start_worker_control, WORKER_LISTEN_FD
 
 
 mgmt_host = http_conf.get('http_server', "mgmt_host")
@@ -17,28 +31,48 @@ mgmt_port = int(http_conf.get('http_server', "mgmt_port"))
 service_host = http_conf.get('http_server', "service_host")
 service_port = int(http_conf.get('http_server', "service_port"))
 
-interface_path = os.path.join(os.path.abspath('.'), 'interface')
-cron_lib_path = os.path.join(os.path.abspath('.'), 'cron_lib')
-
-reactor.suggestThreadPoolSize(200)
+route_cache_size = int(http_conf.get('http_server', "route_cache_size") or 1000)
+thread_pool_size = int(http_conf.get('http_server', "thread_pool_size") or 200)
+workers = int(http_conf.get('http_server', "workers") or 0)
+reload_workers = int(http_conf.get('http_server', "reload_workers") or 4)
+json_backend = http_conf.get('http_server', "json_backend") or json_tool.BACKEND_AUTO
+watch_interface = int(http_conf.get('http_server', "watch_interface") or 0)
+watch_debounce = float(http_conf.get('http_server', "watch_debounce") or 1)
+watch_poll_interval = float(http_conf.get('http_server', "watch_poll_interval") or 2)
+slow_request_ms = float(http_conf.get('http_server', "slow_request_ms") or 0)
+process_pool_size = int(http_conf.get('http_server', "process_pool_size") or 0)
+process_max_tasks_per_child = int(http_conf.get('http_server', "process_max_tasks_per_child") or 0)
+response_cache_entries = int(http_conf.get('http_server', "response_cache_entries") or 10000)
+response_cache_mb = float(http_conf.get('http_server', "response_cache_mb") or 256)
+response_cache_entry_kb = float(http_conf.get('http_server', "response_cache_entry_kb") or 1024)
+compress_encodings = http_conf.get('http_server', "compress_encodings")
+compress_min_bytes = int(http_conf.get('http_server', "compress_min_bytes") or 1024)
+cron_workers = int(http_conf.get('http_server', "cron_workers") or 4)
+command_max_concurrency = int(http_conf.get('http_server', "command_max_concurrency") or
+                              command.DEFAULT_MAX_CONCURRENCY)
 
+access_log_enable = int(http_conf.get('access_log', "enable") or 0)
+access_log_path = http_conf.get('access_log', "path") or './access.log'
+access_log_sample_rate = float(http_conf.get('access_log', "sample_rate") or 0)
+access_log_slow_ms = float(http_conf.get('access_log', "slow_ms") or 1000)
+access_log_buffer_size = int(http_conf.get('access_log', "buffer_size") or 1000)
+access_log_flush_interval = float(http_conf.get('access_log', "flush_interval") or 1)
 
-def start_http_service():
-    logging_init()
+interface_path = os.path.join(os.path.abspath('.'), 'interface')
+cron_lib_path = os.path.join(os.path.abspath('.'), 'cron_lib')
 
-    interface_manager = InterfaceManager(interface_path)
-    interface_manager.reload_interface()
+reactor.suggestThreadPoolSize(thread_pool_size)
+json_tool.set_backend(json_backend)
+command.set_max_concurrency(command_max_concurrency)
+compression.configure([item.strip() for item in compress_encodings.split(',') if item.strip()], compress_min_bytes)
+# 关闭接口通过 common.SQLite 打开的数据库连接. reactor 线程池在 'during' 阶段停止并等待线程结束,
+# 'after' 阶段已没有线程在使用连接
+reactor.addSystemEventTrigger('after', 'shutdown', common.SQLite.close)
 
-    service_site = server.Site(SServer(interface_manager))
-    service_endpoint = endpoints.TCP4ServerEndpoint(reactor, port=service_port, interface=service_host)
-    service_defer = service_endpoint.listen(service_site)
-    service_defer.addCallback(
-        lambda result: logging.info("\nService Server started http://%s:%s\n" % (service_host, service_port)))
-    service_defer.addErrback(
-        lambda result: logging.error("\nService Server Error http://%s:%s %s\n" %
-                                     (service_host, service_port, result.getErrorMessage())))
 
-    mgmt_site = server.Site(MServer(interface_manager))
+def _listen_mgmt(interface_manager: InterfaceManager, supervisor: WorkerSupervisor = None, service: SServer = None,
+                 watcher: InterfaceWatcher = None, cron: CronManager = None):
+    mgmt_site = server.Site(MServer(interface_manager, supervisor, service, watcher, cron))
     mgmt_endpoint = endpoints.TCP4ServerEndpoint(reactor, port=mgmt_port, interface=mgmt_host)
     mgmt_defer = mgmt_endpoint.listen(mgmt_site)
     mgmt_defer.addCallback(
@@ -47,6 +81,147 @@ def start_http_service():
         lambda result: logging.error("\nMGMT Server Error http://%s:%s %s\n" %
                                      (mgmt_host, mgmt_port, result.getErrorMessage())))
 
+
+def _start_watcher(interface_manager: InterfaceManager, supervisor: WorkerSupervisor = None):
+    """
+    配置文件中 watch_interface 为 1 时监视接口目录, 文件变化后自动增量载入, 多进程模式下同时转发给所有 worker
+    """
+    if not watch_interface:
+        return None
+
+    def reload():
+        result = interface_manager.reload_interface(trigger='watch')
+        if supervisor is not None:
+            threads.blockingCallFromThread(reactor, supervisor.broadcast,
+                                           {"command": "reload_interface", "trigger": 'watch'})
+        return result
+
+    watcher = InterfaceWatcher(interface_path, reload, debounce=watch_debounce, poll_interval=watch_poll_interval)
+    watcher.start()
+    return watcher
+
+
+def _start_access_log(suffix: str = ''):
+    """
+    配置文件 [access_log] 中 enable 为 1 时记录访问日志, 多进程模式下每个 worker 单独写文件
+    """
+    if not access_log_enable:
+        return None
+
+    access_log = AccessLog(access_log_path + suffix, sample_rate=access_log_sample_rate, slow_ms=access_log_slow_ms,
+                           buffer_size=access_log_buffer_size, flush_interval=access_log_flush_interval)
+    access_log.start()
+    return access_log
+
+
+def _start_process_pool(interface_manager: InterfaceManager) -> ProcessPool:
+    """
+    有 execution = "process" 的接口时预先启动进程池, 每次重新载入接口后整体替换
+    """
+    process_pool = ProcessPool(process_pool_size, process_max_tasks_per_child)
+
+    def on_reload(summary):
+        changed = summary["force"] or summary["added"] or summary["modified"] or summary["removed"]
+        process_pool.reload(interface_manager.has_execution(EXECUTION_PROCESS), bool(changed))
+
+    on_reload({"force": False, "added": 0, "modified": 0, "removed": 0})
+    interface_manager.add_reload_listener(on_reload)
+    reactor.addSystemEventTrigger('before', 'shutdown', process_pool.stop)
+    return process_pool
+
+
+def _start_response_cache(interface_manager: InterfaceManager) -> ResponseCache:
+    """
+    接口文件有变化时清空响应缓存
+    """
+    response_cache = ResponseCache(response_cache_entries, int(response_cache_mb * 1024 * 1024),
+                                   int(response_cache_entry_kb * 1024))
+
+    def on_reload(summary):
+        if summary["force"] or summary["added"] or summary["modified"] or summary["removed"]:
+            reactor.callFromThread(response_cache.invalidate)
+
+    interface_manager.add_reload_listener(on_reload)
+    return response_cache
+
+
+def _start_cron() -> CronManager:
+    """
+    定时任务只在主进程中运行, 多进程模式下 worker 进程不运行定时任务
+    """
+    cron = CronManager(cron_lib_path, max_workers=cron_workers)
+    cron.start()
+    return cron
+
+
+def _service_site(interface_manager: InterfaceManager, service: SServer) -> server.Site:
+    service_site = server.Site(service)
+    # 收到请求头时即匹配接口, 按接口声明处理请求正文
+    service_site.protocol = InterfaceChannel
+    service_site.requestFactory = InterfaceRequest
+    service_site.match_interface = interface_manager.match_interface
+    service_site.reject_body = service.reject_body
+    return service_site
+
+
+def start_http_service():
+    logging_init()
+
+    interface_manager = InterfaceManager(interface_path, route_cache_size=route_cache_size,
+                                         reload_workers=reload_workers)
+    interface_manager.reload_interface(trigger='startup')
+
+    if workers > 1:
+        # 多进程模式: service 端口由 worker 进程提供, 本进程只运行 MGMT 服务并管理 worker
+        supervisor = WorkerSupervisor(workers, service_host, service_port)
+        try:
+            supervisor.start()
+        except OSError as e:
+            logging.error("\nService Server Error http://%s:%s %s\n" % (service_host, service_port, e))
+            return
+        logging.info("\nService Server started http://%s:%s with %d workers\n" % (service_host, service_port, workers))
+
+        _listen_mgmt(interface_manager, supervisor, watcher=_start_watcher(interface_manager, supervisor),
+                     cron=_start_cron())
+    else:
+        service = SServer(interface_manager, _start_access_log(), Profiler(slow_request_ms),
+                          _start_process_pool(interface_manager), _start_response_cache(interface_manager))
+        service_site = _service_site(interface_manager, service)
+        service_endpoint = endpoints.TCP4ServerEndpoint(reactor, port=service_port, interface=service_host)
+        service_defer = service_endpoint.listen(service_site)
+        service_defer.addCallback(
+            lambda result: logging.info("\nService Server started http://%s:%s\n" % (service_host, service_port)))
+        service_defer.addErrback(
+            lambda result: logging.error("\nService Server Error http://%s:%s %s\n" %
+                                         (service_host, service_port, result.getErrorMessage())))
+
+        _listen_mgmt(interface_manager, service=service, watcher=_start_watcher(interface_manager), cron=_start_cron())
+
     reactor.run()
 
     logging.info("Server stopped.")
+
+
+def start_worker_service(index: int):
+    """
+    多进程模式下 worker 进程的入口, 由 WorkerSupervisor 启动
+    """
+    # 各进程分别写日志文件, 避免多进程同时轮转同一个文件
+    logging_init(suffix='.worker%d' % index)
+
+    interface_manager = InterfaceManager(interface_path, route_cache_size=route_cache_size,
+                                         reload_workers=reload_workers)
+    interface_manager.reload_interface(trigger='startup')
+
+    service = SServer(interface_manager, _start_access_log(suffix='.worker%d' % index), Profiler(slow_request_ms),
+                      _start_process_pool(interface_manager), _start_response_cache(interface_manager))
+    service_site = _service_site(interface_manager, service)
+    reactor.adoptStreamPort(WORKER_LISTEN_FD, socket.AF_INET, service_site)
+    os.close(WORKER_LISTEN_FD)
+    logging.info("\nService Worker %d started pid:%d\n" % (index, os.getpid()))
+
+    start_worker_control(interface_manager, service)
+
+    reactor.run()
+
+    logging.info("Service Worker %d stopped." % index)
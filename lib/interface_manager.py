@@ -1,15 +1,20 @@
 import os
 import sys
+import time
+import hashlib
 import importlib
+import threading
 import traceback
 import inspect
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache, cmp_to_key
 from types import FunctionType, ModuleType
 import logging
 
 from error_code import ErrorException, ERROR_INTERFACE_CHECK_MATCH_RULE, ERROR_INTERFACE_IMPORT_INTERFACE, \
-    ERROR_INTERFACE_NO_SUCH_MATCH_RULE, ERROR_INTERFACE_MATCH_RULE_EXISTED, OP_SUCCEEDED, ERROR_INTERFACE_UNKNOWN
-from lib.common import RWLock
+    ERROR_INTERFACE_NO_SUCH_MATCH_RULE, ERROR_INTERFACE_MATCH_RULE_EXISTED, OP_SUCCEEDED, ERROR_INTERFACE_UNKNOWN, \
+    ERROR_INTERFACE_EXECUTION, ERROR_INTERFACE_ATTRIBUTE
+from lib.route_trie import RouteTable
 
 
 def reload_package(package):
@@ -37,7 +42,142 @@ def reload_package(package):
                     module_visit.add(fn_child)
                     reload_recursive_ex(module_tmp)
 
-    return reload_recursive_ex(package)
+    reload_recursive_ex(package)
+    return module_visit
+
+
+def reload_entry(ee: ErrorException, tb=None, **data):
+    """
+    reload_interface/reload_cron 返回结果中的一项, data 为文件名等附加信息
+    """
+    return {
+        "status": ee.get_code(),
+        "msg": ee.get_msg(),
+        "traceback": tb,
+        "data": data
+    }
+
+
+class ReloadTracker:
+    """
+    目录下 (不含子目录) .py 文件的增量载入记录, InterfaceManager 与 CronManager 共用:
+        0.每个文件记录其依赖的文件 (文件本身及 reload_package 找到的同目录模块)
+        1.依赖的文件以 (mtime_ns, size, sha1) 为签名, scan 时以 hash_workers 个线程并行计算,
+          新增/force/依赖的文件签名有变化的文件需要重新导入
+        2.导入只能由 import_file 串行进行, importlib.reload 不能对同一模块并发执行
+        3.commit 保存本次载入后各文件的依赖, 只跟踪仍在使用的文件, 删除的文件从 sys.modules 中移除
+    只能在持有重新载入锁时使用
+    """
+
+    def __init__(self, dir_path: str, hash_workers: int = 1):
+        self.dir_path = dir_path
+        self.hash_workers = hash_workers
+        self.__files = {}  # {文件名: 依赖的文件路径}
+        self.__signatures = {}  # {文件路径: (mtime_ns, size, sha1)}
+        self.__scanned = {}  # 最近一次 scan 得到的签名
+
+    def module_name(self, name: str) -> str:
+        return f"{os.path.basename(self.dir_path)}.{name}"
+
+    def file_path(self, name: str) -> str:
+        return os.path.join(self.dir_path, name + '.py')
+
+    def list_files(self):
+        """
+        目录下的 .py 文件名 (不含扩展名), 按名称排序
+        """
+        names = []
+        for item in os.listdir(self.dir_path):
+            item_arr = item.split(".")
+            if len(item_arr) != 2 or item_arr[1] != "py":
+                continue
+            if not os.path.isfile(os.path.join(self.dir_path, item)):
+                continue
+            names.append(item_arr[0])
+        names.sort()
+        return names
+
+    @staticmethod
+    def file_signature(path: str, old=None):
+        """
+        :return: (mtime_ns, size, sha1), 文件不存在时为 None. mtime 与大小均未变化时不读取文件
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        if old is not None and old[0] == stat.st_mtime_ns and old[1] == stat.st_size:
+            return old
+
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        return stat.st_mtime_ns, stat.st_size, digest
+
+    def scan(self, names, force: bool = False):
+        """
+        比较所有已跟踪文件及 names 的签名, 返回 names 中需要重新导入的文件名
+        """
+        tracked = set(self.__signatures)
+        tracked.update(self.file_path(name) for name in names)
+        tracked = sorted(tracked)
+        olds = [self.__signatures.get(path) for path in tracked]
+        if len(tracked) > 1 and self.hash_workers > 1:
+            # 只有读取文件与计算摘要并行 (hashlib 计算时释放 GIL)
+            with ThreadPoolExecutor(max_workers=min(self.hash_workers, len(tracked))) as executor:
+                signatures = list(executor.map(self.file_signature, tracked, olds))
+        else:
+            signatures = [self.file_signature(path, old) for path, old in zip(tracked, olds)]
+
+        self.__scanned = {}
+        changed_files = set()
+        for path, old, signature in zip(tracked, olds, signatures):
+            if signature is not None:
+                self.__scanned[path] = signature
+            if old is None or signature is None or old[2] != signature[2]:
+                changed_files.add(path)
+
+        return [name for name in names
+                if force or name not in self.__files or not self.__files[name].isdisjoint(changed_files)]
+
+    def import_file(self, name: str):
+        """
+        导入 (或重新导入) 文件及其依赖的同目录模块
+        :return: (模块, 依赖的文件)
+        """
+        if self.dir_path not in sys.path:
+            sys.path.append(self.dir_path)
+        lib = importlib.import_module(self.module_name(name))
+        return lib, reload_package(lib)
+
+    def state(self, name: str) -> str:
+        """
+        重新导入的文件为 modified, 否则为 added; 须在 commit 之前调用
+        """
+        return 'modified' if name in self.__files else 'added'
+
+    def removed(self, names):
+        """
+        已载入但不在 names 中 (已删除) 的文件名, 按名称排序
+        """
+        return sorted(set(self.__files) - set(names))
+
+    def commit(self, names, files: dict):
+        """
+        :param names: 本次载入后的全部文件名
+        :param files: {文件名: 依赖的文件路径}, 本次重新导入的文件, 其余文件保留原有依赖
+        """
+        for name in set(self.__files) - set(names):
+            sys.modules.pop(self.module_name(name), None)
+        self.__files = {name: files[name] if name in files else self.__files[name] for name in names}
+
+        signatures = {}
+        for path in set().union(*self.__files.values()):
+            # 本次载入新发现的依赖模块没有 scan 得到的签名
+            signature = self.__scanned.get(path) or self.file_signature(path)
+            if signature is not None:
+                signatures[path] = signature
+        self.__signatures = signatures
 
 
 @lru_cache(maxsize=500, typed=True)
@@ -45,7 +185,6 @@ def rule_split(rule_str: str):
     return rule_str.split('/')
 
 
-@lru_cache(maxsize=1000, typed=True)
 def path_split(path_str: str):
     return path_str.split('/')
 
@@ -186,6 +325,121 @@ def match_interface_by_path(match_rule: str, real_path: str) -> bool:
                 continue
 
 
+EXECUTION_THREAD = 'thread'  # 默认, 在 reactor 线程池中执行
+EXECUTION_INLINE = 'inline'  # 直接在 reactor 线程中执行, 仅适用于不阻塞的同步函数或返回 Deferred 的函数
+EXECUTION_ASYNC = 'async'  # async def 定义的接口, 通过 asyncio reactor 在 reactor 线程中执行
+EXECUTION_PROCESS = 'process'  # 在进程池中执行, 适用于 CPU 密集的接口, 见 lib/process_pool.py
+
+REQUEST_BODY_BUFFER = 'buffer'  # 默认, 与 Twisted 一致, 小于 100KB 的正文缓冲在内存中, 否则写入临时文件
+REQUEST_BODY_FILE = 'file'  # 正文一律写入临时文件, 接口通过 lib.request_body.body_view 以 mmap 读取
+REQUEST_BODY_STREAM = 'stream'  # 不缓冲, 每收到一块正文即在 reactor 线程中调用 interface_body_chunk(request, data)
+
+
+def interface_execution(lib):
+    """
+    确定接口的执行方式:
+        0.async def 定义的 interface_function 一律为 EXECUTION_ASYNC
+        1.其余按接口文件中的 'execution' 变量, 未声明时为 EXECUTION_THREAD
+    无效时返回 None
+    """
+    if inspect.iscoroutinefunction(lib.interface_function):
+        return EXECUTION_ASYNC
+
+    execution = getattr(lib, 'execution', EXECUTION_THREAD)
+    if execution not in (EXECUTION_THREAD, EXECUTION_INLINE, EXECUTION_PROCESS):
+        return None
+
+    return execution
+
+
+def check_interface_attribute(lib) -> bool:
+    """
+    校验接口文件中声明的可选参数:
+        max_concurrency     正整数, 接口最大并发数, 未声明时不限制
+        queue_limit         非负整数, 并发已满时的等待队列长度, 默认 0, 仅在声明了 max_concurrency 时生效
+        max_body_size       非负整数, 请求正文的最大字节数, 未声明时不限制
+        request_body        正文接收方式 REQUEST_BODY_*, 默认 REQUEST_BODY_BUFFER,
+                            为 REQUEST_BODY_STREAM 时须同时定义 interface_body_chunk 函数
+        cache_ttl           正数, GET/HEAD 响应的缓存秒数, 未声明时不缓存, 见 lib/response_cache.py
+        cache_args          str 的 list/tuple, 参与缓存键的查询参数, 未声明时全部参与
+        cache_headers       str 的 list/tuple, 参与缓存键的请求头, 默认不包含请求头
+        compress            bool, 是否按 Accept-Encoding 压缩响应, 默认 True, 见 lib/compression.py
+    """
+    max_concurrency = getattr(lib, 'max_concurrency', None)
+    if max_concurrency is not None and (type(max_concurrency) is not int or max_concurrency <= 0):
+        return False
+
+    queue_limit = getattr(lib, 'queue_limit', 0)
+    if type(queue_limit) is not int or queue_limit < 0:
+        return False
+
+    max_body_size = getattr(lib, 'max_body_size', None)
+    if max_body_size is not None and (type(max_body_size) is not int or max_body_size < 0):
+        return False
+
+    request_body = getattr(lib, 'request_body', REQUEST_BODY_BUFFER)
+    if request_body not in (REQUEST_BODY_BUFFER, REQUEST_BODY_FILE, REQUEST_BODY_STREAM):
+        return False
+
+    if request_body == REQUEST_BODY_STREAM and not isinstance(getattr(lib, 'interface_body_chunk', None), FunctionType):
+        return False
+
+    cache_ttl = getattr(lib, 'cache_ttl', None)
+    if cache_ttl is not None and (type(cache_ttl) not in (int, float) or cache_ttl <= 0):
+        return False
+
+    if type(getattr(lib, 'compress', True)) is not bool:
+        return False
+
+    for name in ('cache_args', 'cache_headers'):
+        value = getattr(lib, name, None)
+        if value is not None and (not isinstance(value, (list, tuple)) or
+                                  not all(isinstance(item, str) for item in value)):
+            return False
+
+    return True
+
+
+class Interface:
+    """
+    已载入的接口, 由接口文件解析而来
+    """
+    __slots__ = ('match_rule', 'module', 'function', 'execution', 'max_concurrency', 'queue_limit',
+                 'max_body_size', 'request_body', 'body_chunk', 'cache_ttl', 'cache_args', 'cache_headers',
+                 'compress')
+
+    def __init__(self, lib):
+        self.match_rule = lib.match_rule
+        self.module = lib
+        self.function = lib.interface_function
+        self.execution = interface_execution(lib)
+        self.max_concurrency = getattr(lib, 'max_concurrency', None)
+        self.queue_limit = getattr(lib, 'queue_limit', 0)
+        self.max_body_size = getattr(lib, 'max_body_size', None)
+        self.request_body = getattr(lib, 'request_body', REQUEST_BODY_BUFFER)
+        self.body_chunk = getattr(lib, 'interface_body_chunk', None)
+        self.cache_ttl = getattr(lib, 'cache_ttl', None)
+        # 与 request.args/requestHeaders 一致使用 bytes, cache_args 为 None 时全部查询参数参与缓存键
+        cache_args = getattr(lib, 'cache_args', None)
+        self.cache_args = None if cache_args is None else tuple(name.encode() for name in cache_args)
+        self.cache_headers = tuple(name.lower().encode() for name in getattr(lib, 'cache_headers', None) or ())
+        self.compress = getattr(lib, 'compress', True)
+
+
+class _LoadedFile:
+    """
+    单个接口文件的载入结果
+    """
+    __slots__ = ('name', 'interface', 'result', 'files', 'elapsed')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.interface = None  # 校验通过的 Interface
+        self.result = None  # 校验未通过时的结果
+        self.files = set()  # 接口文件及其依赖的同目录模块的路径
+        self.elapsed = 0.0
+
+
 class InterfaceManager:
     """
     路径匹配模式 -- 只匹配,不负责解析传参
@@ -210,25 +464,117 @@ class InterfaceManager:
               /path               no
     遵循 最长路径优先 规则。当路径长度相同时，继而遵循 绝对匹配 > 参数匹配 > 前缀匹配 的规则。
     """
-    __rw_lock = RWLock()
     __interface_dir_path = ''
-    __interface_list = []
 
-    def __init__(self, interface_dir_path: str):
+    def __init__(self, interface_dir_path: str, route_cache_size: int = 1000, reload_workers: int = 4):
         self.__interface_dir_path = interface_dir_path
+        self.__route_cache_size = route_cache_size
+        # 接口文件及其依赖的同目录模块的签名, reload_workers 为并行计算签名的线程数, 导入接口文件始终串行
+        self.__tracker = ReloadTracker(interface_dir_path, hash_workers=reload_workers)
+        # {接口文件名: _LoadedFile}, 上次载入的结果
+        self.__loaded = {}
+        # 路由表快照, 只通过整体替换来更新, 读者无需加锁
+        self.__route_table = RouteTable()
+        # 仅用于串行化 reload_interface, 不影响请求匹配
+        self.__reload_lock = threading.Lock()
+        self.__last_reload = None
+        # 每次载入完成后以 last_reload 的结果调用, 在执行 reload_interface 的线程中
+        self.__reload_listeners = []
 
     def list_interface(self):
-        self.__rw_lock.read_acquire()
-        interface_list = []
+        return self.__route_table.match_rules()
+
+    def route_cache_stats(self):
+        return self.__route_table.cache_stats()
+
+    def reload_interface(self, force: bool = False, trigger: str = 'manual'):
+        """
+        增量重新载入: 只重新导入新增/修改过的接口文件 (及其依赖的同目录模块有修改的接口文件), 删除的文件直接移除.
+        force 为 True 时重新导入全部接口文件.
+        trigger 为触发来源 (startup/manual/watch), 记录在 last_reload 中.
+        """
+        with self.__reload_lock:
+            started_at = time.time()
+            result = self.__reload_interface(force)
+            self.__last_reload = {
+                "time": started_at,
+                "elapsed": round(time.time() - started_at, 6),
+                "trigger": trigger,
+                "force": force,
+                "interfaces": len(self.__route_table),
+                "added": sum(1 for entry in result if entry.get("state") == 'added'),
+                "modified": sum(1 for entry in result if entry.get("state") == 'modified'),
+                "removed": sum(1 for entry in result if entry.get("state") == 'removed'),
+                "errors": [entry for entry in result if entry["status"] != OP_SUCCEEDED[0]],
+            }
+            for listener in self.__reload_listeners:
+                try:
+                    listener(self.__last_reload)
+                except (Exception,):
+                    logging.error('Reload listener failed\n %s' % traceback.format_exc())
+            return result
+
+    def add_reload_listener(self, listener):
+        self.__reload_listeners.append(listener)
+
+    def has_execution(self, execution: str) -> bool:
+        """
+        当前是否有以 execution 方式执行的接口
+        """
+        return any(loaded.interface is not None and loaded.interface.execution == execution
+                   for loaded in self.__loaded.values())
+
+    def last_reload(self):
+        """
+        最近一次 reload_interface 的时间与结果摘要, 尚未载入时为 None
+        """
+        return self.__last_reload
+
+    def __load_interface_file(self, name: str):
+        """
+        导入 (或重新导入) 单个接口文件并校验. 多个接口文件可能共用同目录的模块, 而 importlib.reload
+        不能对同一模块并发执行, 因此只能在持有 reload 锁时串行调用
+        """
+        started_at = time.perf_counter()
+        loaded = _LoadedFile(name)
+
         try:
-            for interface in self.__interface_list:
-                interface_list.append(interface[0])
-        finally:
-            self.__rw_lock.read_release()
+            lib, loaded.files = self.__tracker.import_file(name)
+        except (BaseException,):
+            ee = ErrorException(ERROR_INTERFACE_IMPORT_INTERFACE)
+            tb = traceback.format_exc()
+            logging.error('Load interface file failed name:%s\n %s' % (name, tb))
+            loaded.result = reload_entry(ee, tb, interface_file=name, match_rule=None)
+            loaded.files = {self.__tracker.file_path(name)}
+            loaded.elapsed = time.perf_counter() - started_at
+            return loaded
+
+        if lib is None:
+            pass
+        elif hasattr(lib, 'match_rule') and isinstance(lib.match_rule, str):
+            lib.match_rule = lib.match_rule.strip()
+            if isinstance(getattr(lib, 'interface_function', None), FunctionType):
+                if not check_match_rule(lib.match_rule):
+                    ee = ErrorException(ERROR_INTERFACE_CHECK_MATCH_RULE)
+                elif interface_execution(lib) is None:
+                    ee = ErrorException(ERROR_INTERFACE_EXECUTION)
+                elif not check_interface_attribute(lib):
+                    ee = ErrorException(ERROR_INTERFACE_ATTRIBUTE)
+                else:
+                    # 是否与其它接口的 match_rule 重复在全部载入后统一判断
+                    ee = None
+                    loaded.interface = Interface(lib)
+                if ee is not None:
+                    loaded.result = reload_entry(ee, interface_file=name, match_rule=lib.match_rule)
+        else:
+            ee = ErrorException(ERROR_INTERFACE_NO_SUCH_MATCH_RULE)
+            logging.debug('Interface file has no match_rule name:%s module:%s', name, lib)
+            loaded.result = reload_entry(ee, interface_file=name, match_rule=None)
 
-        return interface_list
+        loaded.elapsed = time.perf_counter() - started_at
+        return loaded
 
-    def reload_interface(self):
+    def __reload_interface(self, force: bool):
         reload_result = []
         # [{
         #     "status":0,
@@ -237,128 +583,73 @@ class InterfaceManager:
         #     "data":{
         #         "interface_file":"test_c",
         #         "match_rule":""
-        #     }
+        #     },
+        #     "state":"modified",       # added/modified/unchanged/removed
+        #     "elapsed":0.0123          # 本次载入该文件的耗时 (秒), 未变化的文件为 0
         # }, ...]
 
+        tracker = self.__tracker
         try:
-            if self.__interface_dir_path not in sys.path:
-                sys.path.append(self.__interface_dir_path)
+            names = tracker.list_files()
+            dirty = tracker.scan(names, force)
+
+            loaded_dic = {name: self.__loaded[name] for name in names if name in self.__loaded}
+            states = {}
+            for name in dirty:
+                states[name] = tracker.state(name)
+                loaded_dic[name] = self.__load_interface_file(name)
 
             lib_dic = {}
+            for name in names:
+                loaded = loaded_dic[name]
+                state = states.get(name, 'unchanged')
+                elapsed = 0 if state == 'unchanged' else loaded.elapsed
+
+                if loaded.interface is not None:
+                    match_rule = loaded.interface.match_rule
+                    if match_rule in lib_dic:
+                        entry = reload_entry(ErrorException(ERROR_INTERFACE_MATCH_RULE_EXISTED),
+                                             interface_file=name, match_rule=match_rule)
+                    else:
+                        lib_dic[match_rule] = loaded.interface
+                        entry = reload_entry(ErrorException(OP_SUCCEEDED), interface_file=name, match_rule=match_rule)
+                elif loaded.result is not None:
+                    entry = dict(loaded.result)
+                else:
+                    continue
 
-            # 获取路径
-            for top, dirs, not_dirs in os.walk(self.__interface_dir_path, topdown=False):
-                if top == self.__interface_dir_path:
-                    for item in not_dirs:
-                        item_arr = item.split(".")
-                        if len(item_arr) != 2:
-                            continue
-                        if item_arr[1] != "py":
-                            continue
-
-                        try:
-                            model_filename = f"{os.path.basename(self.__interface_dir_path)}.{item_arr[0]}"
-                            lib = importlib.import_module(model_filename)
-
-                            reload_package(lib)
-                        except (BaseException,):
-                            ee = ErrorException(ERROR_INTERFACE_IMPORT_INTERFACE)
-                            print(traceback.format_exc())
-                            reload_result.append({
-                                "status": ee.get_code(),
-                                "msg": ee.get_msg(),
-                                "traceback": traceback.format_exc(),
-                                "data": {
-                                    "interface_file": item_arr[0],
-                                    "match_rule": None}
-                            })
-                            continue
-
-                        if lib is None:
-                            continue
-
-                        if hasattr(lib, 'match_rule') and isinstance(lib.match_rule, str):
-                            lib.match_rule = lib.match_rule.strip()
-                            if isinstance(getattr(lib, 'interface_function', None), FunctionType):
-                                if not check_match_rule(lib.match_rule):
-                                    ee = ErrorException(ERROR_INTERFACE_CHECK_MATCH_RULE)
-                                    reload_result.append({
-                                        "status": ee.get_code(),
-                                        "msg": ee.get_msg(),
-                                        "traceback": None,
-                                        "data": {
-                                            "interface_file": item_arr[0],
-                                            "match_rule": lib.match_rule}
-                                    })
-                                else:
-                                    if lib.match_rule in lib_dic:
-                                        ee = ErrorException(ERROR_INTERFACE_MATCH_RULE_EXISTED)
-                                        reload_result.append({
-                                            "status": ee.get_code(),
-                                            "msg": ee.get_msg(),
-                                            "traceback": None,
-                                            "data": {
-                                                "interface_file": item_arr[0],
-                                                "match_rule": lib.match_rule}
-                                        })
-                                    else:
-                                        lib_dic[lib.match_rule] = lib
-                                        ee = ErrorException(OP_SUCCEEDED)
-                                        reload_result.append({
-                                            "status": ee.get_code(),
-                                            "msg": ee.get_msg(),
-                                            "traceback": None,
-                                            "data": {
-                                                "interface_file": item_arr[0],
-                                                "match_rule": lib.match_rule}
-                                        })
-                        else:
-                            ee = ErrorException(ERROR_INTERFACE_NO_SUCH_MATCH_RULE)
-                            print(lib)
-                            reload_result.append({
-                                "status": ee.get_code(),
-                                "msg": ee.get_msg(),
-                                "traceback": None,
-                                "data": {
-                                    "interface_file": item_arr[0],
-                                    "match_rule": None}
-                            })
+                entry["state"] = state
+                entry["elapsed"] = round(elapsed, 6)
+                reload_result.append(entry)
+
+            for name in tracker.removed(names):
+                # 接口文件已删除
+                interface = self.__loaded[name].interface
+                entry = reload_entry(ErrorException(OP_SUCCEEDED), interface_file=name,
+                                     match_rule=interface.match_rule if interface is not None else None)
+                entry["state"] = 'removed'
+                entry["elapsed"] = 0
+                reload_result.append(entry)
         except(BaseException,):
             logging.error(traceback.format_exc())
-            ee = ErrorException(ERROR_INTERFACE_UNKNOWN)
-            reload_result.append({
-                "status": ee.get_code(),
-                "msg": ee.get_msg(),
-                "traceback": traceback.format_exc(),
-                "data": {
-                    "interface_file": None,
-                    "match_rule": None}
-            })
+            reload_result.append(reload_entry(ErrorException(ERROR_INTERFACE_UNKNOWN), traceback.format_exc(),
+                                              interface_file=None, match_rule=None))
         else:
             match_rule_list = list(lib_dic.keys())
             match_rule_list.sort(key=cmp_to_key(compare_match_rule))
 
-            self.__rw_lock.write_acquire()
-            try:
-                self.match_interface.cache_clear()
-                self.__interface_list.clear()
-                for match_rule in match_rule_list:
-                    self.__interface_list.append((match_rule, lib_dic[match_rule]))
-            finally:
-                self.__rw_lock.write_release()
+            # 新路由表在锁外构建完成, 随后一次引用赋值发布
+            route_table = RouteTable(((match_rule, lib_dic[match_rule]) for match_rule in match_rule_list),
+                                     cache_size=self.__route_cache_size)
+            self.__route_table = route_table
+
+            self.__loaded = {name: loaded_dic[name] for name in names}
+            tracker.commit(names, {name: loaded_dic[name].files for name in dirty})
         finally:
             return reload_result
 
-    @lru_cache(maxsize=500, typed=True)
     def match_interface(self, real_path: str):
-        self.__rw_lock.read_acquire()
-        m = None
-        try:
-            for interface in self.__interface_list:
-                if match_interface_by_path(interface[0], real_path):
-                    m = getattr(interface[1], 'interface_function', None)
-                    break
-        finally:
-            self.__rw_lock.read_release()
-
-        return m
+        """
+        返回匹配到的 Interface, 未匹配返回 None
+        """
+        return self.__route_table.lookup(real_path)
@@ -0,0 +1,158 @@
+"""
+监视接口目录, 文件变化后自动执行增量的 reload_interface.
+
+    0.Linux 下使用 inotify (twisted.internet.inotify), 否则通过 common.set_interval 按间隔轮询 .py 文件的 mtime/大小
+    1.连续的变化在 debounce 秒内合并为一次载入; 载入过程中发生的变化在本次载入结束后再触发一次
+    2.载入在线程池中执行, 不阻塞 reactor 线程
+"""
+import logging
+import os
+import time
+import traceback
+
+from twisted.internet import reactor, threads
+from twisted.python.filepath import FilePath
+
+from lib.common import set_interval
+
+try:
+    from twisted.internet import inotify
+except ImportError:
+    inotify = None
+
+WATCH_MODE_INOTIFY = 'inotify'
+WATCH_MODE_POLL = 'poll'
+
+
+def _is_source(path: str) -> bool:
+    return path.endswith('.py') and '__pycache__' not in path
+
+
+def _snapshot(dir_path: str):
+    """
+    {路径: (mtime_ns, size)}, 只包含 .py 文件
+    """
+    result = {}
+    for top, dirs, files in os.walk(dir_path):
+        dirs[:] = [item for item in dirs if item != '__pycache__']
+        for item in files:
+            if not item.endswith('.py'):
+                continue
+            path = os.path.join(top, item)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            result[path] = (stat.st_mtime_ns, stat.st_size)
+    return result
+
+
+class InterfaceWatcher:
+    """
+    reload 为无参函数, 在线程池中执行, 返回 reload_interface 的结果.
+    除 status 外只能在 reactor 线程中使用.
+    """
+
+    def __init__(self, dir_path: str, reload, debounce: float = 1.0, poll_interval: float = 2.0):
+        self.dir_path = dir_path
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.mode = None
+        self.__reload = reload
+        self.__timer = None
+        self.__reloading = False
+        self.__pending = False
+        self.__notifier = None
+        self.__poll_stopped = None
+        self.__changes = 0
+        self.__reloads = 0
+        self.__last_change = None
+
+    def start(self) -> str:
+        if inotify is not None:
+            try:
+                notifier = inotify.INotify()
+                notifier.startReading()
+                notifier.watch(FilePath(self.dir_path), mask=inotify.IN_MODIFY | inotify.IN_CREATE | inotify.IN_DELETE |
+                               inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_CLOSE_WRITE,
+                               autoAdd=True, callbacks=[self.__on_inotify], recursive=True)
+            except (Exception,):
+                logging.warning('Interface watcher inotify unavailable, fall back to polling\n %s' %
+                                traceback.format_exc())
+            else:
+                self.__notifier = notifier
+                self.mode = WATCH_MODE_INOTIFY
+
+        if self.mode is None:
+            self.__start_poll()
+            self.mode = WATCH_MODE_POLL
+
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        logging.info('Interface watcher started path:%s mode:%s' % (self.dir_path, self.mode))
+        return self.mode
+
+    def __start_poll(self):
+        last = [_snapshot(self.dir_path)]
+
+        @set_interval(self.poll_interval)
+        def poll():
+            current = _snapshot(self.dir_path)
+            if current != last[0]:
+                last[0] = current
+                reactor.callFromThread(self.__changed)
+
+        self.__poll_stopped = poll()
+
+    def stop(self):
+        if self.__notifier is not None:
+            self.__notifier.loseConnection()
+            self.__notifier = None
+        if self.__poll_stopped is not None:
+            self.__poll_stopped.set()
+            self.__poll_stopped = None
+        if self.__timer is not None and self.__timer.active():
+            self.__timer.cancel()
+        self.__timer = None
+
+    def __on_inotify(self, ignored, file_path, mask):
+        if _is_source(os.fsdecode(file_path.path)):
+            self.__changed()
+
+    def __changed(self):
+        self.__changes += 1
+        self.__last_change = time.time()
+        if self.__timer is not None and self.__timer.active():
+            self.__timer.reset(self.debounce)
+        else:
+            self.__timer = reactor.callLater(self.debounce, self.__fire)
+
+    def __fire(self):
+        self.__timer = None
+        if self.__reloading:
+            # 本次载入结束后再载入一次
+            self.__pending = True
+            return
+
+        self.__reloading = True
+        self.__reloads += 1
+        d = threads.deferToThread(self.__reload)
+        d.addErrback(lambda failure: logging.error('Interface watcher reload failed\n %s' % failure.getTraceback()))
+        d.addBoth(self.__reloaded)
+
+    def __reloaded(self, _):
+        self.__reloading = False
+        if self.__pending:
+            self.__pending = False
+            self.__fire()
+
+    def status(self):
+        return {
+            "mode": self.mode,
+            "path": self.dir_path,
+            "debounce": self.debounce,
+            "poll_interval": self.poll_interval if self.mode == WATCH_MODE_POLL else None,
+            "changes": self.__changes,
+            "reloads": self.__reloads,
+            "last_change": self.__last_change,
+            "reloading": self.__reloading,
+        }
@@ -0,0 +1,58 @@
+"""
+JSON 编解码, 安装了 orjson 时默认使用 orjson, 否则使用标准库 json.
+
+    dumps(obj) -> bytes     输出为 UTF-8 编码的紧凑 JSON
+    loads(data)             data 可以是 bytes 或 str
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND_AUTO = 'auto'
+BACKEND_ORJSON = 'orjson'
+BACKEND_JSON = 'json'
+
+
+def __json_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode(encoding='utf_8')
+
+
+def __json_loads(data):
+    return json.loads(data)
+
+
+def __orjson_dumps(obj) -> bytes:
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # orjson 不支持的类型 (如超过 64 位的整数), 退回标准库
+        return __json_dumps(obj)
+
+
+def __orjson_loads(data):
+    return orjson.loads(data)
+
+
+dumps = __json_dumps
+loads = __json_loads
+backend = BACKEND_JSON
+
+
+def set_backend(name: str = BACKEND_AUTO) -> str:
+    """
+    切换 JSON 后端, 返回实际使用的后端名称. 指定 orjson 但未安装时使用标准库.
+    """
+    global dumps, loads, backend
+
+    if name in (BACKEND_AUTO, BACKEND_ORJSON, '') and orjson is not None:
+        dumps, loads, backend = __orjson_dumps, __orjson_loads, BACKEND_ORJSON
+    else:
+        dumps, loads, backend = __json_dumps, __json_loads, BACKEND_JSON
+
+    return backend
+
+
+set_backend()
@@ -0,0 +1,172 @@
+"""
+KeyValueStore 的异步接口, 用于 async 接口函数 (execution = "async") 和 Deferred 代码:
+    0.读操作在专用的读线程池中并发执行, 每个线程使用 KeyValueStore 的独立读连接
+    1.写操作进入队列, 由唯一的写线程取出; 连续的 set/bulk 合并为一次 update (executemany) 提交,
+      合并提交失败时逐个重试, 只有出错的 set/bulk 以异常结束
+    2.在 asyncio 事件循环中调用时返回 asyncio.Future, 可以直接 await;
+      Deferred 代码中以 AsyncKeyValueStore.deferred(kv.get(key)) 转换为 Deferred
+    3.在事件循环之外 (如线程池中的接口) 调用时返回 concurrent.futures.Future
+
+注: 未 await 的 set 之后立即 get 不保证读到新值
+"""
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from twisted.internet.defer import Deferred
+
+_WRITE_SET = 'set'
+_WRITE_DELETE = 'delete'
+_WRITE_FLUSH = 'flush'
+
+
+class AsyncKeyValueStore:
+    """
+    :param store: KeyValueStore 或 CachedKeyValueStore
+    :param readers: 读线程数
+    """
+
+    def __init__(self, store, readers: int = 4):
+        self.store = store
+        self.__readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='kv-async-reader')
+        self.__writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kv-async-writer')
+        self.__lock = threading.Lock()
+        self.__queue = []  # [(kind, payload, Future), ...]
+        self.__draining = False
+        self.__closed = False
+        self.writes = 0
+        self.batches = 0
+
+    @staticmethod
+    def __wrap(future: Future):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return future
+        return asyncio.wrap_future(future, loop=loop)
+
+    @staticmethod
+    def deferred(future) -> Deferred:
+        """
+        把本类方法返回的 Future 转换为 Deferred
+        """
+        if isinstance(future, Future):
+            future = asyncio.wrap_future(future)
+        return Deferred.fromFuture(future)
+
+    def __read(self, fun, *args):
+        if self.__closed:
+            raise RuntimeError('AsyncKeyValueStore is closed')
+        return self.__wrap(self.__readers.submit(fun, *args))
+
+    def __write(self, kind, payload):
+        future = Future()
+        with self.__lock:
+            if self.__closed:
+                raise RuntimeError('AsyncKeyValueStore is closed')
+            self.__queue.append((kind, payload, future))
+            if not self.__draining:
+                self.__draining = True
+                self.__writer.submit(self.__drain)
+        return self.__wrap(future)
+
+    def __drain(self):
+        while True:
+            with self.__lock:
+                batch, self.__queue = self.__queue, []
+                if not batch:
+                    self.__draining = False
+                    return
+
+            # 按顺序执行, 连续的 set 合并为一次 update
+            index = 0
+            while index < len(batch):
+                kind = batch[index][0]
+                end = index + 1
+                if kind == _WRITE_SET:
+                    while end < len(batch) and batch[end][0] == _WRITE_SET:
+                        end += 1
+                self.__apply(kind, batch[index:end])
+                index = end
+
+    def __execute(self, kind, ops):
+        if kind == _WRITE_SET:
+            items = []
+            for _, payload, _ in ops:
+                items.extend(payload)
+            self.store.update(items)
+            self.writes += len(items)
+        elif kind == _WRITE_DELETE:
+            del self.store[ops[0][1]]
+            self.writes += 1
+        else:
+            self.store.flush()
+        self.batches += 1
+
+    def __apply(self, kind, ops):
+        try:
+            self.__execute(kind, ops)
+        except BaseException as e:
+            if len(ops) > 1:
+                # 合并的 update 整体回滚, 逐个重试, 只让出错的调用方收到异常
+                for op in ops:
+                    self.__apply(kind, [op])
+                return
+            for _, _, future in ops:
+                future.set_exception(e)
+        else:
+            for _, _, future in ops:
+                future.set_result(None)
+
+    def get(self, key, default=None):
+        return self.__read(self.store.get, key, default)
+
+    def get_many(self, keys):
+        return self.__read(self.store.get_many, list(keys))
+
+    def scan_prefix(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        """
+        返回 [(key, value), ...], 按 key 排序
+        """
+        return self.__read(self.store.items, prefix, case_sensitivity, limit, start_after)
+
+    def set(self, key, value):
+        return self.__write(_WRITE_SET, ((key, value),))
+
+    def bulk(self, items):
+        """
+        批量写入, items 为 dict 或 [(key, value), ...]
+        """
+        items = list(items.items() if hasattr(items, 'items') else items)
+        return self.__write(_WRITE_SET, items)
+
+    def delete(self, key):
+        """
+        key 不存在时 Future 的异常为 KeyError
+        """
+        return self.__write(_WRITE_DELETE, key)
+
+    def flush(self):
+        """
+        等待此前的全部写操作提交
+        """
+        return self.__write(_WRITE_FLUSH, None)
+
+    def close(self):
+        """
+        等待队列中的写操作完成后关闭线程池, 不关闭 store
+        """
+        with self.__lock:
+            self.__closed = True
+        self.__writer.shutdown(wait=True)
+        self.__readers.shutdown(wait=True)
+
+    def stats(self):
+        with self.__lock:
+            queued = len(self.__queue)
+        return {
+            "queued": queued,
+            "writes": self.writes,
+            "batches": self.batches,
+            "store": self.store.stats(),
+        }
@@ -0,0 +1,234 @@
+"""
+KeyValueStore 前的进程内读缓存 (read-through):
+    0.LRU 淘汰, 可选 TTL; 不存在的 key 同样缓存 (negative caching), 可单独设置 negative_ttl
+    1.经由本对象的写操作 (__setitem__/update/insert/__delitem__) 在写入后使对应的缓存失效;
+      绕过本对象直接写 KeyValueStore 时须自行调用 invalidate
+    2.可以在多个线程中共享
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from lib.sqlitekeyvaluestore import KeyValueStore
+
+# 缓存中表示 key 不存在
+_MISSING = object()
+
+
+class CachedKeyValueStore:
+    """
+    :param store: 被缓存的 KeyValueStore
+    :param capacity: 最多缓存的 key 数 (包括不存在的 key)
+    :param ttl: 缓存的有效秒数, None 为不过期
+    :param negative_ttl: 不存在的 key 的有效秒数, 默认与 ttl 相同, 0 为不缓存不存在的 key
+    """
+
+    def __init__(self, store: KeyValueStore, capacity: int = 10000, ttl: float = None, negative_ttl: float = None):
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+
+        self.store = store
+        self.__capacity = capacity
+        self.__ttl = ttl
+        self.__negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.__data = OrderedDict()  # {key: (value, expire)}
+        self.__lock = threading.Lock()
+        # 每次写入后递增; 读取期间发生过写入时不缓存读到的值, 避免把旧值写回缓存
+        self.__generation = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __lookup(self, key):
+        """
+        返回缓存的值 (不存在的 key 为 _MISSING), 未缓存或已过期返回 None
+        """
+        with self.__lock:
+            entry = self.__data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expire = entry
+            if expire is not None and expire <= time.monotonic():
+                del self.__data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.__data.move_to_end(key)
+            if value is _MISSING:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+    def __store(self, generation, items):
+        """
+        items: [(key, value), ...], value 为 _MISSING 表示不存在
+        """
+        now = time.monotonic()
+        with self.__lock:
+            if generation != self.__generation:
+                return
+
+            data = self.__data
+            for key, value in items:
+                ttl = self.__negative_ttl if value is _MISSING else self.__ttl
+                if ttl is not None and ttl <= 0:
+                    continue
+                data[key] = (value, None if ttl is None else now + ttl)
+                data.move_to_end(key)
+
+            while len(data) > self.__capacity:
+                data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys=None):
+        """
+        使指定的 key 失效, keys 为 None 时清空缓存
+        """
+        with self.__lock:
+            self.__generation += 1
+            if keys is None:
+                self.invalidations += len(self.__data)
+                self.__data.clear()
+                return
+
+            for key in keys:
+                if self.__data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def __getitem__(self, key):
+        value = self.__lookup(key)
+        if value is None:
+            generation = self.__generation
+            try:
+                value = self.store[key]
+            except KeyError:
+                value = _MISSING
+            self.__store(generation, ((key, value),))
+
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get_many(self, keys) -> dict:
+        """
+        批量读取, 未缓存的 key 以一次 KeyValueStore.get_many 读取
+        """
+        result = {}
+        lookup = []
+        for key in dict.fromkeys(keys):
+            value = self.__lookup(key)
+            if value is None:
+                lookup.append(key)
+            elif value is not _MISSING:
+                result[key] = value
+
+        if lookup:
+            generation = self.__generation
+            found = self.store.get_many(lookup)
+            self.__store(generation, [(key, found.get(key, _MISSING)) for key in lookup])
+            result.update(found)
+        return result
+
+    def __setitem__(self, key, value):
+        try:
+            self.store[key] = value
+        finally:
+            self.invalidate((key,))
+
+    def update(self, other=(), **kwargs):
+        items = list(other.items() if hasattr(other, 'items') else other)
+        items.extend(kwargs.items())
+        try:
+            self.store.update(items)
+        finally:
+            self.invalidate([key for key, _ in items])
+
+    def insert(self, key, value):
+        try:
+            self.store.insert(key, value)
+        finally:
+            self.invalidate((key,))
+
+    def __delitem__(self, key):
+        try:
+            del self.store[key]
+        finally:
+            self.invalidate((key,))
+
+    # 以下操作不经过缓存
+
+    def iterkeys(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        return self.store.iterkeys(prefix, case_sensitivity, limit, start_after)
+
+    def itervalues(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        return self.store.itervalues(prefix, case_sensitivity, limit, start_after)
+
+    def iteritems(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        return self.store.iteritems(prefix, case_sensitivity, limit, start_after)
+
+    def keys(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        return self.store.keys(prefix, case_sensitivity, limit, start_after)
+
+    def values(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        return self.store.values(prefix, case_sensitivity, limit, start_after)
+
+    def items(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        return self.store.items(prefix, case_sensitivity, limit, start_after)
+
+    def __iter__(self):
+        return self.store.iterkeys()
+
+    def __len__(self):
+        return len(self.store)
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.invalidate()
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.flush()
+
+    def stats(self):
+        with self.__lock:
+            size = len(self.__data)
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "capacity": self.__capacity,
+            "size": size,
+            "ttl": self.__ttl,
+            "negative_ttl": self.__negative_ttl,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "store": self.store.stats(),
+        }
@@ -1,10 +1,26 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
+from lib import json_tool
 from lib.conf_tool import http_conf
 
 log_level_set = {'debug', 'error', 'warning', 'critical', 'info'}
 
+LOG_FORMAT_TEXT = 'text'
+LOG_FORMAT_JSON = 'json'
+
+# 异步日志队列满时的处理方式
+DROP_NEW = 'drop_new'  # 丢弃新的日志
+DROP_OLD = 'drop_old'  # 丢弃队列中最早的日志
+DROP_BLOCK = 'block'  # 等待队列有空位, 不丢弃
+drop_policy_set = {DROP_NEW, DROP_OLD, DROP_BLOCK}
+
+_listener = None
+_handler = None
+
 
 def switch_log_level(log_level):
     if log_level == 'debug':
@@ -19,16 +35,126 @@ def switch_log_level(log_level):
         return logging.INFO
 
 
-def logging_init():
-    filename = http_conf.get('log', "log_path")
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志输出为一行 json
+    """
+
+    def format(self, record):
+        obj = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "thread": record.thread,
+            "module": record.module,
+            "func": record.funcName,
+            "line": record.lineno,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            obj["exc"] = record.exc_text
+        if record.stack_info:
+            obj["stack"] = record.stack_info
+        return json_tool.dumps(obj).decode()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    有界队列的 QueueHandler, 队列满时按 drop_policy 处理.
+    只在调用线程中合并 msg 与 args, 时间格式化与异常堆栈的格式化都在 QueueListener 线程中进行.
+    """
+
+    def __init__(self, log_queue: queue.Queue, drop_policy: str = DROP_NEW):
+        super().__init__(log_queue)
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self.__dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # args 可能在之后被修改, 须在调用线程中合并; exc_info 保留到输出线程再格式化
+        msg = record.getMessage()
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = msg
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.drop_policy == DROP_BLOCK:
+            self.queue.put(record)
+            return
+
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        with self.__dropped_lock:
+            self.dropped += 1
+        if self.drop_policy == DROP_OLD:
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                pass
+
+
+def logging_init(suffix: str = ''):
+    """
+    log_async 为 1 时日志先进入有界队列, 由单独的线程写入文件, 调用线程不做文件 I/O 和轮转
+    """
+    global _listener, _handler
+
+    filename = http_conf.get('log', "log_path") + suffix
     max_bytes = int(http_conf.get('log', "log_max_MB")) * 1024 * 1024
     backup_count = int(http_conf.get('log', "log_backup_count"))
+    log_async = int(http_conf.get('log', "log_async") or 0)
+    queue_size = int(http_conf.get('log', "log_queue_size") or 10000)
+    drop_policy = http_conf.get('log', "log_drop_policy") or DROP_NEW
+    log_format = http_conf.get('log', "log_format") or LOG_FORMAT_TEXT
+
+    if drop_policy not in drop_policy_set:
+        raise ValueError('log_drop_policy must be one of %s' % sorted(drop_policy_set))
 
     handler = RotatingFileHandler(filename=filename, maxBytes=max_bytes, backupCount=backup_count)
 
     log_level = switch_log_level(http_conf.get('log', "log_level"))
     log_fmt = '%(asctime)s %(levelname)s-%(thread)d-%(module)s-%(funcName)s-%(lineno)d:%(message)s'
     date_fmt = '%Y-%m-%d %H:%M:%S'
+    if log_format == LOG_FORMAT_JSON:
+        handler.setFormatter(JsonFormatter(datefmt=date_fmt))
+    else:
+        handler.setFormatter(logging.Formatter(log_fmt, date_fmt))
+
+    if log_async:
+        _handler = DroppingQueueHandler(queue.Queue(queue_size), drop_policy)
+        _listener = QueueListener(_handler.queue, handler, respect_handler_level=True)
+        _listener.start()
+        # 退出前写完队列中的日志
+        atexit.register(logging_stop)
+        handler = _handler
+
+    logging.basicConfig(level=log_level, handlers=[handler])
+
+
+def logging_stop():
+    """
+    停止异步日志线程, 队列中的日志写完后返回
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
-    logging.basicConfig(level=log_level, format=log_fmt, datefmt=date_fmt, handlers=[handler])
 
+def logging_stats():
+    if _handler is None:
+        return {"async": False}
+    return {
+        "async": _listener is not None,
+        "queued": _handler.queue.qsize(),
+        "queue_size": _handler.queue.maxsize,
+        "drop_policy": _handler.drop_policy,
+        "dropped": _handler.dropped,
+    }
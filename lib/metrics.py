@@ -0,0 +1,224 @@
+"""
+请求统计: 按 match_rule 统计请求数/错误数/并发数及排队与执行耗时.
+
+所有记录都在 reactor 线程中进行 (线程池中的接口把耗时带回 reactor 线程后再记录), 因此不需要加锁,
+读取方 (MGMT 服务) 同样通过 blockingCallFromThread 在 reactor 线程中生成快照.
+"""
+import bisect
+
+# Prometheus 输出使用的固定分桶上限 (秒)
+PROMETHEUS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class LatencyHistogram:
+    """
+    HDR 风格的对数-线性直方图, 以微秒为单位记录.
+    每个 2 的幂区间再线性划分为 2 ** (SUB_BUCKET_BITS - 1) 个子桶, 相对误差约 3%, 桶按需创建.
+    Prometheus 的固定分桶另行精确计数: HDR 桶可能跨越分桶上限, 无法准确归入.
+    """
+    SUB_BUCKET_BITS = 6
+    __slots__ = ('__counts', '__le_counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.__counts = {}  # {bucket_index: count}
+        self.__le_counts = [0] * len(PROMETHEUS_BUCKETS)  # 落在 (上一个上限, 上限] 内的数量
+        self.count = 0
+        self.total = 0.0  # 秒
+        self.max = 0.0  # 秒
+
+    @classmethod
+    def bucket_index(cls, value_us: int) -> int:
+        bits = cls.SUB_BUCKET_BITS
+        if value_us < (1 << bits):
+            return value_us
+
+        exponent = value_us.bit_length() - bits
+        return (exponent << (bits - 1)) + (value_us >> exponent)
+
+    @classmethod
+    def bucket_upper(cls, index: int) -> int:
+        """
+        桶内的最大值 (微秒)
+        """
+        bits = cls.SUB_BUCKET_BITS
+        if index < (1 << bits):
+            return index
+
+        exponent = (index >> (bits - 1)) - 1
+        mantissa = index - (exponent << (bits - 1))
+        return ((mantissa + 1) << exponent) - 1
+
+    def record(self, seconds: float):
+        if seconds < 0:
+            seconds = 0.0
+
+        index = self.bucket_index(int(seconds * 1000000))
+        counts = self.__counts
+        counts[index] = counts.get(index, 0) + 1
+        le_index = bisect.bisect_left(PROMETHEUS_BUCKETS, seconds)
+        if le_index < len(PROMETHEUS_BUCKETS):
+            self.__le_counts[le_index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+
+        threshold = q * self.count
+        seen = 0
+        for index in sorted(self.__counts):
+            seen += self.__counts[index]
+            if seen >= threshold:
+                return min(self.bucket_upper(index) / 1000000, self.max)
+        return self.max
+
+    def cumulative_buckets(self):
+        """
+        [[le, 累计数量], ...], 按 PROMETHEUS_BUCKETS, 末尾为 +Inf
+        """
+        result = []
+        seen = 0
+        for bound, count in zip(PROMETHEUS_BUCKETS, self.__le_counts):
+            seen += count
+            result.append([bound, seen])
+        result.append(['+Inf', self.count])
+        return result
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p90": round(self.quantile(0.9), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "p999": round(self.quantile(0.999), 6),
+            "buckets": self.cumulative_buckets(),
+        }
+
+
+class RouteMetrics:
+    __slots__ = ('requests', 'errors', 'in_flight', 'queue_wait', 'handler')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = {}  # {ErrorException code: count}
+        self.in_flight = 0
+        self.queue_wait = LatencyHistogram()
+        self.handler = LatencyHistogram()
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "errors": {str(code): count for code, count in self.errors.items()},
+            "in_flight": self.in_flight,
+            "queue_wait": self.queue_wait.snapshot(),
+            "handler": self.handler.snapshot(),
+        }
+
+
+class Metrics:
+    """
+    只能在 reactor 线程中使用
+    """
+
+    def __init__(self):
+        self.__routes = {}  # {match_rule: RouteMetrics}
+        self.not_found = 0
+
+    def route(self, match_rule: str) -> RouteMetrics:
+        metrics = self.__routes.get(match_rule)
+        if metrics is None:
+            metrics = self.__routes[match_rule] = RouteMetrics()
+        return metrics
+
+    def request_started(self, match_rule: str) -> RouteMetrics:
+        metrics = self.route(match_rule)
+        metrics.requests += 1
+        metrics.in_flight += 1
+        return metrics
+
+    @staticmethod
+    def request_finished(metrics: RouteMetrics, queue_wait: float, handler_time: float, error_code=None):
+        metrics.in_flight -= 1
+        metrics.queue_wait.record(queue_wait)
+        metrics.handler.record(handler_time)
+        if error_code is not None:
+            metrics.errors[error_code] = metrics.errors.get(error_code, 0) + 1
+
+    def request_rejected(self, match_rule: str, error_code):
+        metrics = self.route(match_rule)
+        metrics.requests += 1
+        metrics.errors[error_code] = metrics.errors.get(error_code, 0) + 1
+
+    def snapshot(self):
+        return {
+            "not_found": self.not_found,
+            "routes": {match_rule: metrics.snapshot() for match_rule, metrics in self.__routes.items()},
+        }
+
+
+def __escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def __sample(name: str, labels: dict, value) -> str:
+    if not labels:
+        return '%s %s' % (name, value)
+    label_str = ','.join('%s="%s"' % (key, __escape_label(label_value)) for key, label_value in labels.items())
+    return '%s{%s} %s' % (name, label_str, value)
+
+
+def render_prometheus(snapshots) -> str:
+    """
+    :param snapshots: [(额外标签 dict, Metrics.snapshot()), ...], 多进程模式下每个 worker 一项
+    :return: Prometheus 文本格式
+    """
+    lines = [
+        '# HELP stupid_server_requests_total Requests handled by match rule.',
+        '# TYPE stupid_server_requests_total counter',
+    ]
+    for base, snapshot in snapshots:
+        for match_rule, route in snapshot["routes"].items():
+            labels = dict(base, match_rule=match_rule)
+            lines.append(__sample('stupid_server_requests_total', labels, route["requests"]))
+
+    lines.append('# HELP stupid_server_errors_total Requests finished with an ErrorException code.')
+    lines.append('# TYPE stupid_server_errors_total counter')
+    for base, snapshot in snapshots:
+        for match_rule, route in snapshot["routes"].items():
+            for code, count in route["errors"].items():
+                labels = dict(base, match_rule=match_rule, code=code)
+                lines.append(__sample('stupid_server_errors_total', labels, count))
+
+    lines.append('# HELP stupid_server_in_flight Requests currently being handled.')
+    lines.append('# TYPE stupid_server_in_flight gauge')
+    for base, snapshot in snapshots:
+        for match_rule, route in snapshot["routes"].items():
+            labels = dict(base, match_rule=match_rule)
+            lines.append(__sample('stupid_server_in_flight', labels, route["in_flight"]))
+
+    lines.append('# HELP stupid_server_not_found_total Requests without a matching interface.')
+    lines.append('# TYPE stupid_server_not_found_total counter')
+    for base, snapshot in snapshots:
+        lines.append(__sample('stupid_server_not_found_total', base, snapshot["not_found"]))
+
+    for name, key, help_text in (('stupid_server_queue_wait_seconds', 'queue_wait',
+                                  'Time between accepting a request and starting its handler.'),
+                                 ('stupid_server_handler_seconds', 'handler', 'Time spent in the handler.')):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        for base, snapshot in snapshots:
+            for match_rule, route in snapshot["routes"].items():
+                histogram = route[key]
+                for le, count in histogram["buckets"]:
+                    labels = dict(base, match_rule=match_rule, le=le)
+                    lines.append(__sample(name + '_bucket', labels, count))
+                labels = dict(base, match_rule=match_rule)
+                lines.append(__sample(name + '_sum', labels, histogram["sum"]))
+                lines.append(__sample(name + '_count', labels, histogram["count"]))
+
+    return '\n'.join(lines) + '\n'
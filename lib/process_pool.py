@@ -0,0 +1,295 @@
+"""
+execution = "process" 的接口在进程池中执行, 不占用主进程的 GIL:
+    0.请求在 reactor 线程中转换为可 pickle 的 RequestSnapshot (method/uri/path/args/请求头/正文), 交给子进程
+    1.子进程导入接口模块, 以 ProcessRequest 调用 interface_function, 接口写出的完整响应以 Response 返回
+    2.子进程以 forkserver (不支持时为 spawn) 方式启动, 不继承主进程的 reactor 和线程; 创建进程池时预先启动全部子进程
+    3.子进程的日志经队列交给主进程的 handler 写出
+    4.接口重新载入后整体替换进程池, 已提交的请求在旧进程池中执行完毕; 子进程异常退出时同样重建进程池
+
+接口必须在 interface_function 中写出完整的响应, 不支持 lib.response_stream.
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from logging.handlers import QueueHandler, QueueListener
+
+from twisted.internet import defer, reactor
+from twisted.web.http import RESPONSES, FOUND
+from twisted.web.http_headers import Headers
+
+from error_code import ErrorException
+from lib.response import Response
+
+
+class RequestSnapshot:
+    """
+    请求的只读快照, 只包含基本类型
+    """
+    __slots__ = ('method', 'uri', 'path', 'args', 'headers', 'body', 'client')
+
+    def __init__(self, request):
+        self.method = request.method
+        self.uri = request.uri
+        self.path = request.path
+        self.args = request.args
+        self.headers = list(request.requestHeaders.getAllRawHeaders())
+        content = request.content
+        if content is None:
+            self.body = b''
+        else:
+            content.seek(0)
+            self.body = content.read()
+            content.seek(0)
+        client = request.getClientAddress()
+        self.client = getattr(client, 'host', None)
+
+
+class ProcessRequest:
+    """
+    子进程中传给 interface_function 的 Request, 提供与 twisted Request 相同的常用属性与方法,
+    响应写入本地缓冲, 由 to_response 生成 Response 返回主进程
+    """
+
+    def __init__(self, snapshot: RequestSnapshot):
+        self.method = snapshot.method
+        self.uri = snapshot.uri
+        self.path = snapshot.path
+        self.args = snapshot.args
+        self.requestHeaders = Headers(dict(snapshot.headers))
+        self.content = BytesIO(snapshot.body)
+        self.body_size = len(snapshot.body)
+        self.client = snapshot.client
+        self.code = 200
+        self.code_message = RESPONSES[200]
+        self.responseHeaders = Headers()
+        self.finished = 0
+        self.__chunks = []
+
+    def getHeader(self, key):
+        # key 为 str 时返回 str, 与 twisted Request 一致
+        value = self.requestHeaders.getRawHeaders(key)
+        if value is None:
+            return None
+        return value[-1]
+
+    def getAllHeaders(self):
+        return {name.lower(): values[-1] for name, values in self.requestHeaders.getAllRawHeaders()}
+
+    def setResponseCode(self, code: int, message: bytes = None):
+        self.code = code
+        self.code_message = message if message is not None else RESPONSES.get(code, b"Unknown Status")
+
+    def setHeader(self, name, value):
+        self.responseHeaders.setRawHeaders(name, [value])
+
+    def redirect(self, url):
+        self.setResponseCode(FOUND)
+        self.setHeader(b"Location", url)
+
+    def respond(self, response: Response):
+        if self.finished:
+            raise RuntimeError("Request.respond called on a request after Request.finish was called.")
+        self.code = response.code
+        self.code_message = response.message if response.message is not None else RESPONSES.get(response.code,
+                                                                                                 b"Unknown Status")
+        self.responseHeaders = Headers()
+        for name, values in response.headers:
+            self.responseHeaders.setRawHeaders(name, values)
+        self.__chunks = [response.body]
+        self.finished = 1
+
+    def write(self, data: bytes):
+        if self.finished:
+            raise RuntimeError("Request.write called on a request after Request.finish was called.")
+        if not isinstance(data, bytes):
+            raise TypeError("Data must be bytes, not %s" % type(data).__name__)
+        self.__chunks.append(data)
+
+    def writeSequence(self, seq):
+        for data in seq:
+            self.write(data)
+
+    def finish(self):
+        self.finished = 1
+
+    def to_response(self) -> Response:
+        return Response(self.code, list(self.responseHeaders.getAllRawHeaders()), b''.join(self.__chunks),
+                        self.code_message)
+
+
+class RemoteError(Exception):
+    """
+    子进程中接口抛出的非 ErrorException 异常, 异常本身不一定能 pickle, 只带回 repr 与堆栈
+    """
+
+    def __init__(self, text: str, tb: str):
+        super().__init__(text, tb)
+        self.text = text
+        self.tb = tb
+
+    def __repr__(self):
+        return self.text
+
+
+def _init_child(log_queue, log_level):
+    # 由主进程统一处理 Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(log_level)
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _run(module_name: str, snapshot: RequestSnapshot):
+    """
+    在子进程中执行, 返回 (Response 或 None, 异常, 堆栈); 接口未结束请求时 Response 为 None
+    """
+    request = ProcessRequest(snapshot)
+    try:
+        module = importlib.import_module(module_name)
+        module.interface_function(request)
+    except ErrorException as e:
+        # 接口中定义的子类不一定能在主进程中还原
+        return None, ErrorException((e.get_code(), e.get_msg())), traceback.format_exc()
+    except BaseException as e:
+        tb = traceback.format_exc()
+        return None, RemoteError(repr(e), tb), tb
+
+    if not request.finished:
+        return None, None, None
+    return request.to_response(), None, None
+
+
+class ProcessPool:
+    """
+    submit 只能在 reactor 线程中调用, start/reload/stop 可以在任意线程中调用
+    """
+
+    def __init__(self, size: int = 0, max_tasks_per_child: int = 0):
+        self.size = size or os.cpu_count() or 1
+        self.max_tasks_per_child = max_tasks_per_child or None
+        methods = multiprocessing.get_all_start_methods()
+        self.__context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.__executor = None
+        self.__lock = threading.RLock()
+        self.__log_queue = None
+        self.__log_listener = None
+        self.generation = 0
+        self.submitted = 0
+        self.restarts = 0
+
+    @property
+    def running(self) -> bool:
+        return self.__executor is not None
+
+    def start(self):
+        """
+        创建新的进程池并预先启动全部子进程, 已有的进程池在其中的请求执行完后退出
+        """
+        with self.__lock:
+            self.__start()
+
+    def __start(self):
+        if self.__log_listener is None:
+            self.__log_queue = self.__context.Queue()
+            self.__log_listener = QueueListener(self.__log_queue, *logging.getLogger().handlers,
+                                                respect_handler_level=True)
+            self.__log_listener.start()
+
+        old = self.__executor
+        self.__executor = ProcessPoolExecutor(max_workers=self.size, mp_context=self.__context,
+                                              initializer=_init_child,
+                                              initargs=(self.__log_queue, logging.getLogger().level),
+                                              max_tasks_per_child=self.max_tasks_per_child)
+        for _ in range(self.size):
+            self.__executor.submit(_warm_up)
+        self.generation += 1
+        if old is not None:
+            old.shutdown(wait=False)
+        logging.info('Process pool started size:%s max_tasks_per_child:%s generation:%s',
+                     self.size, self.max_tasks_per_child, self.generation)
+
+    def reload(self, needed: bool, changed: bool = True):
+        """
+        接口重新载入后调用, 子进程中已导入的接口模块随旧进程池一起退出
+        :param needed: 是否还有 execution = "process" 的接口, 没有时关闭进程池
+        :param changed: 接口文件是否有变化, 没有变化且进程池已在运行时不重建
+        """
+        with self.__lock:
+            if needed:
+                if changed or self.__executor is None:
+                    self.__start()
+            elif self.__executor is not None:
+                self.__executor.shutdown(wait=False)
+                self.__executor = None
+                logging.info('Process pool stopped, no process interface')
+
+    def stop(self):
+        with self.__lock:
+            if self.__executor is not None:
+                self.__executor.shutdown(wait=False, cancel_futures=True)
+                self.__executor = None
+            if self.__log_listener is not None:
+                self.__log_listener.stop()
+                self.__log_listener = None
+
+    def submit(self, module_name: str, request) -> defer.Deferred:
+        """
+        结果为 (Response 或 None, 异常, 堆栈)
+        """
+        with self.__lock:
+            if self.__executor is None:
+                self.__start()
+            executor = self.__executor
+        self.submitted += 1
+        d = defer.Deferred()
+
+        def on_done(future):
+            # 在进程池的管理线程中调用
+            reactor.callFromThread(fire, future)
+
+        def fire(future):
+            error = future.exception()
+            if error is None:
+                d.callback(future.result())
+            else:
+                d.errback(error)
+
+        try:
+            executor.submit(_run, module_name, RequestSnapshot(request)).add_done_callback(on_done)
+        except BrokenProcessPool as e:
+            d.errback(e)
+
+        def on_broken(failure):
+            failure.trap(BrokenProcessPool)
+            # 子进程异常退出, 重建进程池, 本次请求按服务错误返回
+            with self.__lock:
+                if self.__executor is executor:
+                    self.restarts += 1
+                    logging.error('Process pool broken, restarting')
+                    self.__start()
+            return failure
+
+        d.addErrback(on_broken)
+        return d
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "size": self.size,
+            "max_tasks_per_child": self.max_tasks_per_child,
+            "start_method": self.__context.get_start_method(),
+            "generation": self.generation,
+            "submitted": self.submitted,
+            "restarts": self.restarts,
+        }
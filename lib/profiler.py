@@ -0,0 +1,291 @@
+"""
+按 match_rule 对接口进行性能分析, 由 MGMT 服务开启:
+    0.cprofile: 对命中规则的每个请求在执行线程中启用 cProfile, 结果合并后以 pstats 文本输出
+    1.sample: 采样线程每 interval_ms 读取一次正在执行该规则的线程的调用栈, 以 collapsed stack 格式输出,
+      可直接用于 flamegraph.pl / speedscope
+    2.开启后在 requests 个请求或 seconds 秒后自动结束, 结果保留到下次开启
+    3.slow_ms 大于 0 时, 执行超过 slow_ms 的请求在执行过程中自动记录一次调用栈, 最多保留 slow_keep 条
+
+只对接口函数的同步执行部分生效: 线程池中的接口为整个执行过程, inline/async 接口为在 reactor 线程中同步执行的部分.
+未开启任何分析且 slow_ms 为 0 时 active 为 False, SServer 不包装接口函数, 没有额外开销.
+"""
+import collections
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+PROFILE_CPROFILE = 'cprofile'
+PROFILE_SAMPLE = 'sample'
+profile_mode_set = {PROFILE_CPROFILE, PROFILE_SAMPLE}
+
+# 采样线程的最长间隔, 保证会话到期及慢请求能及时处理
+_MAX_TICK = 0.1
+
+
+class _Session:
+    def __init__(self, rule: str, mode: str, max_requests, seconds, interval: float):
+        self.rule = rule
+        self.mode = mode
+        self.max_requests = max_requests
+        self.seconds = seconds
+        self.interval = interval
+        self.started_at = time.time()
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.finished_at = None
+        self.requests = 0
+        self.skipped = 0
+        self.samples = 0
+        self.stats = None  # pstats.Stats
+        self.stacks = collections.Counter()  # {collapsed stack: count}
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.finished_at is None
+
+    def expired(self) -> bool:
+        if not self.running:
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return self.max_requests is not None and self.requests >= self.max_requests
+
+    def take(self) -> bool:
+        """
+        是否分析本次请求, 在 Profiler 的锁内调用
+        """
+        if self.expired():
+            return False
+        self.requests += 1
+        return True
+
+    def add_profile(self, profile: cProfile.Profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def add_stack(self, stack: str):
+        with self.lock:
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def status(self):
+        return {
+            "match_rule": self.rule,
+            "mode": self.mode,
+            "running": self.running,
+            "requests": self.requests,
+            "max_requests": self.max_requests,
+            "seconds": self.seconds,
+            "skipped": self.skipped,
+            "samples": self.samples,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def output(self, limit: int) -> str:
+        with self.lock:
+            if self.mode == PROFILE_CPROFILE:
+                if self.stats is None:
+                    return ''
+                stream = io.StringIO()
+                self.stats.stream = stream
+                self.stats.sort_stats('cumulative').print_stats(limit)
+                return stream.getvalue()
+
+            return ''.join('%s %d\n' % item for item in self.stacks.most_common(limit))
+
+
+class _Running:
+    __slots__ = ('rule', 'path', 'session', 'started', 'captured')
+
+    def __init__(self, rule, path, session):
+        self.rule = rule
+        self.path = path
+        self.session = session
+        self.started = time.monotonic()
+        self.captured = False
+
+
+class Profiler:
+    """
+    wrap 在 reactor 线程中调用, 其余方法可以在任意线程中调用
+    """
+
+    def __init__(self, slow_ms: float = 0, slow_keep: int = 50):
+        self.__lock = threading.Lock()
+        self.__sessions = {}  # {match_rule: _Session}
+        self.__running = {}  # {thread_id: _Running}
+        self.__slow = slow_ms / 1000
+        self.__slow_captures = collections.deque(maxlen=slow_keep)
+        self.__slow_count = 0
+        self.__sampler = None
+        self.__wrapper_code = None
+        self.active = False
+
+    def __update(self):
+        """
+        在锁内调用, 有需要时启动采样线程
+        """
+        self.active = self.__slow > 0 or any(session.running for session in self.__sessions.values())
+        if self.active and self.__sampler is None:
+            self.__sampler = threading.Thread(target=self.__sample_loop, name='profiler-sampler', daemon=True)
+            self.__sampler.start()
+
+    def start(self, rule: str, mode: str = PROFILE_CPROFILE, max_requests: int = None, seconds: float = None,
+              interval_ms: float = 5):
+        if mode not in profile_mode_set:
+            raise ValueError('mode must be one of %s' % sorted(profile_mode_set))
+        with self.__lock:
+            session = self.__sessions[rule] = _Session(rule, mode, max_requests, seconds, interval_ms / 1000)
+            self.__update()
+        return session.status()
+
+    def stop(self, rule: str):
+        with self.__lock:
+            session = self.__sessions.get(rule)
+            if session is None:
+                return None
+            if session.running:
+                session.finished_at = time.time()
+            self.__update()
+        return session.status()
+
+    def result(self, rule: str, limit: int = 100):
+        with self.__lock:
+            session = self.__sessions.get(rule)
+        if session is None:
+            return None
+        result = session.status()
+        result["format"] = 'pstats' if session.mode == PROFILE_CPROFILE else 'collapsed'
+        result["output"] = session.output(limit)
+        return result
+
+    def set_slow(self, slow_ms: float):
+        with self.__lock:
+            self.__slow = slow_ms / 1000
+            self.__update()
+            return {"slow_ms": slow_ms}
+
+    def slow_requests(self):
+        with self.__lock:
+            return {
+                "slow_ms": self.__slow * 1000,
+                "count": self.__slow_count,
+                "captures": list(self.__slow_captures),
+            }
+
+    def status(self):
+        with self.__lock:
+            return {
+                "active": self.active,
+                "slow_ms": self.__slow * 1000,
+                "sessions": [session.status() for session in self.__sessions.values()],
+            }
+
+    def wrap(self, rule: str, function):
+        """
+        返回带有分析功能的接口函数
+        """
+        def profiled(request):
+            tid = threading.get_ident()
+            with self.__lock:
+                session = self.__sessions.get(rule)
+                if session is not None and not session.take():
+                    session = None
+                running = self.__running[tid] = _Running(rule, request.path.decode(errors='replace'), session)
+
+            profile = None
+            if session is not None and session.mode == PROFILE_CPROFILE:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Python 3.12 起同一时间只能有一个 cProfile 在运行
+                    profile = None
+                    session.skipped += 1
+            try:
+                return function(request)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                    session.add_profile(profile)
+                with self.__lock:
+                    if self.__running.get(tid) is running:
+                        del self.__running[tid]
+
+        self.__wrapper_code = profiled.__code__
+        return profiled
+
+    def __frames(self, frame):
+        """
+        从当前位置到接口函数的各层 frame, 内层在前
+        """
+        while frame is not None and frame.f_code is not self.__wrapper_code:
+            yield frame
+            frame = frame.f_back
+
+    def __collapse(self, frame) -> str:
+        """
+        从接口函数开始到当前位置的调用栈, 以 ';' 连接, 外层在前
+        """
+        names = ['%s (%s:%d)' % (item.f_code.co_name, item.f_code.co_filename, item.f_code.co_firstlineno)
+                 for item in self.__frames(frame)]
+        names.reverse()
+        return ';'.join(names)
+
+    def __sample_loop(self):
+        while True:
+            with self.__lock:
+                for session in self.__sessions.values():
+                    if session.running and session.expired():
+                        session.finished_at = time.time()
+                self.__update()
+                if not self.active:
+                    self.__sampler = None
+                    return
+
+                intervals = [session.interval for session in self.__sessions.values()
+                             if session.running and session.mode == PROFILE_SAMPLE]
+                if self.__slow > 0:
+                    intervals.append(self.__slow / 4)
+                tick = min(intervals + [_MAX_TICK])
+                running = list(self.__running.items())
+                slow = self.__slow
+
+            if running:
+                self.__sample(running, slow)
+            time.sleep(tick)
+
+    def __sample(self, running, slow: float):
+        frames = sys._current_frames()
+        now = time.monotonic()
+        for tid, item in running:
+            frame = frames.get(tid)
+            if frame is None:
+                continue
+
+            session = item.session
+            if session is not None and session.mode == PROFILE_SAMPLE and session.running:
+                session.add_stack(self.__collapse(frame))
+
+            if slow > 0 and not item.captured and now - item.started >= slow:
+                item.captured = True
+                capture = {
+                    "time": time.time(),
+                    "match_rule": item.rule,
+                    "path": item.path,
+                    "thread": tid,
+                    "elapsed": round(now - item.started, 6),
+                    "stack": traceback.StackSummary.extract(
+                        (item, item.f_lineno) for item in reversed(list(self.__frames(frame)))).format(),
+                }
+                with self.__lock:
+                    self.__slow_captures.append(capture)
+                    self.__slow_count += 1
@@ -0,0 +1,190 @@
+"""
+请求正文的接收方式.
+
+Twisted 在收到全部正文后才调用 SServer.render, 此时正文已完整缓冲. InterfaceRequest 在收到请求头时即完成路由匹配,
+按接口文件中的 request_body/max_body_size 决定正文的去向, 早于任何缓冲:
+    REQUEST_BODY_BUFFER     与 Twisted 一致
+    REQUEST_BODY_FILE       一律写入临时文件, 接口通过 body_view 以 mmap 读取, 不复制到内存
+    REQUEST_BODY_STREAM     不缓冲, 每收到一块即在 reactor 线程中调用 interface_body_chunk(request, data)
+正文超过 max_body_size 时经 Site 上的 reject_body (SServer.reject_body) 返回 413 并断开连接,
+Content-Length 已知时在接收正文之前即拒绝.
+
+请求行由 InterfaceChannel 在收到时交给 InterfaceRequest, 因此 Site 的 protocol 须为 InterfaceChannel.
+"""
+import logging
+import mmap
+import os
+import tempfile
+from io import BytesIO
+
+from twisted.python.failure import Failure
+from twisted.web import server, http
+
+from lib.interface_manager import REQUEST_BODY_FILE, REQUEST_BODY_STREAM
+
+
+def body_view(request) -> memoryview:
+    """
+    以 memoryview 读取请求正文. 正文在临时文件中时为只读 mmap, 不复制到内存, 在请求结束前有效.
+    """
+    content = request.content
+    if isinstance(content, BytesIO):
+        return memoryview(content.getvalue())
+
+    content.flush()
+    if os.fstat(content.fileno()).st_size == 0:
+        return memoryview(b'')
+    return memoryview(mmap.mmap(content.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class InterfaceChannel(http.HTTPChannel):
+    """
+    Twisted 在收到全部正文后才以 requestReceived 把请求行交给 Request, 这里在收到请求行时即交给新建的 Request
+    """
+
+    def lineReceived(self, line):
+        count = len(self.requests)
+        super().lineReceived(line)
+        if len(self.requests) > count:
+            self.requests[-1].request_line = line
+
+    def allContentReceived(self):
+        if not self.requests:
+            # 正文超过 max_body_size 的请求已返回 413 并结束, 连接正在关闭, 剩余的正文直接丢弃
+            return
+        super().allContentReceived()
+
+
+class InterfaceRequest(server.Request):
+    """
+    SServer 使用的 Request, 由 Site.requestFactory 创建. 需要 Site 上设置 match_interface 与 reject_body.
+
+        request_line        请求行, 由 InterfaceChannel 设置
+        disconnected        客户端是否已断开连接
+        interface_matched   收到请求头时是否已完成匹配, 为 True 时 SServer 直接使用 interface
+        interface           匹配到的 Interface, 未匹配到时为 None
+        body_size           已收到的正文字节数
+        body_error          REQUEST_BODY_STREAM 中 interface_body_chunk 抛出的异常 (Failure), 之后的正文将被丢弃
+        response_capture    不为 None 时 write 的正文同时追加到其中, 供 lib.response_cache 保存, 超过 capture_limit 时放弃
+        response_filter     不为 None 时以 Response 写出的响应先经 response_filter(request, response) 处理, 见 lib.response
+        response_encoding   协商得到的压缩编码, 不压缩时为 None
+        identity_body       响应经 compression.compress_filter 压缩时, 压缩前的正文; content_encoding 为所用的编码
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_line = None
+        self.disconnected = False
+        self.interface_matched = False
+        self.interface = None
+        self.body_size = 0
+        self.body_error = None
+        self.response_capture = None
+        self.capture_limit = 0
+        self.response_filter = None
+        self.response_encoding = None
+        self.identity_body = None
+        self.content_encoding = None
+        self.__captured = 0
+        self.__rejected = False
+
+    def __parse_request_line(self):
+        """
+        :return: (method, uri, version), 没有请求行时为 None
+        """
+        if self.request_line is None:
+            return None
+        parts = self.request_line.split()
+        if len(parts) != 3:
+            # Twisted 已按 400 断开连接
+            return None
+        return parts
+
+    def __match(self):
+        match_interface = getattr(self.channel.site, 'match_interface', None)
+        request_line = self.__parse_request_line()
+        if match_interface is None or request_line is None:
+            return
+
+        try:
+            self.interface = match_interface(request_line[1].split(b'?', 1)[0].decode())
+        except (Exception,):
+            # 交给 SServer.render 按原有流程处理
+            return
+        self.interface_matched = True
+
+    def __reject(self):
+        self.__rejected = True
+        self.content = BytesIO()
+        # 不再发送 100 Continue
+        self.requestHeaders.removeHeader(b'expect')
+
+        # requestReceived 不会再调用, 以请求行补全写出响应及访问日志所需的属性
+        self.method, self.uri, self.clientproto = self.__parse_request_line()
+        self.path = self.uri.split(b'?', 1)[0]
+        logging.info('Request body too large path:%s size:%s max_body_size:%s' %
+                     (self.path.decode(errors='replace'), self.body_size, self.interface.max_body_size))
+
+        # 连接上剩余的正文不再解析, 响应写出后断开
+        self.channel.persistent = False
+        self.setHeader(b'connection', b'close')
+        self.channel.site.reject_body(self)
+
+    def gotLength(self, length):
+        self.__match()
+        interface = self.interface
+        if interface is None:
+            super().gotLength(length)
+            return
+
+        if interface.max_body_size is not None and length is not None and length > interface.max_body_size:
+            self.body_size = length
+            self.__reject()
+        elif interface.request_body == REQUEST_BODY_STREAM:
+            self.content = BytesIO()
+        elif interface.request_body == REQUEST_BODY_FILE:
+            self.content = tempfile.TemporaryFile()
+        else:
+            super().gotLength(length)
+
+    def handleContentChunk(self, data):
+        if self.__rejected:
+            return
+
+        self.body_size += len(data)
+        interface = self.interface
+        if interface is None:
+            self.content.write(data)
+            return
+
+        if interface.max_body_size is not None and self.body_size > interface.max_body_size:
+            # 未声明 Content-Length (chunked) 时只能边收边检查
+            self.__reject()
+        elif interface.request_body == REQUEST_BODY_STREAM:
+            if self.body_error is None:
+                try:
+                    interface.body_chunk(self, data)
+                except BaseException:
+                    self.body_error = Failure()
+        else:
+            self.content.write(data)
+
+    def write(self, data):
+        capture = self.response_capture
+        if capture is not None and data:
+            self.__captured += len(data)
+            if self.__captured > self.capture_limit:
+                self.response_capture = None
+            else:
+                capture.append(data)
+        super().write(data)
+
+    def connectionLost(self, reason):
+        self.disconnected = True
+        super().connectionLost(reason)
+
+    def requestReceived(self, command, path, version):
+        if self.__rejected:
+            # 已返回 413, 连接正在关闭
+            return
+        super().requestReceived(command, path, version)
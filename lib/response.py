@@ -0,0 +1,180 @@
+import logging
+
+from twisted.internet import reactor
+from twisted.web.http import Request, RESPONSES, FOUND
+from twisted.web.http_headers import Headers
+
+from error_code import ErrorException, all_errors
+from lib import json_tool
+
+
+class Response:
+    """
+    一次完整的 HTTP 响应: 状态码 + 响应头 + 正文.
+    只包含基本类型, 可以在线程/进程间传递, 由 send 在 reactor 线程中一次性写出.
+    """
+    __slots__ = ('code', 'message', 'headers', 'body')
+
+    def __init__(self, code: int = 200, headers=None, body: bytes = b'', message: bytes = None):
+        self.code = code
+        self.message = message
+        self.headers = headers if headers is not None else []  # [(name, [value, ...]), ...]
+        self.body = body
+
+    def send(self, request: Request):
+        """
+        只能在 reactor 线程中调用
+        """
+        request.setResponseCode(self.code, self.message)
+        for name, values in self.headers:
+            request.responseHeaders.setRawHeaders(name, values)
+        if not request.responseHeaders.hasHeader(b"content-length"):
+            request.responseHeaders.setRawHeaders(b"content-length", [b"%d" % len(self.body)])
+
+        try:
+            if self.body:
+                request.write(self.body)
+            request.finish()
+        except RuntimeError:
+            # 客户端已断开连接
+            logging.debug('Response dropped, connection lost path:%s', request.path.decode(errors='replace'))
+
+
+class BufferedRequest:
+    """
+    供线程池中的接口使用的 Request 代理.
+
+    Twisted 不支持在非 reactor 线程中写响应, 因此 setResponseCode/setHeader/responseHeaders/write
+    只写入本地缓冲, 调用 finish 时将完整的 Response 通过一次 callFromThread 交给 reactor 线程写出.
+    其余属性与方法 (method/path/args/content/getHeader 等) 直接转发给原始 Request, 接口文件无需修改.
+    """
+
+    def __init__(self, request: Request):
+        self.__request = request
+        self.__chunks = []
+        self.code = 200
+        self.code_message = RESPONSES[200]
+        self.responseHeaders = Headers()
+        self.finished = 0
+
+    @property
+    def raw_request(self) -> Request:
+        return self.__request
+
+    def __getattr__(self, name):
+        return getattr(self.__request, name)
+
+    def setResponseCode(self, code: int, message: bytes = None):
+        self.code = code
+        self.code_message = message if message is not None else RESPONSES.get(code, b"Unknown Status")
+
+    def setHeader(self, name, value):
+        self.responseHeaders.setRawHeaders(name, [value])
+
+    def redirect(self, url):
+        self.setResponseCode(FOUND)
+        self.setHeader(b"Location", url)
+
+    def respond(self, response: Response):
+        """
+        以 response 替换已缓冲的全部内容并结束请求
+        """
+        if self.finished:
+            raise RuntimeError("Request.respond called on a request after Request.finish was called.")
+
+        self.code = response.code
+        self.code_message = response.message if response.message is not None else RESPONSES.get(response.code,
+                                                                                                 b"Unknown Status")
+        self.responseHeaders = Headers()
+        for name, values in response.headers:
+            self.responseHeaders.setRawHeaders(name, values)
+        self.__chunks = [response.body]
+        self.finish()
+
+    def detach(self) -> Response:
+        """
+        响应改由其它方式写出 (如 lib.response_stream): 标记为已结束但不发送, 返回已缓冲的状态码/响应头/正文
+        """
+        if self.finished:
+            raise RuntimeError("Request.detach called on a request after Request.finish was called.")
+
+        self.finished = 1
+        return self.to_response()
+
+    def write(self, data: bytes):
+        if self.finished:
+            raise RuntimeError("Request.write called on a request after Request.finish was called.")
+        # 与 Twisted 一致, 在写入时而不是 finish 时拒绝非 bytes
+        if not isinstance(data, bytes):
+            raise TypeError("Data must be bytes, not %s" % type(data).__name__)
+        self.__chunks.append(data)
+
+    def writeSequence(self, seq):
+        for data in seq:
+            self.write(data)
+
+    def to_response(self) -> Response:
+        return Response(self.code, list(self.responseHeaders.getAllRawHeaders()), b''.join(self.__chunks),
+                        self.code_message)
+
+    def finish(self):
+        if self.finished:
+            logging.warning('request.finish called twice path:%s' % self.__request.path.decode(errors='replace'))
+            return
+
+        # response_filter 只依赖请求头与 Response, 在当前线程中执行.
+        # 先生成响应再标记为已结束, 出错时请求仍未结束, 可以改为写出错误响应
+        response = filter_response(self.__request, self.to_response())
+        self.finished = 1
+        reactor.callFromThread(response.send, self.__request)
+
+
+def filter_response(request, response: Response) -> Response:
+    """
+    经 request.response_filter (如 ETag) 处理接口写出的完整响应, 未设置时原样返回
+    """
+    response_filter = getattr(request, 'response_filter', None)
+    if response_filter is None:
+        return response
+    return response_filter(request, response)
+
+
+def json_response(obj, code: int = 200) -> Response:
+    body = json_tool.dumps(obj)
+    return Response(code, [(b"content-type", [b"application/json"]),
+                           (b"content-length", [b"%d" % len(body)])], body)
+
+
+# 所有错误码在导入时预先生成好响应正文及响应头
+__error_responses = {error: json_response(ErrorException(error).to_dict()) for error in all_errors()}
+
+
+def error_response(e: ErrorException, code: int = 200) -> Response:
+    if code == 200 and type(e) is ErrorException:
+        response = __error_responses.get((e.get_code(), e.get_msg()))
+        if response is not None:
+            return response
+    return json_response(e.to_dict(), code)
+
+
+def send_response(request, response: Response):
+    """
+    写出完整的响应并结束请求:
+        BufferedRequest 以 response 替换缓冲内容, 由 reactor 线程写出;
+        原始 Request (reactor 线程) 直接写出, 若接口已开始写入, 响应头已发出, 只追加正文.
+    """
+    if isinstance(request, BufferedRequest):
+        request.respond(response)
+    elif not request.startedWriting:
+        filter_response(request, response).send(request)
+    else:
+        request.write(response.body)
+        request.finish()
+
+
+def write_json(request, obj, code: int = 200):
+    """
+    供接口使用: 以 JSON 返回 obj 并结束请求
+        write_json(request, {"code": 0, "msg": "Operation-succeeded", "data": {}})
+    """
+    send_response(request, json_response(obj, code))
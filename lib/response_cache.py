@@ -0,0 +1,287 @@
+"""
+接口声明 cache_ttl 后, GET/HEAD 请求的响应缓存在内存中, 命中时由 SServer 在 reactor 线程中直接写出, 不再执行接口:
+    0.缓存键为 (match_rule, path, 查询参数, 请求头): 查询参数默认全部参与, 声明 cache_args 时只取其中的参数;
+      声明 cache_headers 时取其中的请求头
+    1.只缓存状态码 200, 接口未返回错误码, 且没有 Set-Cookie 及 Cache-Control: no-store/private 的响应
+    2.响应带有强 ETag (正文的 blake2b 摘要), 请求的 If-None-Match 与之相同时返回 304
+    3.按条目数与总字节数 LRU 淘汰, 超过 max_entry_bytes 的响应不缓存
+    4.可按 match_rule 或路径前缀失效, 接口文件有变化并重新载入后清空
+    5.可压缩的响应按编码分别保存压缩结果 (各自有 ETag), 命中时直接写出, 不必每次重新压缩
+"""
+import collections
+import hashlib
+import logging
+import time
+
+from twisted.internet import defer, threads
+
+from lib import compression
+from lib.response import Response
+
+# 不随缓存保存的响应头, 由 Twisted 在写出时重新生成
+_SKIP_HEADERS = frozenset((b'date', b'server', b'content-length', b'transfer-encoding', b'connection', b'etag'))
+
+
+def make_etag(body: bytes) -> bytes:
+    return b'"' + hashlib.blake2b(body, digest_size=16).hexdigest().encode() + b'"'
+
+
+def etag_matches(request, etag: bytes) -> bool:
+    """
+    If-None-Match 中是否包含 etag (或为 *)
+    """
+    if_none_match = request.requestHeaders.getRawHeaders(b'if-none-match')
+    if not if_none_match:
+        return False
+    for value in if_none_match:
+        for item in value.split(b','):
+            item = item.strip()
+            if item == b'*' or item == etag:
+                return True
+    return False
+
+
+def not_modified(etag: bytes, headers=()) -> Response:
+    """
+    304 响应, 只保留与缓存相关的响应头
+    """
+    headers = [(name, values) for name, values in headers
+               if name.lower() in (b'cache-control', b'expires', b'vary', b'content-location')]
+    headers.append((b'etag', [etag]))
+    return Response(304, headers, b'')
+
+
+def tag_response(request, response: Response) -> Response:
+    """
+    为可缓存接口的响应加上 ETag, If-None-Match 相同时改为 304. 只依赖请求头与 response, 可以在任意线程中调用
+    """
+    if response.code != 200:
+        return response
+
+    etag = make_etag(response.body)
+    if etag_matches(request, etag):
+        return not_modified(etag, response.headers)
+    # response 可能是预先生成的共享对象 (如 error_response), 不能修改
+    headers = [(name, values) for name, values in response.headers if name.lower() != b'etag']
+    headers.append((b'etag', [etag]))
+    return Response(response.code, headers, response.body, response.message)
+
+
+def cache_key(interface, request):
+    """
+    只能在 reactor 线程中调用
+    """
+    args = request.args
+    if interface.cache_args is None:
+        args_key = tuple(sorted((name, tuple(values)) for name, values in args.items()))
+    else:
+        args_key = tuple(tuple(args.get(name, ())) for name in interface.cache_args)
+
+    headers = request.requestHeaders
+    headers_key = tuple(tuple(headers.getRawHeaders(name, ())) for name in interface.cache_headers)
+    return interface.match_rule, request.path, args_key, headers_key
+
+
+class CacheEntry:
+    """
+    variants 为 {编码: (正文, ETag)}, 未压缩的正文的编码为 None; 各编码的压缩结果在首次需要时生成后保存
+    """
+    __slots__ = ('key', 'headers', 'variants', 'compressible', 'created', 'expires', 'size')
+
+    def __init__(self, key, headers, body: bytes, etag: bytes, ttl: float):
+        self.key = key
+        self.headers = headers
+        self.variants = {None: (body, etag)}
+        self.compressible = compression.compressible(200, headers, len(body))
+        self.created = time.monotonic()
+        self.expires = self.created + ttl
+        self.size = len(body) + sum(len(name) + sum(len(value) for value in values) for name, values in headers)
+
+    @property
+    def rule(self) -> str:
+        return self.key[0]
+
+    @property
+    def path(self) -> bytes:
+        return self.key[1]
+
+    def response(self, request, encoding: str = None) -> Response:
+        body, etag = self.variants[encoding]
+        if etag_matches(request, etag):
+            return not_modified(etag, compression.vary_headers(self.headers) if self.compressible else self.headers)
+
+        if encoding is not None:
+            headers = compression.encoded_headers(self.headers, encoding, len(body))
+        elif self.compressible:
+            headers = compression.vary_headers(self.headers)
+        else:
+            headers = list(self.headers)
+        headers.append((b'etag', [etag]))
+        headers.append((b'age', [b'%d' % (time.monotonic() - self.created)]))
+        return Response(200, headers, body)
+
+
+class ResponseCache:
+    """
+    只能在 reactor 线程中使用
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024, max_entry_bytes: int = 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.__entries = collections.OrderedDict()  # {cache_key: CacheEntry}
+        self.__bytes = 0
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        entry = self.__entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.expires <= time.monotonic():
+            self.__remove(key)
+            self.misses += 1
+            return None
+
+        self.__entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def serve(self, entry: CacheEntry, request, encoding: str = None) -> defer.Deferred:
+        """
+        以缓存的条目结束请求, 完成时触发. 条目还没有 encoding 的压缩结果时在线程池中压缩后保存
+        """
+        if not entry.compressible:
+            encoding = None
+        if encoding in entry.variants:
+            self.__send(entry, request, encoding)
+            return defer.succeed(None)
+
+        def on_compressed(body):
+            self.__add_variant(entry, encoding, body)
+            self.__send(entry, request, encoding)
+
+        def on_error(failure):
+            logging.error('Response compress failed encoding:%s\n %s', encoding, failure.getTraceback())
+            self.__send(entry, request, None)
+
+        d = threads.deferToThread(compression.compress, encoding, entry.variants[None][0])
+        d.addCallbacks(on_compressed, on_error)
+        return d
+
+    def __send(self, entry: CacheEntry, request, encoding):
+        response = entry.response(request, encoding)
+        if response.code == 304:
+            self.not_modified += 1
+        response.send(request)
+
+    def __add_variant(self, entry: CacheEntry, encoding: str, body: bytes):
+        if encoding in entry.variants:
+            return
+        entry.variants[encoding] = (body, make_etag(body))
+        entry.size += len(body)
+        if self.__entries.get(entry.key) is entry:
+            self.__bytes += len(body)
+            self.__evict()
+
+    def __evict(self):
+        while self.__entries and (len(self.__entries) > self.max_entries or self.__bytes > self.max_bytes):
+            self.__remove(next(iter(self.__entries)))
+            self.evictions += 1
+
+    def put(self, key, request, ttl: float):
+        """
+        请求正常结束后调用, 保存 request 已写出的响应
+        """
+        capture = request.response_capture
+        request.response_capture = None
+        if capture is None or request.code != 200 or request.method != b'GET':
+            return
+
+        # 响应经 compression.compress_filter 压缩过时, 同时保存未压缩的正文与压缩结果
+        encoding = getattr(request, 'content_encoding', None)
+        skip = _SKIP_HEADERS if encoding is None else _SKIP_HEADERS | {b'content-encoding', b'vary'}
+        headers = []
+        etag = None
+        for name, values in request.responseHeaders.getAllRawHeaders():
+            lower = name.lower()
+            if lower == b'set-cookie':
+                return
+            if lower == b'cache-control' and any(b'no-store' in value or b'private' in value for value in values):
+                return
+            if lower == b'etag':
+                etag = values[-1]
+            elif lower == b'vary' and encoding is None:
+                # compress_filter 加上的 Vary 在写出时按需重新加上
+                values = [value for value in values if value.lower() != b'accept-encoding']
+                if values:
+                    headers.append((name, values))
+            elif lower not in skip:
+                headers.append((name, values))
+
+        body = b''.join(capture)
+        if encoding is None:
+            entry = CacheEntry(key, headers, body, etag or make_etag(body), ttl)
+        else:
+            identity = request.identity_body
+            entry = CacheEntry(key, headers, identity, make_etag(identity), ttl)
+            entry.variants[encoding] = (body, etag or make_etag(body))
+            entry.size += len(body)
+        if entry.size > self.max_entry_bytes:
+            return
+
+        self.__remove(key)
+        self.__entries[key] = entry
+        self.__bytes += entry.size
+        self.stores += 1
+        self.__evict()
+
+    def __remove(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.__bytes -= entry.size
+
+    def invalidate(self, rule: str = None, prefix: str = None) -> int:
+        """
+        失效 match_rule 为 rule 或路径以 prefix 开头的条目, 均为 None 时全部失效. 返回失效的条目数
+        """
+        prefix = prefix.encode() if prefix is not None else None
+        keys = [key for key, entry in self.__entries.items()
+                if (rule is None or entry.rule == rule) and (prefix is None or entry.path.startswith(prefix))]
+        for key in keys:
+            self.__remove(key)
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def stats(self):
+        rules = collections.Counter(entry.rule for entry in self.__entries.values())
+        variants = collections.Counter(encoding for entry in self.__entries.values() for encoding in entry.variants
+                                       if encoding is not None)
+        lookups = self.hits + self.misses
+        return {
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "max_entry_bytes": self.max_entry_bytes,
+            "entries": len(self.__entries),
+            "bytes": self.__bytes,
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "rules": dict(rules),
+            "compressed_variants": dict(variants),
+        }
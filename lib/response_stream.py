@@ -0,0 +1,328 @@
+"""
+流式响应, 内存占用与响应大小无关.
+
+    stream_response(request, source, content_type=None)
+
+source 可以是:
+    0.文件路径 (str 或 os.PathLike): 以 IPullProducer 按块读取, 设置 Content-Length, 支持单个区间的 Range 请求 (206/416)
+    1.异步迭代器 (async generator 等): 以 IPushProducer 按客户端的 TCP 背压逐块写出, 使用 chunked 编码
+    2.同步迭代器 (generator 等): 同上, 线程池中执行的接口, 其迭代器同样在线程池中执行, 否则在 reactor 线程中执行
+
+线程池中执行的接口调用后立即返回, 由 reactor 线程完成写出;
+在 reactor 线程中执行的接口 (inline/async) 须返回或 await 其返回值, 写出完成 (或客户端断开) 时结束.
+"""
+import asyncio
+import logging
+import mimetypes
+import os
+
+from zope.interface import implementer
+from twisted.internet import defer, reactor, threads
+from twisted.internet.interfaces import IPushProducer, IPullProducer
+from twisted.web.http import PARTIAL_CONTENT, REQUESTED_RANGE_NOT_SATISFIABLE
+
+from lib.async_bridge import as_deferred
+from lib.response import BufferedRequest, Response
+
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header: bytes, size: int):
+    """
+    解析单个区间的 Range 请求头
+    :return: (offset, length); 无法解析或包含多个区间时为 None, 应返回完整内容;
+             区间无法满足时为 (size, 0)
+    """
+    if header is None:
+        return None
+
+    unit, _, spec = header.partition(b'=')
+    if unit.strip().lower() != b'bytes' or b',' in spec:
+        return None
+
+    start, sep, end = spec.strip().partition(b'-')
+    if not sep:
+        return None
+
+    try:
+        if not start:
+            # 后缀区间 bytes=-N
+            suffix = int(end)
+            if suffix <= 0:
+                return size, 0
+            offset = max(size - suffix, 0)
+            return offset, size - offset
+
+        offset = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        return None
+
+    if offset >= size:
+        return size, 0
+    if offset < 0 or last < offset:
+        return None
+
+    last = min(last, size - 1)
+    return offset, last - offset + 1
+
+
+@implementer(IPullProducer)
+class _FileProducer:
+    """
+    按块读取文件的 [offset, offset + length) 区间, 由传输层在发送缓冲区排空时拉取下一块
+    """
+
+    def __init__(self, request, file, offset: int, length: int, done: defer.Deferred, chunk_size: int = CHUNK_SIZE):
+        self.__request = request
+        self.__file = file
+        self.__remaining = length
+        self.__done = done
+        self.__chunk_size = chunk_size
+        file.seek(offset)
+
+    def start(self):
+        self.__request.notifyFinish().addErrback(lambda _: self.stopProducing())
+        self.__request.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if self.__file is None:
+            return
+
+        data = self.__file.read(min(self.__chunk_size, self.__remaining)) if self.__remaining > 0 else b''
+        if not data:
+            self.__request.unregisterProducer()
+            self.__request.finish()
+            self.stopProducing()
+            return
+
+        self.__remaining -= len(data)
+        self.__request.write(data)
+
+    def stopProducing(self):
+        if self.__file is None:
+            return
+
+        self.__file.close()
+        self.__file = None
+        if not self.__done.called:
+            self.__done.callback(None)
+
+
+async def _anext(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+@implementer(IPushProducer)
+class _IteratorProducer:
+    """
+    逐块写出迭代器的内容, 传输层缓冲区满时暂停 (pauseProducing), 排空后继续 (resumeProducing)
+    """
+
+    def __init__(self, request, iterator, in_thread: bool, done: defer.Deferred):
+        self.__request = request
+        self.__iterator = iterator
+        self.__is_async = hasattr(iterator, '__anext__')
+        self.__in_thread = in_thread
+        self.__done = done
+        self.__paused = False
+        self.__pumping = False
+        self.__waiting = False
+        self.__stopped = False
+
+    def start(self):
+        self.__request.notifyFinish().addErrback(lambda _: self.stopProducing())
+        self.__request.registerProducer(self, True)
+        self.__pump()
+
+    def __next(self) -> defer.Deferred:
+        if self.__is_async:
+            return as_deferred(_anext(self.__iterator))
+        if self.__in_thread:
+            return threads.deferToThread(next, self.__iterator, None)
+        return defer.maybeDeferred(next, self.__iterator, None)
+
+    def __pump(self):
+        # 同步迭代器的 Deferred 立即触发, 以循环代替递归
+        if self.__pumping:
+            return
+
+        self.__pumping = True
+        try:
+            while not (self.__paused or self.__waiting or self.__stopped):
+                self.__waiting = True
+                self.__next().addCallbacks(self.__on_chunk, self.__on_error)
+        finally:
+            self.__pumping = False
+
+    def __on_chunk(self, data):
+        self.__waiting = False
+        if self.__stopped:
+            self.__close()
+            return
+
+        if data is None:
+            self.__request.unregisterProducer()
+            self.__request.finish()
+            self.__stop()
+            return
+
+        if isinstance(data, str):
+            data = data.encode(encoding='utf_8')
+        if data:
+            self.__request.write(data)
+        self.__pump()
+
+    def __on_error(self, failure):
+        self.__waiting = False
+        logging.error('Stream response Exception path:%s\n %s' %
+                      (self.__request.path.decode(errors='replace'), failure.getTraceback()))
+        if not self.__stopped:
+            # 响应头已发出, 只能断开连接, 使客户端得知响应不完整
+            self.__request.unregisterProducer()
+            self.__request.loseConnection()
+            self.__stop()
+
+    def pauseProducing(self):
+        self.__paused = True
+
+    def resumeProducing(self):
+        self.__paused = False
+        self.__pump()
+
+    def stopProducing(self):
+        # 客户端已断开
+        if self.__stopped:
+            return
+        self.__stop()
+        if not self.__waiting:
+            self.__close()
+
+    def __stop(self):
+        self.__stopped = True
+        if not self.__done.called:
+            self.__done.callback(None)
+
+    def __close(self):
+        """
+        迭代器正在执行时不能关闭, 须等到本次迭代返回
+        """
+        iterator, self.__iterator = self.__iterator, None
+        if iterator is None:
+            return
+
+        if self.__is_async:
+            if hasattr(iterator, 'aclose'):
+                as_deferred(iterator.aclose()).addErrback(lambda _: None)
+        elif hasattr(iterator, 'close'):
+            if self.__in_thread:
+                reactor.callInThread(iterator.close)
+            else:
+                iterator.close()
+
+
+def _apply_head(request, head: Response):
+    request.setResponseCode(head.code, head.message)
+    for name, values in head.headers:
+        request.responseHeaders.setRawHeaders(name, values)
+
+
+def _start(request, head: Response, headers, producer, done: defer.Deferred):
+    """
+    只能在 reactor 线程中调用
+    """
+    if head is not None:
+        _apply_head(request, head)
+    for name, value in headers:
+        request.responseHeaders.setRawHeaders(name, [value])
+
+    if head is not None and head.body:
+        request.write(head.body)
+
+    if producer is None or request.method == b'HEAD':
+        request.finish()
+        if producer is not None:
+            producer.stopProducing()
+        if not done.called:
+            done.callback(None)
+        return
+
+    producer.start()
+
+
+def stream_response(request, source, content_type: bytes = None, chunk_size: int = CHUNK_SIZE):
+    """
+    :param request: 接口拿到的 request
+    :param source: 文件路径/异步迭代器/同步迭代器, 迭代出的每一块为 bytes (str 以 UTF-8 编码)
+    :param content_type: 默认文件按扩展名推断, 迭代器为 application/octet-stream
+    :return: 在 reactor 线程中调用时返回 asyncio Future (未安装 asyncio reactor 时为 Deferred),
+             写出完成或客户端断开时结束; 在线程池中调用时返回 None
+    """
+    in_thread = isinstance(request, BufferedRequest)
+    done = defer.Deferred()
+    headers = []
+
+    if isinstance(source, (str, os.PathLike)):
+        # 打开文件与解析 Range 在接口中完成, 出错时按接口异常处理
+        file = open(source, 'rb')
+        try:
+            size = os.fstat(file.fileno()).st_size
+            if content_type is None:
+                content_type = (mimetypes.guess_type(os.fspath(source))[0] or 'application/octet-stream').encode()
+            headers.append((b'accept-ranges', b'bytes'))
+
+            offset, length = 0, size
+            code = None
+            byte_range = parse_range(request.getHeader(b'range'), size)
+            if byte_range is not None:
+                offset, length = byte_range
+                if length == 0:
+                    code = REQUESTED_RANGE_NOT_SATISFIABLE
+                    headers.append((b'content-range', b'bytes */%d' % size))
+                else:
+                    code = PARTIAL_CONTENT
+                    headers.append((b'content-range', b'bytes %d-%d/%d' % (offset, offset + length - 1, size)))
+            headers.append((b'content-length', b'%d' % length))
+        except BaseException:
+            file.close()
+            raise
+
+        if code == REQUESTED_RANGE_NOT_SATISFIABLE:
+            file.close()
+            producer = None
+        else:
+            producer = _FileProducer(request.raw_request if in_thread else request, file, offset, length, done,
+                                     chunk_size)
+    elif hasattr(source, '__aiter__'):
+        code = None
+        producer = _IteratorProducer(request.raw_request if in_thread else request, source.__aiter__(), in_thread,
+                                     done)
+    elif hasattr(source, '__iter__') and not isinstance(source, (bytes, bytearray, memoryview)):
+        code = None
+        producer = _IteratorProducer(request.raw_request if in_thread else request, iter(source), in_thread, done)
+    else:
+        raise TypeError('stream_response source must be a file path or an iterator, got %r' % type(source))
+
+    headers.append((b'content-type', content_type or b'application/octet-stream'))
+
+    if in_thread:
+        head = request.detach()
+        if code is not None:
+            head.code, head.message = code, None
+        # 接口已写入的正文会先于流式内容发出, 此时 Content-Length 不再准确
+        if head.body:
+            headers = [(name, value) for name, value in headers if name != b'content-length']
+        reactor.callFromThread(_start, request.raw_request, head, headers, producer, done)
+        return None
+
+    if code is not None:
+        request.setResponseCode(code)
+    _start(request, None, headers, producer, done)
+    try:
+        # async def 接口中 await 的须为 asyncio 的 awaitable, inline 接口返回后由 as_deferred 转换
+        return done.asFuture(asyncio.get_running_loop())
+    except RuntimeError:
+        return done
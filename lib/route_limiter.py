@@ -0,0 +1,74 @@
+from collections import deque
+
+from twisted.internet import defer
+from twisted.web.http import Request
+
+
+class RouteLimiter:
+    """
+    单个接口的并发限制: 最多 max_concurrency 个请求同时执行, 超出的请求进入长度为 queue_limit 的等待队列,
+    队列已满时 submit 返回 False, 由调用方立即返回错误.
+
+    只在 reactor 线程中使用, 不需要加锁.
+    """
+
+    def __init__(self, max_concurrency: int, queue_limit: int = 0):
+        self.max_concurrency = max_concurrency
+        self.queue_limit = queue_limit
+        self.active = 0
+        self.rejected = 0
+        self.__queue = deque()  # [run, ...], 只包含仍在等待的请求
+
+    def configure(self, max_concurrency: int, queue_limit: int):
+        self.max_concurrency = max_concurrency
+        self.queue_limit = queue_limit
+        self.__drain()
+
+    def submit(self, request: Request, run) -> bool:
+        """
+        :param run: 无参函数, 开始处理请求, 返回处理完成时触发的 Deferred
+        """
+        if self.active < self.max_concurrency and not self.__queue:
+            self.__start(run)
+            return True
+
+        if len(self.__queue) < self.queue_limit:
+            def on_lost(_):
+                # 排队期间客户端已断开, 不再占用队列; 已开始执行时不在队列中
+                try:
+                    self.__queue.remove(run)
+                except ValueError:
+                    pass
+
+            request.notifyFinish().addErrback(on_lost)
+            self.__queue.append(run)
+            return True
+
+        self.rejected += 1
+        return False
+
+    def __start(self, run):
+        self.active += 1
+        d = defer.maybeDeferred(run)
+        d.addBoth(self.__release)
+
+    def __release(self, result):
+        self.active -= 1
+        self.__drain()
+        return result
+
+    def __drain(self):
+        while self.__queue and self.active < self.max_concurrency:
+            self.__start(self.__queue.popleft())
+
+    def queued(self) -> int:
+        return len(self.__queue)
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_limit": self.queue_limit,
+            "active": self.active,
+            "queued": len(self.__queue),
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,214 @@
+class _TrieNode:
+    __slots__ = ('exact', 'param', 'prefix_rank', 'end_rank', 'star_list')
+
+    def __init__(self):
+        self.exact = {}  # 绝对匹配子节点 {segment: _TrieNode}
+        self.param = None  # '{}' 子节点
+        self.prefix_rank = None  # 以 '*' 结尾的规则, 匹配其后的任意路径
+        self.end_rank = None  # 在此节点结束的规则 (最后一段为绝对匹配或 '{}')
+        self.star_list = []  # 位于中间的 '*' 规则 [(rank, rule_size), ...], 按 rank 升序
+
+
+class RouteTrie:
+    """
+    将 match_rule 编译为按 '/' 分段的前缀树, 每个节点包含 绝对匹配/'{}'/'*' 三类子槽位.
+
+    rank 为规则在 compare_match_rule 排序结果中的下标, 查找时返回所有命中规则中 rank 最小者,
+    因此与按优先级线性扫描 match_interface_by_path 的结果完全一致, 代价只与路径深度相关.
+
+    注: 与 match_interface_by_path 保持一致, 位于中间的 '*' 只与字面量 '*' 匹配,
+        且一旦匹配即视为整条规则匹配 (只要求规则长度不超过路径长度).
+    """
+    __slots__ = ('__root', '__values', '__literals')
+
+    def __init__(self, sorted_rules):
+        """
+        :param sorted_rules: 已按 compare_match_rule 排好序的 [(match_rule, value), ...]
+        """
+        self.__root = _TrieNode()
+        self.__values = []
+        # 每一层上出现过的字面量, 用于生成与具体参数无关的缓存键
+        self.__literals = []
+
+        for rank, (match_rule, value) in enumerate(sorted_rules):
+            self.__values.append(value)
+            self.__insert(match_rule.split('/'), rank)
+
+        self.__literals.append(frozenset())
+        self.__literals = tuple(frozenset(literals) for literals in self.__literals)
+
+    def __insert(self, rule_arr, rank):
+        rule_size = len(rule_arr)
+        node = self.__root
+
+        while len(self.__literals) < rule_size:
+            self.__literals.append(set())
+
+        for index in range(rule_size):
+            key = rule_arr[index]
+            last = index == rule_size - 1
+
+            if key == '*':
+                if last:
+                    if node.prefix_rank is None:
+                        node.prefix_rank = rank
+                else:
+                    # 中间的 '*' 只与字面量 '*' 匹配
+                    self.__literals[index].add('*')
+                    node.star_list.append((rank, rule_size))
+                return
+            elif key == '{}':
+                if node.param is None:
+                    node.param = _TrieNode()
+                node = node.param
+            else:
+                self.__literals[index].add(key)
+                child = node.exact.get(key)
+                if child is None:
+                    child = node.exact[key] = _TrieNode()
+                node = child
+
+        if node.end_rank is None:
+            node.end_rank = rank
+
+    def lookup(self, real_path: str):
+        """
+        返回命中规则中优先级最高者对应的 value, 未命中返回 None
+        """
+        path_arr = real_path.split('/')
+        path_size = len(path_arr)
+
+        best = None
+        stack = [(self.__root, 0)]
+        while stack:
+            node, depth = stack.pop()
+
+            if depth == path_size:
+                if node.end_rank is not None and (best is None or node.end_rank < best):
+                    best = node.end_rank
+                continue
+
+            # 路径还有剩余段, 以 '*' 结尾的规则必然命中
+            if node.prefix_rank is not None and (best is None or node.prefix_rank < best):
+                best = node.prefix_rank
+
+            key = path_arr[depth]
+
+            if node.star_list and key == '*':
+                for rank, rule_size in node.star_list:
+                    if best is not None and rank >= best:
+                        break
+                    if rule_size <= path_size:
+                        best = rank
+                        break
+
+            child = node.exact.get(key)
+            if child is not None:
+                stack.append((child, depth + 1))
+
+            if node.param is not None:
+                stack.append((node.param, depth + 1))
+
+        return None if best is None else self.__values[best]
+
+    def shape_key(self, real_path: str):
+        """
+        将路径归一化为规则形状:
+            0.未在对应层作为字面量出现过的段, 只可能被 '{}' 或 '*' 匹配, 统一替换为 None
+            1.超过最长规则的部分不影响匹配结果, 只保留 "更长" 这一信息
+        匹配结果只取决于形状, 因此 /info/<uuid>/status/log 这类路径会落到同一个键上.
+        """
+        literals = self.__literals
+        path_arr = real_path.split('/', len(literals) - 1)
+
+        return tuple(key if key in literals[index] else None for index, key in enumerate(path_arr))
+
+    def __len__(self):
+        return len(self.__values)
+
+
+class RouteCache:
+    """
+    以规则形状为键的有界路由缓存, 容量满时淘汰最早写入的条目.
+
+    不加锁: 字典的单次读写在 GIL 下是原子的, 并发淘汰时的冲突直接忽略;
+    统计计数同样不加锁, 并发下为近似值.
+    """
+    __slots__ = ('__capacity', '__data', 'hits', 'misses', 'evictions')
+
+    def __init__(self, capacity: int):
+        self.__capacity = capacity
+        self.__data = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        value = self.__data.get(key, default)
+        if value is default:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.__capacity <= 0:
+            return
+
+        data = self.__data
+        while len(data) >= self.__capacity:
+            try:
+                data.pop(next(iter(data)), None)
+            except (RuntimeError, StopIteration):
+                break
+            self.evictions += 1
+
+        data[key] = value
+
+    def stats(self):
+        return {
+            "capacity": self.__capacity,
+            "size": len(self.__data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class RouteTable:
+    """
+    不可变的路由表快照: 按优先级排序的规则列表 + 编译好的前缀树.
+
+    构建完成后不再修改, InterfaceManager 通过一次引用赋值发布新快照,
+    读者取得引用后即可无锁查找, 重新加载不会阻塞正在处理的请求.
+    """
+    __slots__ = ('__rules', '__trie', '__cache')
+
+    __miss = object()
+
+    def __init__(self, sorted_rules=(), cache_size=0):
+        self.__rules = tuple(sorted_rules)
+        self.__trie = RouteTrie(self.__rules)
+        # 缓存随快照一起替换, 不会读到旧路由表的结果
+        self.__cache = RouteCache(cache_size)
+
+    @property
+    def rules(self):
+        return self.__rules
+
+    def match_rules(self):
+        return [match_rule for match_rule, _ in self.__rules]
+
+    def lookup(self, real_path: str):
+        key = self.__trie.shape_key(real_path)
+        value = self.__cache.get(key, self.__miss)
+        if value is self.__miss:
+            value = self.__trie.lookup(real_path)
+            self.__cache.put(key, value)
+        return value
+
+    def cache_stats(self):
+        return self.__cache.stats()
+
+    def __len__(self):
+        return len(self.__rules)
@@ -1,20 +1,28 @@
-import json
 import traceback
 
 from twisted.web import server, resource
 from twisted.web.http import Request
-from twisted.internet import reactor
+from twisted.internet import reactor, threads
 
+from lib import json_tool
 from lib.conf_tool import http_conf
+from lib.cron_manager import CronManager
 from error_code import ErrorException, ERROR_SERVICE, ERROR_INTERFACE_METHOD, ERROR_INTERFACE_CONTENT_TYPE, \
-    ERROR_INTERFACE_REQUEST_JSON_INVALID, ERROR_INTERFACE_PARAM, OP_SUCCEEDED
+    ERROR_INTERFACE_REQUEST_JSON_INVALID, ERROR_INTERFACE_PARAM, ERROR_INTERFACE_NO_SUCH_MATCH_RULE, OP_SUCCEEDED, \
+    ERROR_CRON_JOB_NOT_FOUND
 from lib.interface_manager import InterfaceManager
+from lib.interface_watcher import InterfaceWatcher
+from lib.metrics import render_prometheus
+from lib.profiler import profile_mode_set, PROFILE_CPROFILE
 import logging
 
-from lib.log_utils import switch_log_level, log_level_set
+from lib.log_utils import switch_log_level, log_level_set, logging_stats
+from lib.response import BufferedRequest, error_response, send_response, write_json
+from lib.servers.service_server import SServer
+from lib.workers import WorkerSupervisor
 
 
-def interface_change_log_level(request: Request):
+def interface_change_log_level(request: Request, supervisor: WorkerSupervisor = None):
     try:
         if request.method.decode() != 'POST':
             raise ErrorException(ERROR_INTERFACE_METHOD)
@@ -25,7 +33,7 @@ def interface_change_log_level(request: Request):
         req_data = request.content.getvalue()
 
         try:
-            req_obj = json.loads(req_data.decode())
+            req_obj = json_tool.loads(req_data)
         except (Exception,):
             raise ErrorException(ERROR_INTERFACE_REQUEST_JSON_INVALID)
 
@@ -44,21 +52,19 @@ def interface_change_log_level(request: Request):
 
         logger = logging.getLogger()
         logger.setLevel(switch_log_level(log_level))
+
+        workers = None
+        if supervisor is not None:
+            workers = threads.blockingCallFromThread(reactor, supervisor.broadcast, {"command": "change_log_level"})
     except ErrorException as e:
         logging.error(traceback.format_exc())
-        res_obj = e.to_dict()
-
-        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-        request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-        request.setResponseCode(200)
-        request.finish()
+        send_response(request, error_response(e))
     else:
         res_obj = ErrorException(OP_SUCCEEDED).to_dict()
+        if workers is not None:
+            res_obj['workers'] = workers
 
-        request.setResponseCode(200)
-        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-        request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-        request.finish()
+        write_json(request, res_obj)
 
 
 def interface_get_log_level(request: Request):
@@ -70,28 +76,33 @@ def interface_get_log_level(request: Request):
 
     except ErrorException as e:
         logging.error(traceback.format_exc())
-        res_obj = e.to_dict()
-
-        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-        request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-        request.setResponseCode(200)
-        request.finish()
+        send_response(request, error_response(e))
     else:
         res_obj = ErrorException(OP_SUCCEEDED).to_dict()
-        res_obj['data'] = {"log_level": log_level}
+        res_obj['data'] = {"log_level": log_level, "logging": logging_stats()}
 
-        request.setResponseCode(200)
-        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-        request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-        request.finish()
+        write_json(request, res_obj)
 
 
 class MServer(resource.Resource):
     isLeaf = True
     __interface_manager = None
+    __supervisor = None
+    __service = None
+    __watcher = None
+    __cron = None
 
-    def __init__(self, interface_manager: InterfaceManager):
+    def __init__(self, interface_manager: InterfaceManager, supervisor: WorkerSupervisor = None,
+                 service: SServer = None, watcher: InterfaceWatcher = None, cron: CronManager = None):
         self.__interface_manager = interface_manager
+        # 多进程模式下的 worker 管理器, 部分管理命令需要转发给所有 worker
+        self.__supervisor = supervisor
+        # 单进程模式下本进程中的 service 服务, 用于查询运行状态
+        self.__service = service
+        # 接口目录的监视器, 未启用时为 None
+        self.__watcher = watcher
+        # 定时任务, 只在主进程中运行
+        self.__cron = cron
         super().__init__()
 
     def reload_interface(self, request: Request):
@@ -99,24 +110,25 @@ class MServer(resource.Resource):
             if request.method.decode() != 'POST':
                 raise ErrorException(ERROR_INTERFACE_METHOD)
 
-            result = self.__interface_manager.reload_interface()
+            # ?force=1 时重新导入全部接口文件, 否则只重新导入有变化的文件
+            force = request.args.get(b'force', [b''])[0] in (b'1', b'true')
+            result = self.__interface_manager.reload_interface(force)
+
+            workers = None
+            if self.__supervisor is not None:
+                workers = threads.blockingCallFromThread(reactor, self.__supervisor.broadcast,
+                                                         {"command": "reload_interface", "force": force})
 
         except ErrorException as e:
             logging.error(traceback.format_exc())
-            res_obj = e.to_dict()
-
-            request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-            request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-            request.setResponseCode(200)
-            request.finish()
+            send_response(request, error_response(e))
         else:
             res_obj = ErrorException(OP_SUCCEEDED).to_dict()
             res_obj['data'] = result
+            if workers is not None:
+                res_obj['workers'] = workers
 
-            request.setResponseCode(200)
-            request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-            request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-            request.finish()
+            write_json(request, res_obj)
 
     def list_interface(self, request: Request):
         try:
@@ -127,31 +139,330 @@ class MServer(resource.Resource):
 
         except ErrorException as e:
             logging.error(traceback.format_exc())
-            res_obj = e.to_dict()
+            send_response(request, error_response(e))
+        else:
+            res_obj = ErrorException(OP_SUCCEEDED).to_dict()
+            res_obj['data'] = result
 
-            request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-            request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-            request.setResponseCode(200)
-            request.finish()
+            write_json(request, res_obj)
+
+    def __get_data(self, request: Request, fun):
+        """
+        只读的 GET 管理接口, 返回值为 fun() 的结果
+        """
+        try:
+            if request.method.decode() != 'GET':
+                raise ErrorException(ERROR_INTERFACE_METHOD)
+
+            result = fun()
+
+        except ErrorException as e:
+            logging.error(traceback.format_exc())
+            send_response(request, error_response(e))
         else:
             res_obj = ErrorException(OP_SUCCEEDED).to_dict()
             res_obj['data'] = result
 
+            write_json(request, res_obj)
+
+    def __post_data(self, request: Request, fun):
+        """
+        JSON 正文的 POST 管理接口, 返回值为 fun(req_obj) 的结果, fun 中参数错误时抛出 ErrorException
+        """
+        try:
+            if request.method.decode() != 'POST':
+                raise ErrorException(ERROR_INTERFACE_METHOD)
+
+            if request.getHeader('Content-Type') != 'application/json':
+                raise ErrorException(ERROR_INTERFACE_CONTENT_TYPE)
+
+            try:
+                req_obj = json_tool.loads(request.content.getvalue())
+            except (Exception,):
+                raise ErrorException(ERROR_INTERFACE_REQUEST_JSON_INVALID)
+
+            if not isinstance(req_obj, dict):
+                raise ErrorException(ERROR_INTERFACE_PARAM)
+
+            result = fun(req_obj)
+
+        except ErrorException as e:
+            logging.error(traceback.format_exc())
+            send_response(request, error_response(e))
+        else:
+            res_obj = ErrorException(OP_SUCCEEDED).to_dict()
+            res_obj['data'] = result
+
+            write_json(request, res_obj)
+
+    def __fan_out(self, command: str, local_fun, args: dict = None):
+        """
+        多进程模式下将查询转发给所有 worker, 返回 [{"index":0, "pid":123, "result":...}, ...];
+        单进程模式下直接返回 local_fun() 的结果
+        """
+        if self.__supervisor is None:
+            return local_fun()
+
+        command = {"command": command}
+        if args is not None:
+            command["args"] = args
+        return threads.blockingCallFromThread(reactor, self.__supervisor.broadcast, command)
+
+    def route_cache_stats(self, request: Request):
+        self.__get_data(request, lambda: self.__fan_out("route_cache_stats",
+                                                         self.__interface_manager.route_cache_stats))
+
+    def route_limits(self, request: Request):
+        def local_fun():
+            if self.__service is None:
+                return {}
+            return threads.blockingCallFromThread(reactor, self.__service.limiter_stats)
+
+        self.__get_data(request, lambda: self.__fan_out("route_limits", local_fun))
+
+    def __metrics_snapshot(self):
+        if self.__service is None:
+            return {}
+        return threads.blockingCallFromThread(reactor, self.__service.metrics_snapshot)
+
+    def stats(self, request: Request):
+        self.__get_data(request, lambda: self.__fan_out("metrics", self.__metrics_snapshot))
+
+    def metrics(self, request: Request):
+        """
+        Prometheus 文本格式, 多进程模式下以 worker 标签区分各进程
+        """
+        try:
+            if request.method.decode() != 'GET':
+                raise ErrorException(ERROR_INTERFACE_METHOD)
+
+            if self.__supervisor is None:
+                snapshots = [({}, self.__metrics_snapshot())] if self.__service is not None else []
+            else:
+                snapshots = [({"worker": worker["index"]}, worker["result"])
+                             for worker in self.__fan_out("metrics", None) if worker.get("result")]
+
+        except ErrorException as e:
+            logging.error(traceback.format_exc())
+            send_response(request, error_response(e))
+        else:
             request.setResponseCode(200)
-            request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-            request.write(json.dumps(res_obj).encode(encoding='utf_8'))
+            request.responseHeaders.addRawHeader(b"content-type", b"text/plain; version=0.0.4; charset=utf-8")
+            request.write(render_prometheus(snapshots).encode(encoding='utf_8'))
             request.finish()
 
+    def reload_status(self, request: Request):
+        def fun():
+            result = {
+                "watcher": self.__watcher.status() if self.__watcher is not None else None,
+                "last_reload": self.__interface_manager.last_reload(),
+            }
+            if self.__supervisor is not None:
+                result["workers"] = self.__fan_out("last_reload", None)
+            return result
+
+        self.__get_data(request, fun)
+
+    def __profiler(self):
+        if self.__service is None:
+            raise ErrorException(ERROR_INTERFACE_PARAM)
+        return self.__service.profiler
+
+    @staticmethod
+    def __positive(req_obj: dict, key: str, kind=(int, float)):
+        value = req_obj.get(key)
+        if value is None:
+            return None
+        if isinstance(value, bool) or not isinstance(value, kind) or value <= 0:
+            raise ErrorException(ERROR_INTERFACE_PARAM)
+        return value
+
+    def profile_start(self, request: Request):
+        """
+        {"match_rule": "/path/{}", "mode": "cprofile" | "sample", "requests": 100, "seconds": 60, "interval_ms": 5}
+        requests 与 seconds 均未指定时分析 100 个请求
+        """
+        def fun(req_obj):
+            match_rule = req_obj.get('match_rule')
+            mode = req_obj.get('mode', PROFILE_CPROFILE)
+            if not isinstance(match_rule, str) or mode not in profile_mode_set:
+                raise ErrorException(ERROR_INTERFACE_PARAM)
+
+            args = {
+                "rule": match_rule,
+                "mode": mode,
+                "max_requests": self.__positive(req_obj, 'requests', int),
+                "seconds": self.__positive(req_obj, 'seconds'),
+                "interval_ms": self.__positive(req_obj, 'interval_ms') or 5,
+            }
+            if args["max_requests"] is None and args["seconds"] is None:
+                args["max_requests"] = 100
+            return self.__fan_out("profile_start", lambda: self.__profiler().start(**args), args)
+
+        self.__post_data(request, fun)
+
+    def profile_stop(self, request: Request):
+        def fun(req_obj):
+            match_rule = req_obj.get('match_rule')
+            if not isinstance(match_rule, str):
+                raise ErrorException(ERROR_INTERFACE_PARAM)
+
+            result = self.__fan_out("profile_stop", lambda: self.__profiler().stop(match_rule), {"rule": match_rule})
+            if result is None:
+                raise ErrorException(ERROR_INTERFACE_NO_SUCH_MATCH_RULE)
+            return result
+
+        self.__post_data(request, fun)
+
+    def profile_result(self, request: Request):
+        """
+        ?match_rule=/path/{}&limit=100, cprofile 的结果为 pstats 文本, sample 的结果为 collapsed stack
+        """
+        def fun():
+            match_rule = request.args.get(b'match_rule', [b''])[0].decode(errors='replace')
+            try:
+                limit = int(request.args.get(b'limit', [b'100'])[0])
+            except ValueError:
+                raise ErrorException(ERROR_INTERFACE_PARAM)
+
+            args = {"rule": match_rule, "limit": limit}
+            result = self.__fan_out("profile_result", lambda: self.__profiler().result(**args), args)
+            if result is None:
+                raise ErrorException(ERROR_INTERFACE_NO_SUCH_MATCH_RULE)
+            return result
+
+        self.__get_data(request, fun)
+
+    def profile_status(self, request: Request):
+        self.__get_data(request, lambda: self.__fan_out("profile_status", lambda: self.__profiler().status()))
+
+    def slow_requests(self, request: Request):
+        """
+        GET 返回自动记录的慢请求调用栈, POST {"slow_ms": 500} 设置阈值, 0 为关闭
+        """
+        if request.method.decode() == 'GET':
+            self.__get_data(request, lambda: self.__fan_out("slow_requests", lambda: self.__profiler().slow_requests()))
+            return
+
+        def fun(req_obj):
+            slow_ms = req_obj.get('slow_ms')
+            if isinstance(slow_ms, bool) or not isinstance(slow_ms, (int, float)) or slow_ms < 0:
+                raise ErrorException(ERROR_INTERFACE_PARAM)
+
+            args = {"slow_ms": slow_ms}
+            return self.__fan_out("set_slow", lambda: self.__profiler().set_slow(slow_ms), args)
+
+        self.__post_data(request, fun)
+
+    def __response_cache(self):
+        if self.__service is None:
+            raise ErrorException(ERROR_INTERFACE_PARAM)
+        return self.__service.response_cache
+
+    def response_cache(self, request: Request):
+        self.__get_data(request, lambda: self.__fan_out(
+            "response_cache", lambda: threads.blockingCallFromThread(reactor, self.__response_cache().stats)))
+
+    def invalidate_cache(self, request: Request):
+        """
+        {"match_rule": "/path/{}"} 或 {"prefix": "/path/"}, 同时指定时须同时满足, 均未指定时清空全部缓存
+        """
+        def fun(req_obj):
+            args = {"rule": req_obj.get('match_rule'), "prefix": req_obj.get('prefix')}
+            if any(value is not None and not isinstance(value, str) for value in args.values()):
+                raise ErrorException(ERROR_INTERFACE_PARAM)
+
+            return self.__fan_out("invalidate_cache", lambda: {"invalidated": threads.blockingCallFromThread(
+                reactor, self.__response_cache().invalidate, **args)}, args)
+
+        self.__post_data(request, fun)
+
+    def list_cron(self, request: Request):
+        self.__get_data(request, lambda: self.__cron.list_cron() if self.__cron is not None else [])
+
+    def reload_cron(self, request: Request):
+        try:
+            if request.method.decode() != 'POST':
+                raise ErrorException(ERROR_INTERFACE_METHOD)
+
+            # ?force=1 时重新导入全部任务文件
+            force = request.args.get(b'force', [b''])[0] in (b'1', b'true')
+            result = self.__cron.reload_cron(force) if self.__cron is not None else []
+
+        except ErrorException as e:
+            logging.error(traceback.format_exc())
+            send_response(request, error_response(e))
+        else:
+            res_obj = ErrorException(OP_SUCCEEDED).to_dict()
+            res_obj['data'] = result
+
+            write_json(request, res_obj)
+
+    def run_cron(self, request: Request):
+        """
+        POST {"name": "任务文件名"} 立即执行一次
+        """
+        def fun(req_obj):
+            name = req_obj.get('name')
+            if not isinstance(name, str):
+                raise ErrorException(ERROR_INTERFACE_PARAM)
+
+            if self.__cron is None or not self.__cron.run_cron(name):
+                raise ErrorException(ERROR_CRON_JOB_NOT_FOUND)
+            return {"name": name}
+
+        self.__post_data(request, fun)
+
+    def list_workers(self, request: Request):
+        def fun():
+            if self.__supervisor is None:
+                return []
+            return threads.blockingCallFromThread(reactor, self.__supervisor.list_workers)
+
+        self.__get_data(request, fun)
+
     def __do_fun(self, request: Request):
         try:
             if request.path.decode() == "/reload_interface":
                 self.reload_interface(request)
             elif request.path.decode() == "/change_log_level":
-                interface_change_log_level(request)
+                interface_change_log_level(request, self.__supervisor)
             elif request.path.decode() == "/get_log_level":
                 interface_get_log_level(request)
             elif request.path.decode() == "/list_interface":
                 self.list_interface(request)
+            elif request.path.decode() == "/route_cache_stats":
+                self.route_cache_stats(request)
+            elif request.path.decode() == "/route_limits":
+                self.route_limits(request)
+            elif request.path.decode() == "/stats":
+                self.stats(request)
+            elif request.path.decode() == "/metrics":
+                self.metrics(request)
+            elif request.path.decode() == "/list_workers":
+                self.list_workers(request)
+            elif request.path.decode() == "/reload_status":
+                self.reload_status(request)
+            elif request.path.decode() == "/profile_start":
+                self.profile_start(request)
+            elif request.path.decode() == "/profile_stop":
+                self.profile_stop(request)
+            elif request.path.decode() == "/profile_result":
+                self.profile_result(request)
+            elif request.path.decode() == "/profile_status":
+                self.profile_status(request)
+            elif request.path.decode() == "/slow_requests":
+                self.slow_requests(request)
+            elif request.path.decode() == "/response_cache":
+                self.response_cache(request)
+            elif request.path.decode() == "/invalidate_cache":
+                self.invalidate_cache(request)
+            elif request.path.decode() == "/list_cron":
+                self.list_cron(request)
+            elif request.path.decode() == "/reload_cron":
+                self.reload_cron(request)
+            elif request.path.decode() == "/run_cron":
+                self.run_cron(request)
             else:
                 request.setResponseCode(404)
                 request.finish()
@@ -160,12 +471,9 @@ class MServer(resource.Resource):
             logging.error('MServer Exception path:%s Exception:%s\n %s' %
                           (request.path.decode(), repr(e), traceback.format_exc()))
 
-            res_obj = {'status': 0, 'msg': ErrorException(ERROR_SERVICE).get_msg()}
-            request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-            request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-            request.setResponseCode(200)
-            request.finish()
+            write_json(request, {'status': 0, 'msg': ErrorException(ERROR_SERVICE).get_msg()})
 
     def render(self, request):
-        reactor.callInThread(self.__do_fun, request)
+        # 管理接口均在线程池中执行, 响应经 BufferedRequest 交回 reactor 线程写出
+        reactor.callInThread(self.__do_fun, BufferedRequest(request))
         return server.NOT_DONE_YET
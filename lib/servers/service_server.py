@@ -1,77 +1,375 @@
-import json
+import time
 import traceback
 
 from twisted.web import server, resource
 from twisted.web.http import Request
-from twisted.internet import reactor
+from twisted.internet import threads
+from twisted.python.failure import Failure
 
 from error_code import ErrorException, ERROR_SERVICE_INTERFACE, ERROR_SERVICE, \
-    ERROR_INTERFACE_NOT_FINISHED
-from lib.interface_manager import InterfaceManager
+    ERROR_INTERFACE_NOT_FINISHED, ERROR_INTERFACE_BUSY, ERROR_INTERFACE_BODY_TOO_LARGE
+from lib import command, compression
+from lib.access_log import AccessLog
+from lib.async_bridge import call_on_reactor
+from lib.interface_manager import InterfaceManager, Interface, EXECUTION_THREAD, EXECUTION_PROCESS
+from lib.metrics import Metrics
+from lib.process_pool import ProcessPool
+from lib.profiler import Profiler
+from lib.response import BufferedRequest, json_response, error_response, send_response, filter_response
+from lib.response_cache import ResponseCache, cache_key, tag_response
+from lib.route_limiter import RouteLimiter
 import logging
 
 
+def _compress_and_tag(request, response):
+    # ETag 按实际写出的 (压缩后的) 正文生成
+    return tag_response(request, compression.compress_filter(request, response))
+
+
 # 除上传下载外, 能识别的错误均使用 200,错误信息在 json 中体现
 class SServer(resource.Resource):
     isLeaf = True
     __interface_manager = None
+    # 固定的错误响应在导入时生成, 不必每次序列化
+    __busy_response = error_response(ErrorException(ERROR_INTERFACE_BUSY), 503)
+    __too_large_response = error_response(ErrorException(ERROR_INTERFACE_BODY_TOO_LARGE), 413)
+    __service_error_response = json_response({'status': 0, 'msg': ErrorException(ERROR_SERVICE).get_msg()})
 
-    def __init__(self, interface_manager: InterfaceManager):
+    def __init__(self, interface_manager: InterfaceManager, access_log: AccessLog = None, profiler: Profiler = None,
+                 process_pool: ProcessPool = None, response_cache: ResponseCache = None):
         self.__interface_manager = interface_manager
+        self.__access_log = access_log
+        # 由 MGMT 服务开启的性能分析, 未开启时不包装接口函数
+        self.profiler = profiler if profiler is not None else Profiler()
+        # execution = "process" 的接口使用的进程池, 首次使用时启动
+        self.process_pool = process_pool if process_pool is not None else ProcessPool()
+        # 声明了 cache_ttl 的接口的响应缓存, 只在 reactor 线程中访问
+        self.response_cache = response_cache if response_cache is not None else ResponseCache()
+        # {match_rule: RouteLimiter}, 只在 reactor 线程中访问
+        self.__limiters = {}
+        # 请求统计, 只在 reactor 线程中记录
+        self.__metrics = Metrics()
         super().__init__()
 
-    def __do_fun(self, request: Request):
+    @staticmethod
+    def __send_error(request: Request, response):
+        """
+        写出错误响应. 错误响应同样使用 200, 不能带 ETag 而被客户端缓存或返回 304, 只保留压缩.
+        在线程池中调用时 response_filter 随后在同一线程中执行, 可以直接修改.
+        接口已结束请求后才抛出异常时响应已写出, 只记录日志
+        """
+        raw = getattr(request, 'raw_request', request)
+        if request.finished or raw.finished:
+            logging.error('Error response dropped, request already finished path:%s',
+                          raw.path.decode(errors='replace'))
+            return
+        response_filter = getattr(raw, 'response_filter', None)
+        if response_filter is _compress_and_tag:
+            raw.response_filter = compression.compress_filter
+        elif response_filter is tag_response:
+            raw.response_filter = None
+        send_response(request, response)
+
+    def __interface_error(self, request: Request, e: BaseException, tb):
+        """
+        返回写入响应的错误码
+        :param tb: 返回异常堆栈的无参函数, 只在需要写日志时调用
+        """
+        if isinstance(e, ErrorException):
+            # 接口主动抛出的 ErrorException 很常见, debug 关闭时不生成堆栈
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(tb())
+            self.__send_error(request, error_response(e))
+            return e.get_code()
+        else:
+            logging.error('Interface Exception path:%s Exception:%s\n %s',
+                          request.path.decode(), repr(e), tb())
+            e = ErrorException(ERROR_SERVICE_INTERFACE)
+            self.__send_error(request, error_response(e))
+            return e.get_code()
+
+    def __check_finished(self, request: Request):
+        """
+        接口未结束请求时返回 ERROR_INTERFACE_NOT_FINISHED 的错误码, 否则返回 None
+        """
+        # 客户端已断开时请求无法再结束 (如流式响应写出过程中断开)
+        if request.finished != 1 and not getattr(request, 'disconnected', False):
+            e = ErrorException(ERROR_INTERFACE_NOT_FINISHED)
+            logging.error('Interface Exception path:%s Exception:%s\n %s' %
+                          (request.path.decode(), e.get_msg(), traceback.format_exc()))
+
+            self.__send_error(request, error_response(e))
+            return e.get_code()
+        return None
+
+    def __service_error(self, request: Request, e: BaseException, tb: str):
+        logging.error('SServer Exception path:%s Exception:%s\n %s' %
+                      (request.path.decode(errors='replace'), repr(e), tb))
+
         try:
-            interface_function = self.__interface_manager.match_interface(request.path.decode())
-            if interface_function is None:
-                logging.debug('Interface Not Found path:%s\n %s' %
-                              (request.path.decode(), traceback.format_exc()))
-                request.setResponseCode(404)
-                request.finish()
-            else:
-                try:
-                    interface_function(request)
-                except ErrorException as e:
-                    logging.debug(traceback.format_exc())
-                    res_obj = e.to_dict()
-
-                    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-                    request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-                    request.setResponseCode(200)
-                    request.finish()
-                except BaseException as e:
-                    logging.error('Interface Exception path:%s Exception:%s\n %s' %
-                                  (request.path.decode(), repr(e), traceback.format_exc()))
-
-                    res_obj = ErrorException(ERROR_SERVICE_INTERFACE).to_dict()
-
-                    request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-                    request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-                    request.setResponseCode(200)
-                    request.finish()
-                finally:
-                    if request.finished != 1:
-                        e = ErrorException(ERROR_INTERFACE_NOT_FINISHED)
-                        logging.error('Interface Exception path:%s Exception:%s\n %s' %
-                                      (request.path.decode(), e.get_msg(), traceback.format_exc()))
-
-                        res_obj = e.to_dict()
-
-                        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-                        request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-                        request.setResponseCode(200)
-                        request.finish()
+            self.__send_error(request, self.__service_error_response)
+        except BaseException as send_e:
+            # 错误响应也无法写出时只记录日志, 调用方仍需返回统计结果
+            logging.error('SServer send error response failed path:%s Exception:%s',
+                          request.path.decode(errors='replace'), repr(send_e))
+        return ErrorException(ERROR_SERVICE).get_code()
+
+    def __do_fun(self, request: BufferedRequest, function):
+        """
+        在线程池中执行, request 为 BufferedRequest, 响应在 finish 时统一交给 reactor 线程写出
+        function 为接口函数, 开启性能分析时为 Profiler.wrap 包装后的函数
+        :return: (开始执行时间, 结束时间, 错误码), 由 reactor 线程记录统计
+        """
+        started_at = time.perf_counter()
+        error_code = None
+        try:
+            try:
+                function(request)
+            except BaseException as e:
+                error_code = self.__interface_error(request, e, traceback.format_exc)
+            finally:
+                error_code = self.__check_finished(request) or error_code
         except BaseException as e:
-            logging.error('SServer Exception path:%s Exception:%s\n %s' %
-                          (request.path.decode(), repr(e), traceback.format_exc()))
+            error_code = self.__service_error(request, e, traceback.format_exc())
 
-            res_obj = {'status': 0, 'msg': ErrorException(ERROR_SERVICE).get_msg()}
-            request.responseHeaders.addRawHeader(b"content-type", b"application/json")
-            request.write(json.dumps(res_obj).encode(encoding='utf_8'))
-            request.setResponseCode(200)
-            request.finish()
+        return started_at, time.perf_counter(), error_code
+
+    def __do_fun_reactor(self, request: Request, function):
+        """
+        在 reactor 线程中执行 EXECUTION_INLINE/EXECUTION_ASYNC 接口, 不占用线程池
+        """
+        started_at = time.perf_counter()
+        error_code = None
+
+        def on_error(failure):
+            nonlocal error_code
+            error_code = self.__interface_error(request, failure.value, failure.getTraceback)
+
+        def on_done(_):
+            nonlocal error_code
+            error_code = self.__check_finished(request) or error_code
+
+        def on_service_error(failure):
+            nonlocal error_code
+            error_code = self.__service_error(request, failure.value, failure.getTraceback())
+
+        def on_result(_):
+            return started_at, time.perf_counter(), error_code
+
+        d = call_on_reactor(function, request)
+        d.addErrback(on_error)
+        d.addCallback(on_done)
+        d.addErrback(on_service_error)
+        d.addCallback(on_result)
+        return d
+
+    def __do_fun_process(self, request: Request, interface: Interface):
+        """
+        在进程池中执行 EXECUTION_PROCESS 接口, 子进程返回的 Response 在 reactor 线程中写出
+        """
+        started_at = time.perf_counter()
+
+        def on_result(result):
+            response, e, tb = result
+            if e is not None:
+                error_code = self.__interface_error(request, e, lambda: tb)
+            elif response is None:
+                error_code = self.__check_finished(request)
+            elif getattr(request, 'response_filter', None) is not None:
+                # 压缩等处理在线程池中进行
+                d = threads.deferToThread(filter_response, request, response)
+                d.addCallback(lambda filtered: filtered.send(request))
+                d.addCallback(lambda _: (started_at, time.perf_counter(), None))
+                return d
+            else:
+                send_response(request, response)
+                error_code = None
+            return started_at, time.perf_counter(), error_code
+
+        def on_service_error(failure):
+            error_code = self.__service_error(request, failure.value, failure.getTraceback())
+            return started_at, time.perf_counter(), error_code
+
+        d = self.process_pool.submit(interface.module.__name__, request)
+        d.addCallback(on_result)
+        d.addErrback(on_service_error)
+        return d
+
+    def __dispatch(self, request: Request, interface: Interface, accepted_at: float):
+        """
+        开始处理请求, 返回接口执行完成时触发的 Deferred
+        """
+        metrics = self.__metrics.request_started(interface.match_rule)
+
+        def on_result(result):
+            if isinstance(result, Failure):
+                # 执行接口的 Deferred 出错时同样结束统计, 否则 in_flight 无法归零
+                logging.error('SServer dispatch failed path:%s Exception:%s\n %s',
+                              request.path.decode(errors='replace'), repr(result.value), result.getTraceback())
+                started_at, finished_at, error_code = accepted_at, time.perf_counter(), \
+                    ErrorException(ERROR_SERVICE).get_code()
+            else:
+                started_at, finished_at, error_code = result
+            self.__metrics.request_finished(metrics, started_at - accepted_at, finished_at - started_at, error_code)
+            self.__access(request, interface.match_rule, error_code, started_at - accepted_at, finished_at - started_at)
+            if getattr(request, 'response_capture', None) is not None and error_code is None:
+                self.__cache_store(request, interface)
+
+        if interface.execution == EXECUTION_PROCESS:
+            d = self.__do_fun_process(request, interface)
+            d.addBoth(on_result)
+            return d
+
+        function = interface.function
+        if self.profiler.active:
+            function = self.profiler.wrap(interface.match_rule, function)
+
+        if interface.execution == EXECUTION_THREAD:
+            d = threads.deferToThread(self.__do_fun, BufferedRequest(request), function)
+        else:
+            d = self.__do_fun_reactor(request, function)
+        d.addBoth(on_result)
+        return d
+
+    def __access(self, request: Request, rule, error_code, queue_wait: float = None, handler_time: float = None):
+        """
+        写访问日志, 响应尚未结束 (如流式响应) 时在结束后再写
+        """
+        access_log = self.__access_log
+        if access_log is None:
             return
 
+        if request.finished or getattr(request, 'disconnected', False):
+            access_log.record(request, rule, error_code, queue_wait, handler_time)
+        else:
+            request.notifyFinish().addBoth(
+                lambda _: access_log.record(request, rule, error_code, queue_wait, handler_time))
+
+    def __prepare(self, request: Request, interface: Interface, accepted_at: float) -> bool:
+        """
+        协商压缩编码并设置 response_filter; 命中响应缓存时直接写出并返回 True,
+        未命中的 GET 请求开始记录响应, 接口正常结束后保存
+        """
+        if not hasattr(request, 'response_filter'):
+            # 不是 InterfaceRequest
+            return False
+
+        if interface.compress and compression.encodings:
+            request.response_encoding = compression.negotiate(request)
+            request.response_filter = compression.compress_filter
+
+        if interface.cache_ttl is None or not self.response_cache.enabled or request.method not in (b'GET', b'HEAD'):
+            return False
+
+        key = cache_key(interface, request)
+        entry = self.response_cache.get(key)
+        if entry is None:
+            if request.method == b'GET':
+                request.cache_key = key
+                request.response_capture = []
+                request.capture_limit = self.response_cache.max_entry_bytes
+                request.response_filter = tag_response if request.response_filter is None else _compress_and_tag
+            return False
+
+        metrics = self.__metrics.request_started(interface.match_rule)
+
+        def on_sent(_):
+            self.__metrics.request_finished(metrics, 0.0, time.perf_counter() - accepted_at)
+            self.__access(request, interface.match_rule, None, 0.0, time.perf_counter() - accepted_at)
+
+        self.response_cache.serve(entry, request, request.response_encoding).addCallback(on_sent)
+        return True
+
+    def __cache_store(self, request: Request, interface: Interface):
+        """
+        响应尚未结束 (如流式响应) 时在结束后再保存, 客户端断开时不保存
+        """
+        def store(_=None):
+            self.response_cache.put(request.cache_key, request, interface.cache_ttl)
+
+        if request.finished:
+            store()
+        elif not getattr(request, 'disconnected', False):
+            request.notifyFinish().addCallbacks(store, lambda _: None)
+
+    def __limiter(self, interface: Interface):
+        if interface.max_concurrency is None:
+            self.__limiters.pop(interface.match_rule, None)
+            return None
+
+        limiter = self.__limiters.get(interface.match_rule)
+        if limiter is None:
+            limiter = self.__limiters[interface.match_rule] = RouteLimiter(interface.max_concurrency,
+                                                                           interface.queue_limit)
+        elif limiter.max_concurrency != interface.max_concurrency or limiter.queue_limit != interface.queue_limit:
+            # 重新载入后参数发生变化
+            limiter.configure(interface.max_concurrency, interface.queue_limit)
+        return limiter
+
+    def limiter_stats(self):
+        """
+        只能在 reactor 线程中调用
+        """
+        return {match_rule: limiter.stats() for match_rule, limiter in self.__limiters.items()}
+
+    def metrics_snapshot(self):
+        """
+        只能在 reactor 线程中调用
+        """
+        snapshot = self.__metrics.snapshot()
+        if self.__access_log is not None:
+            snapshot["access_log"] = self.__access_log.stats()
+        if self.process_pool.running:
+            snapshot["process_pool"] = self.process_pool.stats()
+        if self.response_cache.enabled:
+            snapshot["response_cache"] = self.response_cache.stats()
+        snapshot["commands"] = command.stats()
+        return snapshot
+
+    def reject_body(self, request: Request):
+        """
+        请求正文超过 max_body_size, 由 InterfaceRequest 在接收正文时调用, 之后不会再调用 render
+        """
+        rule = request.interface.match_rule
+        self.__metrics.request_rejected(rule, ERROR_INTERFACE_BODY_TOO_LARGE[0])
+        self.__too_large_response.send(request)
+        self.__access(request, rule, ERROR_INTERFACE_BODY_TOO_LARGE[0])
+
     def render(self, request):
-        reactor.callInThread(self.__do_fun, request)
+        accepted_at = time.perf_counter()
+        if getattr(request, 'interface_matched', False):
+            # InterfaceRequest 在收到请求头时已完成匹配
+            interface = request.interface
+        else:
+            try:
+                interface = self.__interface_manager.match_interface(request.path.decode())
+            except BaseException as e:
+                error_code = self.__service_error(request, e, traceback.format_exc())
+                self.__access(request, None, error_code)
+                return server.NOT_DONE_YET
+
+        if interface is None:
+            logging.debug('Interface Not Found path:%s', request.path.decode())
+            self.__metrics.not_found += 1
+            request.setResponseCode(404)
+            request.finish()
+            self.__access(request, None, None)
+        elif getattr(request, 'body_error', None) is not None:
+            # interface_body_chunk 抛出了异常
+            error_code = self.__interface_error(request, request.body_error.value, request.body_error.getTraceback)
+            self.__metrics.request_rejected(interface.match_rule, error_code)
+            self.__access(request, interface.match_rule, error_code)
+        elif self.__prepare(request, interface, accepted_at):
+            # 命中响应缓存
+            return server.NOT_DONE_YET
+        else:
+            limiter = self.__limiter(interface)
+            if limiter is None:
+                self.__dispatch(request, interface, accepted_at)
+            elif not limiter.submit(request, lambda: self.__dispatch(request, interface, accepted_at)):
+                logging.debug('Interface Busy path:%s match_rule:%s', request.path.decode(), interface.match_rule)
+                self.__metrics.request_rejected(interface.match_rule, ERROR_INTERFACE_BUSY[0])
+                self.__busy_response.send(request)
+                self.__access(request, interface.match_rule, ERROR_INTERFACE_BUSY[0])
+
         return server.NOT_DONE_YET
@@ -1,74 +1,454 @@
+import itertools
+import logging
+import queue
 import sqlite3
+import threading
+import weakref
+
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+# 单条 IN 查询的参数个数上限, 低于旧版本 SQLite 的 SQLITE_MAX_VARIABLE_NUMBER (999)
+_IN_CHUNK = 500
+
+# SQLite 的 NOCASE 只忽略 ASCII 字母的大小写
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+_MAX_CODE_POINT = 0x10FFFF
+_SURROGATE_FIRST = 0xD800
+_SURROGATE_LAST = 0xDFFF
+_UPPER_FIRST = ord('A')
+_UPPER_LAST = ord('Z')
+
+
+def _prefix_upper_bound(prefix: str, nocase: bool = False):
+    """
+    大于所有以 prefix 开头的字符串的最小字符串, 不存在时返回 None. UTF-8 的字节序与码位顺序一致.
+    nocase 为 True 时 prefix 须已转为小写, 结果用于 NOCASE 比较: NOCASE 先将 'A'-'Z' 转为小写再比较,
+    因此结果中不能出现大写字母 (如 '@' + 1 == 'A' 会被当作 'a', 使 '[' ~ '`' 开头的 key 落入区间), 跳到 '['
+    """
+    chars = list(prefix)
+    while chars:
+        code = ord(chars[-1]) + 1
+        if nocase and _UPPER_FIRST <= code <= _UPPER_LAST:
+            code = _UPPER_LAST + 1
+        if _SURROGATE_FIRST <= code <= _SURROGATE_LAST:
+            # 代理码位无法以 UTF-8 编码
+            code = _SURROGATE_LAST + 1
+        if code <= _MAX_CODE_POINT:
+            chars[-1] = chr(code)
+            return ''.join(chars)
+        chars.pop()
+    return None
+
+
+def _connect(database: str, uri: bool, timeout: float, synchronous: str):
+    conn = sqlite3.connect(database, isolation_level=None, check_same_thread=False, timeout=timeout, uri=uri)
+    conn.execute('PRAGMA synchronous=%s' % synchronous)
+    if uri:
+        # 共享缓存的内存数据库使用表级锁, 读连接不加读锁, 避免与写线程互相阻塞 (SQLITE_LOCKED)
+        conn.execute('PRAGMA read_uncommitted=1')
+    return conn
+
+
+class _WriteOp:
+    """
+    sql 为 None 时不执行任何语句, 仅用于等待此前的写操作提交 (flush)
+    """
+    __slots__ = ('sql', 'params', 'many', 'seq', 'done', 'rowcount', 'error')
+
+    def __init__(self, sql, params, many=False, seq=None):
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.seq = seq  # write_behind 写入的序号
+        self.done = threading.Event()
+        self.rowcount = 0
+        self.error = None
+
+
+class _Writer(threading.Thread):
+    """
+    唯一的写线程: 把队列中的多个写操作合并到一个事务中提交, 每个操作使用独立的 SAVEPOINT,
+    单个操作失败 (如 insert 的唯一约束) 只回滚该操作.
+    """
+    __stop = object()
+
+    def __init__(self, connect, batch_size: int, batch_delay: float, on_committed):
+        """
+        :param connect: 创建写连接的无参函数, 不能引用 KeyValueStore, 否则 KeyValueStore 无法被回收
+        :param on_committed: 每个事务提交后以该批写操作调用, 为 weakref.WeakMethod
+        """
+        super().__init__(name='kv-writer', daemon=True)
+        self.__connect = connect
+        self.__batch_size = batch_size
+        self.__batch_delay = batch_delay
+        self.__on_committed = on_committed
+        self.__queue = queue.Queue()
+        self.batches = 0
+        self.ops = 0
+
+    def submit(self, op: _WriteOp):
+        self.__queue.put(op)
+
+    def stop(self):
+        self.__queue.put(self.__stop)
+        self.join()
+
+    def __collect(self, first):
+        batch = [first]
+        while len(batch) < self.__batch_size:
+            try:
+                if self.__batch_delay > 0:
+                    op = self.__queue.get(timeout=self.__batch_delay)
+                else:
+                    op = self.__queue.get_nowait()
+            except queue.Empty:
+                break
+            if op is self.__stop:
+                # 放回, 本批提交后退出
+                self.__queue.put(op)
+                break
+            batch.append(op)
+        return batch
+
+    def run(self):
+        conn = self.__connect()
+        try:
+            while True:
+                first = self.__queue.get()
+                if first is self.__stop:
+                    return
+
+                batch = self.__collect(first)
+                self.__commit(conn, batch)
+                self.batches += 1
+                self.ops += len(batch)
+                on_committed = self.__on_committed()
+                if on_committed is not None:
+                    on_committed(batch)
+                for op in batch:
+                    op.done.set()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def __commit(conn, batch):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for op in batch:
+                if op.sql is None:
+                    continue
+                conn.execute('SAVEPOINT op')
+                try:
+                    if op.many:
+                        cursor = conn.executemany(op.sql, op.params)
+                    else:
+                        cursor = conn.execute(op.sql, op.params)
+                    op.rowcount = cursor.rowcount
+                except sqlite3.Error as e:
+                    conn.execute('ROLLBACK TO op')
+                    op.error = e
+                conn.execute('RELEASE op')
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            logging.error('KeyValueStore commit failed: %r' % e)
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for op in batch:
+                if op.error is None:
+                    op.error = e
 
 
 class KeyValueStore(dict):
-    def __init__(self, filename=None):
-        self.__conn = sqlite3.connect(filename, isolation_level=None)
-        self.__conn.execute("CREATE TABLE IF NOT EXISTS kv (key text unique, value text)")
+    """
+    基于 SQLite 的键值存储, 可以在多个线程中共享:
+        0.每个线程使用独立的读连接, WAL 模式下读不阻塞写
+        1.所有写操作由唯一的写线程合并为事务提交 (group commit), 并发的写入共用一次 fsync
+        2.write_behind 为 True 时 __setitem__/update 不等待提交, 未提交的值对本实例的读操作可见;
+          insert/__delitem__ 需要返回错误, 始终等待提交
+    :param synchronous: PRAGMA synchronous, WAL 模式下 NORMAL 不会损坏数据库, 仅在断电时可能丢失最近的事务
+    :param batch_size: 单个事务最多合并的写操作数
+    :param batch_delay: 写线程收到第一个写操作后等待更多写操作的秒数, 0 为只合并已在队列中的写操作
+    :param nocase_index: 创建 key COLLATE NOCASE 索引, 用于不区分大小写的前缀查询 (默认方式)
+    """
+
+    def __init__(self, filename=None, synchronous: str = 'NORMAL', write_behind: bool = False,
+                 batch_size: int = 1000, batch_delay: float = 0.0, timeout: float = 30, nocase_index: bool = True):
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError('synchronous must be one of %s' % (SYNCHRONOUS_MODES,))
+
+        self.__synchronous = synchronous.upper()
+        self.__timeout = timeout
+        self.__write_behind = write_behind
+        if filename is None or filename == ':memory:':
+            # 内存数据库须以共享缓存的方式才能在多个连接间共享
+            self.__database = 'file:kv_memory_%d?mode=memory&cache=shared' % id(self)
+            self.__uri = True
+        else:
+            self.__database = filename
+            self.__uri = False
+
+        self.__local = threading.local()
+        self.__connections = []
+        self.__connections_lock = threading.Lock()
+        self.__closed = False
+
+        # 保持至少一个连接, 共享缓存的内存数据库在最后一个连接关闭时销毁
+        conn = self.__conn()
+        if not self.__uri:
+            conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute("CREATE TABLE IF NOT EXISTS kv (key text unique, value text)")
+        if nocase_index:
+            conn.execute("CREATE INDEX IF NOT EXISTS kv_key_nocase ON kv (key COLLATE NOCASE)")
+
+        # {key: (seq, value)}, write_behind 模式下尚未提交的写入
+        self.__pending = {}
+        self.__pending_lock = threading.Lock()
+        self.__seq = itertools.count()
+        database, uri, timeout, synchronous = self.__database, self.__uri, self.__timeout, self.__synchronous
+        self.__writer = _Writer(lambda: _connect(database, uri, timeout, synchronous), batch_size, batch_delay,
+                                weakref.WeakMethod(self.__committed))
+        self.__writer.start()
+
+    def __conn(self):
+        """
+        当前线程的读连接
+        """
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            if self.__closed:
+                raise sqlite3.ProgrammingError('Cannot operate on a closed KeyValueStore.')
+            conn = self.__local.conn = _connect(self.__database, self.__uri, self.__timeout, self.__synchronous)
+            with self.__connections_lock:
+                self.__connections.append(conn)
+        return conn
+
+    def __write(self, sql, params, many=False):
+        if self.__closed:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed KeyValueStore.')
+
+        op = _WriteOp(sql, params, many)
+        self.__writer.submit(op)
+        op.done.wait()
+        if op.error is not None:
+            raise op.error
+        return op
+
+    def __write_behind_items(self, items):
+        """
+        items: [(key, value), ...], 写入 pending 后提交给写线程, 不等待
+        """
+        with self.__pending_lock:
+            seq = next(self.__seq)
+            for key, value in items:
+                self.__pending[key] = (seq, value)
+            # 须在持有锁时入队, 保证写线程按 seq 顺序提交
+            self.__writer.submit(_WriteOp('REPLACE INTO kv (key, value) VALUES (?,?)', items, many=True, seq=seq))
+
+    def __committed(self, batch):
+        if not self.__pending:
+            return
+
+        with self.__pending_lock:
+            for op in batch:
+                if op.seq is None:
+                    continue
+                if op.error is not None:
+                    logging.error('KeyValueStore write behind failed: %r' % op.error)
+                for key, _ in op.params:
+                    entry = self.__pending.get(key)
+                    if entry is not None and entry[0] <= op.seq:
+                        del self.__pending[key]
+
+    def __pending_value(self, key):
+        if not self.__pending:
+            return None
+        with self.__pending_lock:
+            entry = self.__pending.get(key)
+        return entry
+
+    def flush(self):
+        """
+        等待此前的全部写操作提交
+        """
+        self.__write(None, None)
+
+    def close(self):
+        if self.__closed:
+            return
+        self.__writer.stop()
+        self.__closed = True
+        with self.__connections_lock:
+            connections, self.__connections = self.__connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        self.__conn.commit()
+        self.flush()
 
     def __del__(self):
-        self.__conn.commit()
-        self.__conn.close()
+        try:
+            self.close()
+        except (Exception,):
+            pass
 
     def __len__(self):
-        rows = self.__conn.execute('SELECT COUNT(*) FROM kv').fetchone()[0]
+        if self.__pending:
+            self.flush()
+        rows = self.__conn().execute('SELECT COUNT(*) FROM kv').fetchone()[0]
         return rows if rows is not None else 0
 
-    def iterkeys(self, prefix='', case_sensitivity=False):
-        c = self.__conn.cursor()
-        c.execute("PRAGMA case_sensitive_like = %s" % ('1' if case_sensitivity else '0'))
-        cmd = f'SELECT key FROM kv WHERE key LIKE "{prefix}%"'
-        for row in c.execute(cmd):
+    def __scan(self, columns: str, prefix: str, case_sensitivity: bool, limit, start_after):
+        """
+        前缀查询改写为索引上的区间查询 key >= prefix AND key < upper, 按 key 排序.
+        不区分大小写时 (与 SQLite 的 LIKE 相同, 只忽略 ASCII 字母的大小写) 使用 NOCASE 索引.
+        start_after 为上一页的最后一个 key, 与 limit 配合分页.
+        """
+        if self.__pending:
+            self.flush()
+
+        collate = '' if case_sensitivity else ' COLLATE NOCASE'
+        where = []
+        params = []
+        if prefix:
+            if not case_sensitivity:
+                prefix = prefix.translate(_ASCII_LOWER)
+            where.append('key%s >= ?' % collate)
+            params.append(prefix)
+            upper = _prefix_upper_bound(prefix, not case_sensitivity)
+            if upper is not None:
+                where.append('key%s < ?' % collate)
+                params.append(upper)
+
+        if start_after is not None:
+            if case_sensitivity:
+                where.append('key > ?')
+                params.append(start_after)
+            else:
+                # 忽略大小写后相等的 key 再按原值排序, 保证分页不重复不遗漏
+                where.append('(key COLLATE NOCASE > ? OR (key COLLATE NOCASE = ? AND key > ?))')
+                params.extend((start_after, start_after, start_after))
+
+        cmd = 'SELECT %s FROM kv' % columns
+        if where:
+            cmd += ' WHERE ' + ' AND '.join(where)
+        cmd += ' ORDER BY key' if case_sensitivity else ' ORDER BY key COLLATE NOCASE, key'
+        if limit is not None:
+            cmd += ' LIMIT ?'
+            params.append(limit)
+
+        return self.__conn().execute(cmd, params)
+
+    def iterkeys(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        for row in self.__scan('key', prefix, case_sensitivity, limit, start_after):
             yield row[0]
 
-    def itervalues(self, prefix='', case_sensitivity=False):
-        c = self.__conn.cursor()
-        c.execute("PRAGMA case_sensitive_like = %s" % ('1' if case_sensitivity else '0'))
-        cmd = f'SELECT value FROM kv WHERE key LIKE "{prefix}%"'
-        for row in c.execute(cmd):
+    def itervalues(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        for row in self.__scan('value', prefix, case_sensitivity, limit, start_after):
             yield row[0]
 
-    def iteritems(self, prefix='', case_sensitivity=False):
-        c = self.__conn.cursor()
-        c.execute("PRAGMA case_sensitive_like = %s" % ('1' if case_sensitivity else '0'))
-        cmd = f'SELECT key, value FROM kv WHERE key LIKE "{prefix}%"'
-        for row in c.execute(cmd):
+    def iteritems(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        for row in self.__scan('key, value', prefix, case_sensitivity, limit, start_after):
             yield row[0], row[1]
 
-    def keys(self, prefix='', case_sensitivity=False):
-        return list(self.iterkeys(prefix, case_sensitivity))
+    def keys(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        return list(self.iterkeys(prefix, case_sensitivity, limit, start_after))
 
-    def values(self, prefix='', case_sensitivity=False):
-        return list(self.itervalues(prefix, case_sensitivity))
+    def values(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        return list(self.itervalues(prefix, case_sensitivity, limit, start_after))
 
-    def items(self, prefix='', case_sensitivity=False):
-        return list(self.iteritems(prefix, case_sensitivity))
+    def items(self, prefix='', case_sensitivity=False, limit=None, start_after=None):
+        return list(self.iteritems(prefix, case_sensitivity, limit, start_after))
 
     def insert(self, key, value):
-        self.__conn.execute('INSERT INTO kv (key, value) VALUES (?,?)', (key, value))
+        if self.__pending_value(key) is not None:
+            self.flush()
+        self.__write('INSERT INTO kv (key, value) VALUES (?,?)', (key, value))
+
+    def update(self, other=(), **kwargs):
+        """
+        批量写入, 以 executemany 在一个事务中完成
+        """
+        items = list(other.items() if hasattr(other, 'items') else other)
+        items.extend(kwargs.items())
+        if not items:
+            return
+
+        if self.__write_behind:
+            self.__write_behind_items(items)
+        else:
+            self.__write('REPLACE INTO kv (key, value) VALUES (?,?)', items, many=True)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_many(self, keys) -> dict:
+        """
+        批量读取, 以 IN 查询完成, 返回 {key: value}, 不存在的 key 不包含在结果中
+        """
+        result = {}
+        keys = list(dict.fromkeys(keys))
+        lookup = keys
+        if self.__pending:
+            lookup = []
+            for key in keys:
+                entry = self.__pending_value(key)
+                if entry is None:
+                    lookup.append(key)
+                else:
+                    result[key] = entry[1]
+
+        conn = self.__conn()
+        for index in range(0, len(lookup), _IN_CHUNK):
+            chunk = lookup[index:index + _IN_CHUNK]
+            cmd = 'SELECT key, value FROM kv WHERE key IN (%s)' % ','.join('?' * len(chunk))
+            for row in conn.execute(cmd, chunk):
+                result[row[0]] = row[1]
+        return result
 
     def __contains__(self, key):
-        return self.__conn.execute('SELECT 1 FROM kv WHERE key = ?', (key,)).fetchone() is not None
+        if self.__pending_value(key) is not None:
+            return True
+        return self.__conn().execute('SELECT 1 FROM kv WHERE key = ?', (key,)).fetchone() is not None
 
     def __getitem__(self, key):
-        item = self.__conn.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+        entry = self.__pending_value(key)
+        if entry is not None:
+            return entry[1]
+
+        item = self.__conn().execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
         if item is None:
             raise KeyError(key)
         return item[0]
 
     def __setitem__(self, key, value):
-        self.__conn.execute('REPLACE INTO kv (key, value) VALUES (?,?)', (key, value))
+        if self.__write_behind:
+            self.__write_behind_items([(key, value)])
+        else:
+            self.__write('REPLACE INTO kv (key, value) VALUES (?,?)', (key, value))
 
     def __delitem__(self, key):
-        if key not in self:
+        if self.__pending_value(key) is not None:
+            self.flush()
+        if self.__write('DELETE FROM kv WHERE key = ?', (key,)).rowcount == 0:
             raise KeyError(key)
-        self.__conn.execute('DELETE FROM kv WHERE key = ?', (key,))
 
     def __iter__(self):
         return self.iterkeys()
+
+    def stats(self):
+        return {
+            "connections": len(self.__connections),
+            "batches": self.__writer.batches,
+            "writes": self.__writer.ops,
+            "pending": len(self.__pending),
+        }
@@ -0,0 +1,291 @@
+import itertools
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+from twisted.internet import reactor, defer, protocol, threads, stdio
+from twisted.protocols.basic import LineReceiver
+
+from lib.conf_tool import http_conf
+from lib.log_utils import switch_log_level
+
+# 子进程中的文件描述符约定
+WORKER_LISTEN_FD = 3  # 继承自 supervisor 的 service 监听 socket
+WORKER_CONTROL_IN_FD = 4  # supervisor -> worker 的控制命令
+WORKER_CONTROL_OUT_FD = 5  # worker -> supervisor 的命令结果
+
+WORKER_COMMAND_TIMEOUT = 60
+
+
+class _WorkerProcessProtocol(protocol.ProcessProtocol):
+    """
+    supervisor 侧的单个 worker, 控制通道为按行分隔的 JSON
+    """
+
+    def __init__(self, supervisor, index: int):
+        self.supervisor = supervisor
+        self.index = index
+        self.pid = None
+        self.started_at = time.time()
+        self.__buffer = b''
+        self.__pending = {}
+        self.__ids = itertools.count()
+
+    def connectionMade(self):
+        self.pid = self.transport.pid
+        logging.info('Worker started index:%s pid:%s' % (self.index, self.pid))
+
+    def childDataReceived(self, childFD, data):
+        if childFD != WORKER_CONTROL_OUT_FD:
+            return
+
+        self.__buffer += data
+        while b'\n' in self.__buffer:
+            line, self.__buffer = self.__buffer.split(b'\n', 1)
+            try:
+                msg = json.loads(line.decode())
+            except (Exception,):
+                logging.error('Worker control message invalid index:%s line:%r' % (self.index, line))
+                continue
+
+            d = self.__pending.pop(msg.get('id'), None)
+            if d is None:
+                continue
+
+            if msg.get('error') is not None:
+                d.errback(RuntimeError(msg['error']))
+            else:
+                d.callback(msg.get('result'))
+
+    def send(self, command: dict) -> defer.Deferred:
+        msg_id = next(self.__ids)
+        d = defer.Deferred()
+        self.__pending[msg_id] = d
+
+        line = json.dumps(dict(command, id=msg_id)).encode() + b'\n'
+        self.transport.writeToChild(WORKER_CONTROL_IN_FD, line)
+
+        def on_timeout(failure):
+            self.__pending.pop(msg_id, None)
+            return failure
+
+        d.addTimeout(WORKER_COMMAND_TIMEOUT, reactor)
+        d.addErrback(on_timeout)
+        return d
+
+    def processEnded(self, reason):
+        pending, self.__pending = self.__pending, {}
+        for d in pending.values():
+            d.errback(reason)
+
+        self.supervisor.worker_ended(self, reason)
+
+
+class WorkerSupervisor:
+    """
+    多进程模式: 由 supervisor 创建 service 端口的监听 socket, 以继承文件描述符的方式交给 N 个 worker 进程,
+    每个 worker 运行独立的 reactor 并在同一个 socket 上 accept. supervisor 自身只运行 MGMT 服务.
+
+    worker 异常退出时按指数退避重启, 运行超过 stable_seconds 后退避计数清零.
+    """
+
+    def __init__(self, count: int, host: str, port: int, backlog: int = 1024,
+                 restart_backoff: float = 1, max_restart_backoff: float = 60, stable_seconds: float = 10):
+        self.count = count
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.stable_seconds = stable_seconds
+
+        self.__socket = None
+        self.__workers = {}  # {index: _WorkerProcessProtocol}
+        self.__failures = {}  # {index: 连续异常退出次数}
+        self.__restarts = {}  # {index: 累计重启次数}
+        self.__stopping = False
+        self.__stopped = {}  # {index: Deferred}, 等待 worker 退出
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        self.__socket = sock
+
+        for index in range(self.count):
+            self.__failures[index] = 0
+            self.__restarts[index] = 0
+            self.__spawn(index)
+
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def __spawn(self, index: int):
+        if self.__stopping:
+            return
+
+        worker = _WorkerProcessProtocol(self, index)
+        self.__workers[index] = worker
+
+        args = [sys.executable, '-c', 'from lib import http_server; http_server.start_worker_service(%d)' % index]
+        child_fds = {
+            0: 0,
+            1: 1,
+            2: 2,
+            WORKER_LISTEN_FD: self.__socket.fileno(),
+            WORKER_CONTROL_IN_FD: 'w',
+            WORKER_CONTROL_OUT_FD: 'r',
+        }
+        reactor.spawnProcess(worker, sys.executable, args, env=os.environ, path=os.getcwd(), childFDs=child_fds)
+
+    def worker_ended(self, worker: _WorkerProcessProtocol, reason):
+        index = worker.index
+        if self.__workers.get(index) is worker:
+            del self.__workers[index]
+
+        if self.__stopping:
+            d = self.__stopped.pop(index, None)
+            if d is not None:
+                d.callback(None)
+            return
+
+        if time.time() - worker.started_at >= self.stable_seconds:
+            self.__failures[index] = 0
+        self.__failures[index] += 1
+        self.__restarts[index] += 1
+
+        delay = min(self.max_restart_backoff, self.restart_backoff * 2 ** (self.__failures[index] - 1))
+        logging.error('Worker exited index:%s pid:%s reason:%s, restart in %.1fs' %
+                      (index, worker.pid, reason.getErrorMessage(), delay))
+        reactor.callLater(delay, self.__spawn, index)
+
+    def broadcast(self, command: dict) -> defer.Deferred:
+        """
+        向所有存活的 worker 发送命令, 结果为 [{"index":0, "pid":123, "result":...}, ...]
+        只能在 reactor 线程中调用
+        """
+        workers = sorted(self.__workers.values(), key=lambda w: w.index)
+
+        def on_result(result, worker):
+            return {"index": worker.index, "pid": worker.pid, "result": result}
+
+        def on_error(failure, worker):
+            return {"index": worker.index, "pid": worker.pid, "error": failure.getErrorMessage()}
+
+        dl = []
+        for worker in workers:
+            d = worker.send(command)
+            d.addCallbacks(on_result, on_error, callbackArgs=(worker,), errbackArgs=(worker,))
+            dl.append(d)
+
+        return defer.gatherResults(dl)
+
+    def list_workers(self):
+        now = time.time()
+        result = []
+        for index in range(self.count):
+            worker = self.__workers.get(index)
+            result.append({
+                "index": index,
+                "pid": worker.pid if worker is not None else None,
+                "uptime": round(now - worker.started_at, 3) if worker is not None else None,
+                "restarts": self.__restarts.get(index, 0),
+            })
+        return result
+
+    def stop(self):
+        self.__stopping = True
+
+        dl = []
+        for index, worker in list(self.__workers.items()):
+            d = self.__stopped[index] = defer.Deferred()
+            dl.append(d)
+            try:
+                worker.transport.signalProcess('TERM')
+            except (Exception,):
+                self.__stopped.pop(index, None)
+                d.callback(None)
+
+        return defer.DeferredList(dl)
+
+
+class WorkerControl(LineReceiver):
+    """
+    worker 侧的控制通道, 执行 supervisor 转发来的管理命令
+    """
+    delimiter = b'\n'
+
+    def __init__(self, interface_manager, service):
+        self.__interface_manager = interface_manager
+        self.__service = service
+
+    def __execute(self, command: dict):
+        """
+        在线程池中执行
+        """
+        name = command.get('command')
+        if name == 'reload_interface':
+            return self.__interface_manager.reload_interface(bool(command.get('force')), command.get('trigger', 'manual'))
+        elif name == 'last_reload':
+            return self.__interface_manager.last_reload()
+        elif name == 'route_cache_stats':
+            return self.__interface_manager.route_cache_stats()
+        elif name == 'route_limits':
+            return threads.blockingCallFromThread(reactor, self.__service.limiter_stats)
+        elif name == 'metrics':
+            return threads.blockingCallFromThread(reactor, self.__service.metrics_snapshot)
+        elif name == 'profile_start':
+            return self.__service.profiler.start(**command['args'])
+        elif name == 'profile_stop':
+            return self.__service.profiler.stop(**command['args'])
+        elif name == 'profile_result':
+            return self.__service.profiler.result(**command['args'])
+        elif name == 'profile_status':
+            return self.__service.profiler.status()
+        elif name == 'slow_requests':
+            return self.__service.profiler.slow_requests()
+        elif name == 'set_slow':
+            return self.__service.profiler.set_slow(command['args']['slow_ms'])
+        elif name == 'response_cache':
+            return threads.blockingCallFromThread(reactor, self.__service.response_cache.stats)
+        elif name == 'invalidate_cache':
+            return {"invalidated": threads.blockingCallFromThread(reactor, self.__service.response_cache.invalidate,
+                                                                  **command['args'])}
+        elif name == 'change_log_level':
+            # supervisor 已写入配置文件, 这里只需重新读取并生效
+            http_conf.reload()
+            logging.getLogger().setLevel(switch_log_level(http_conf.get('log', "log_level")))
+            return http_conf.get('log', "log_level")
+        else:
+            raise ValueError('unknown command %r' % name)
+
+    def lineReceived(self, line):
+        try:
+            command = json.loads(line.decode())
+        except (Exception,):
+            logging.error('Worker control message invalid line:%r' % line)
+            return
+
+        def on_result(result):
+            self.sendLine(json.dumps({"id": command.get('id'), "result": result}).encode())
+
+        def on_error(failure):
+            logging.error('Worker control command failed command:%s\n %s' % (command, failure.getTraceback()))
+            self.sendLine(json.dumps({"id": command.get('id'), "error": failure.getErrorMessage()}).encode())
+
+        d = threads.deferToThread(self.__execute, command)
+        d.addCallbacks(on_result, on_error)
+
+    def connectionLost(self, reason=None):
+        # supervisor 已退出
+        if reactor.running:
+            logging.info('Worker control channel closed, stopping.')
+            reactor.stop()
+
+
+def start_worker_control(interface_manager, service):
+    return stdio.StandardIO(WorkerControl(interface_manager, service), stdin=WORKER_CONTROL_IN_FD, stdout=WORKER_CONTROL_OUT_FD)
@@ -0,0 +1,61 @@
+"""
+AsyncKeyValueStore 合并写入时, 出错的写操作不影响同一批的其它调用方
+"""
+import threading
+import unittest
+
+from lib.kv_async import AsyncKeyValueStore
+from lib.sqlitekeyvaluestore import KeyValueStore
+
+
+class AsyncKeyValueStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = KeyValueStore()
+        self.kv = AsyncKeyValueStore(self.store)
+
+    def tearDown(self):
+        self.kv.close()
+        self.store.close()
+
+    def test_set_and_get(self):
+        self.kv.set('a', '1').result()
+        self.kv.bulk({'b': '2', 'c': '3'}).result()
+        self.assertEqual(self.kv.get('a').result(), '1')
+        self.assertEqual(self.kv.get_many(['b', 'c']).result(), {'b': '2', 'c': '3'})
+
+    def test_bad_value_fails_only_its_caller(self):
+        # 写线程被占用时提交的写操作合并为一批
+        blocker = threading.Event()
+        self.kv.store = _Blocking(self.store, blocker)
+        futures = {'k%d' % index: self.kv.set('k%d' % index, object() if index == 3 else str(index))
+                   for index in range(7)}
+        futures['bulk'] = self.kv.bulk([('b0', 'x'), ('b1', 'y')])
+        blocker.set()
+
+        for key, future in futures.items():
+            if key == 'k3':
+                self.assertIsNotNone(future.exception(timeout=5))
+            else:
+                self.assertIsNone(future.exception(timeout=5), key)
+        self.assertEqual(self.store.get_many(['k0', 'k3', 'k6', 'b1']), {'k0': '0', 'k6': '6', 'b1': 'y'})
+
+
+class _Blocking:
+    """
+    第一次 update 等待 event, 使后续的写操作在队列中堆积
+    """
+
+    def __init__(self, store, event):
+        self.__store = store
+        self.__event = event
+
+    def update(self, items):
+        self.__event.wait(5)
+        return self.__store.update(items)
+
+    def __getattr__(self, name):
+        return getattr(self.__store, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+"""
+LatencyHistogram 输出的 Prometheus 分桶须与按 le 逐个计数的结果一致
+"""
+import random
+import unittest
+
+from lib.metrics import LatencyHistogram, PROMETHEUS_BUCKETS
+
+
+class CumulativeBucketsTest(unittest.TestCase):
+    def assert_buckets(self, values):
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+        expected = [[bound, sum(1 for value in values if value <= bound)] for bound in PROMETHEUS_BUCKETS]
+        expected.append(['+Inf', len(values)])
+        self.assertEqual(histogram.cumulative_buckets(), expected)
+
+    def test_values_on_bounds(self):
+        # HDR 桶跨越上限时, 恰好等于上限的值也必须计入该 le
+        self.assert_buckets(list(PROMETHEUS_BUCKETS))
+        self.assert_buckets([0.001, 0.1])
+
+    def test_values_around_bounds(self):
+        values = []
+        for bound in PROMETHEUS_BUCKETS:
+            values.extend((bound * 0.97, bound * 0.999, bound * 1.001, bound * 1.03))
+        self.assert_buckets(values + [0.0, 11.0])
+
+    def test_random(self):
+        rng = random.Random(8)
+        self.assert_buckets([rng.lognormvariate(-5, 2) for _ in range(5000)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+ETag 与响应缓存
+"""
+import unittest
+
+from twisted.web.http_headers import Headers
+
+from error_code import ErrorException, ERROR_INTERFACE_METHOD
+from lib.response import Response, error_response
+from lib.response_cache import make_etag, tag_response
+
+
+class _Request:
+    def __init__(self, if_none_match=None):
+        self.requestHeaders = Headers()
+        if if_none_match is not None:
+            self.requestHeaders.setRawHeaders(b'if-none-match', [if_none_match])
+
+
+class TagResponseTest(unittest.TestCase):
+    def test_adds_etag(self):
+        response = tag_response(_Request(), Response(200, [(b'content-type', [b'text/plain'])], b'body'))
+        self.assertEqual(response.code, 200)
+        self.assertIn((b'etag', [make_etag(b'body')]), response.headers)
+
+    def test_not_modified(self):
+        response = tag_response(_Request(make_etag(b'body')), Response(200, [], b'body'))
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, b'')
+
+    def test_shared_response_not_modified(self):
+        # error_response 返回预先生成的共享对象, 加 ETag 时不能修改它
+        shared = error_response(ErrorException(ERROR_INTERFACE_METHOD))
+        headers = list(shared.headers)
+        tagged = tag_response(_Request(), shared)
+        self.assertIsNot(tagged, shared)
+        self.assertEqual(shared.headers, headers)
+        self.assertIs(error_response(ErrorException(ERROR_INTERFACE_METHOD)), shared)
+
+    def test_other_codes_untouched(self):
+        response = Response(404, [], b'')
+        self.assertIs(tag_response(_Request(), response), response)
+
+
+if __name__ == '__main__':
+    unittest.main()
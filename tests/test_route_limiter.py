@@ -0,0 +1,70 @@
+"""
+RouteLimiter 排队期间断开的请求立即让出队列位置
+"""
+import unittest
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.test.requesthelper import DummyRequest
+
+from lib.route_limiter import RouteLimiter
+
+
+class RouteLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.limiter = RouteLimiter(1, queue_limit=2)
+        self.started = []
+        self.pending = []
+
+    def submit(self, name):
+        request = DummyRequest([b''])
+
+        def run():
+            self.started.append(name)
+            d = defer.Deferred()
+            self.pending.append(d)
+            return d
+
+        return request, self.limiter.submit(request, run)
+
+    def test_queue_limit(self):
+        self.assertTrue(self.submit('a')[1])
+        self.assertTrue(self.submit('b')[1])
+        self.assertTrue(self.submit('c')[1])
+        self.assertFalse(self.submit('d')[1])
+        self.assertEqual(self.limiter.stats()["queued"], 2)
+        self.assertEqual(self.limiter.rejected, 1)
+
+        self.pending.pop(0).callback(None)
+        self.assertEqual(self.started, ['a', 'b'])
+        self.assertEqual(self.limiter.queued(), 1)
+
+    def test_lost_request_leaves_queue(self):
+        self.submit('a')
+        request_b, _ = self.submit('b')
+        request_c, _ = self.submit('c')
+
+        request_b.processingFailed(Failure(ConnectionError('lost')))
+        request_c.processingFailed(Failure(ConnectionError('lost')))
+        self.assertEqual(self.limiter.queued(), 0)
+        # 断开的请求不再占用队列, 新的请求可以排队
+        self.assertTrue(self.submit('d')[1])
+        self.assertTrue(self.submit('e')[1])
+
+        self.pending.pop(0).callback(None)
+        self.assertEqual(self.started, ['a', 'd'])
+        self.assertEqual(self.limiter.stats()["queued"], 1)
+
+    def test_lost_running_request(self):
+        request_a, _ = self.submit('a')
+        self.submit('b')
+
+        # 已开始执行的请求断开时不影响队列
+        request_a.processingFailed(Failure(ConnectionError('lost')))
+        self.assertEqual(self.limiter.queued(), 1)
+        self.pending.pop(0).callback(None)
+        self.assertEqual(self.started, ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
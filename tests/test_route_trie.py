@@ -0,0 +1,138 @@
+"""
+RouteTrie/RouteTable 与按优先级线性扫描 match_interface_by_path 的结果须完全一致
+"""
+import random
+import unittest
+from functools import cmp_to_key
+
+from lib.interface_manager import compare_match_rule, match_interface_by_path
+from lib.route_trie import RouteTrie, RouteTable
+
+
+def sort_rules(match_rules):
+    return sorted(set(match_rules), key=cmp_to_key(compare_match_rule))
+
+
+def linear_lookup(sorted_rules, real_path):
+    for match_rule in sorted_rules:
+        if match_interface_by_path(match_rule, real_path):
+            return match_rule
+    return None
+
+
+RULES = [
+    '/info/*/status/*',
+    '/info/{}/status/*',
+    '/path/{}/info',
+    '/test/interface',
+    '/path/status',
+    '/path/{}',
+    '/path/*',
+    '/a/{}/{}',
+    '/a/b/{}',
+    '/a/{}/c',
+    '/a/*',
+    '/*',
+]
+
+PATHS = [
+    '/info/*/status/*',
+    '/info/*/status/success',
+    '/info/user/status/success',
+    '/info/user/status/',
+    '/info/user/status',
+    '/path/user/info',
+    '/path/user/infos',
+    '/path/status',
+    '/path/stat',
+    '/path/stat/',
+    '/path/',
+    '/path',
+    '/test/interface',
+    '/test/interface/',
+    '/a/b/c',
+    '/a/x/c',
+    '/a/b/x',
+    '/a/x/y',
+    '/a/b/c/d',
+    '/a',
+    '/',
+    '',
+    '/nope/x',
+]
+
+# 刚好能表达 字面量/'{}'/'*' 三类槽位及其冲突的小字母表
+_RULE_SEGMENTS = ['a', 'b', '*', '{}', '{}']
+_PATH_SEGMENTS = ['a', 'b', 'c', '*', '{}', '']
+
+
+def random_rules(rng, count):
+    rules = []
+    for _ in range(count):
+        size = rng.randint(1, 4)
+        rules.append('/' + '/'.join(rng.choice(_RULE_SEGMENTS) for _ in range(size)))
+    return rules
+
+
+def random_path(rng):
+    size = rng.randint(0, 5)
+    return '/' + '/'.join(rng.choice(_PATH_SEGMENTS) for _ in range(size))
+
+
+class RouteTrieTest(unittest.TestCase):
+    def assert_equivalent(self, match_rules, paths, cache_size=0):
+        sorted_rules = sort_rules(match_rules)
+        trie = RouteTrie([(match_rule, match_rule) for match_rule in sorted_rules])
+        table = RouteTable([(match_rule, match_rule) for match_rule in sorted_rules], cache_size=cache_size)
+        for real_path in paths:
+            expected = linear_lookup(sorted_rules, real_path)
+            with self.subTest(rules=sorted_rules, path=real_path):
+                self.assertEqual(trie.lookup(real_path), expected)
+                self.assertEqual(table.lookup(real_path), expected)
+                # 第二次查找命中 shape_key 缓存
+                self.assertEqual(table.lookup(real_path), expected)
+
+    def test_documented_examples(self):
+        sorted_rules = sort_rules(RULES)
+        trie = RouteTrie([(match_rule, match_rule) for match_rule in sorted_rules])
+        self.assertEqual(trie.lookup('/info/*/status/success'), '/info/*/status/*')
+        self.assertEqual(trie.lookup('/info/user/status/success'), '/info/{}/status/*')
+        self.assertEqual(trie.lookup('/path/user/info'), '/path/{}/info')
+        self.assertEqual(trie.lookup('/path/user/infos'), '/path/*')
+        self.assertEqual(trie.lookup('/path/status'), '/path/status')
+        self.assertEqual(trie.lookup('/path/stat'), '/path/{}')
+        self.assertEqual(trie.lookup('/path/stat/'), '/path/*')
+
+    def test_table(self):
+        self.assert_equivalent(RULES, PATHS)
+        self.assert_equivalent(RULES, PATHS, cache_size=100)
+
+    def test_empty(self):
+        self.assert_equivalent([], PATHS, cache_size=10)
+
+    def test_shape_key_cache(self):
+        sorted_rules = sort_rules(RULES)
+        table = RouteTable([(match_rule, match_rule) for match_rule in sorted_rules], cache_size=100)
+        # 不同参数的路径共享同一个缓存键
+        self.assertEqual(table.lookup('/path/u1/info'), '/path/{}/info')
+        self.assertEqual(table.lookup('/path/u2/info'), '/path/{}/info')
+        self.assertEqual(table.lookup('/path/u3/infos'), '/path/*')
+        stats = table.cache_stats()
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["hits"], 1)
+
+    def test_shape_key_cache_eviction(self):
+        # 容量很小时频繁淘汰, 结果仍须一致
+        rng = random.Random(7)
+        self.assert_equivalent(RULES, [random_path(rng) for _ in range(300)] + PATHS, cache_size=3)
+
+    def test_random(self):
+        rng = random.Random(20240501)
+        for _ in range(300):
+            match_rules = random_rules(rng, rng.randint(1, 12))
+            paths = [random_path(rng) for _ in range(60)]
+            self.assert_equivalent(match_rules, paths, cache_size=rng.choice((0, 4, 1000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+KeyValueStore 的前缀查询须与逐个比较前缀的结果一致
+"""
+import random
+import unittest
+
+from lib.sqlitekeyvaluestore import KeyValueStore, _prefix_upper_bound
+
+
+def expected_keys(keys, prefix, case_sensitivity):
+    if case_sensitivity:
+        return sorted(key for key in keys if key.startswith(prefix))
+    # 与 SQLite NOCASE 相同, 只忽略 ASCII 字母的大小写
+    fold = lambda text: ''.join(c.lower() if 'A' <= c <= 'Z' else c for c in text)
+    return sorted((key for key in keys if fold(key).startswith(fold(prefix))), key=lambda key: (fold(key), key))
+
+
+class PrefixUpperBoundTest(unittest.TestCase):
+    def test_binary(self):
+        self.assertEqual(_prefix_upper_bound('ab'), 'ac')
+        self.assertEqual(_prefix_upper_bound('@'), 'A')
+        self.assertEqual(_prefix_upper_bound(''), None)
+        self.assertEqual(_prefix_upper_bound('a\U0010ffff'), 'b')
+        self.assertEqual(_prefix_upper_bound('\U0010ffff'), None)
+        self.assertEqual(_prefix_upper_bound('퟿'), '')
+
+    def test_nocase_skips_upper_case(self):
+        self.assertEqual(_prefix_upper_bound('@', True), '[')
+        self.assertEqual(_prefix_upper_bound('x@', True), 'x[')
+        self.assertEqual(_prefix_upper_bound('ab', True), 'ac')
+
+
+class KeyValueStorePrefixTest(unittest.TestCase):
+    def setUp(self):
+        self.kv = KeyValueStore()
+
+    def tearDown(self):
+        self.kv.close()
+
+    def test_prefix_below_letter(self):
+        # '@' 的下一个码位是 'A', NOCASE 下 '[' ~ '`' 开头的 key 不能落入区间
+        keys = ['@a', '@B', '[y', '_x', '`z', 'a', 'A@', 'A[', 'a@b']
+        self.kv.update((key, key) for key in keys)
+        self.assertEqual(self.kv.keys('@'), ['@a', '@B'])
+        self.assertEqual(self.kv.keys('a@'), ['A@', 'a@b'])
+        self.assertEqual(self.kv.keys('@', case_sensitivity=True), ['@B', '@a'])
+
+    def test_random(self):
+        rng = random.Random(15)
+        alphabet = '@AZaz[`{_0'
+        keys = {''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(400)}
+        self.kv.update((key, key) for key in keys)
+        for prefix in ['', '@', 'A', 'a', 'z', 'Z', '`', '[', '{', 'a@', 'Z`'] + \
+                      [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 3))) for _ in range(50)]:
+            for case_sensitivity in (False, True):
+                with self.subTest(prefix=prefix, case_sensitivity=case_sensitivity):
+                    self.assertEqual(self.kv.keys(prefix, case_sensitivity=case_sensitivity),
+                                     expected_keys(keys, prefix, case_sensitivity))
+
+    def test_paging(self):
+        keys = ['@a', '@B', '@c', '[y', 'A@', 'a@b', '@D']
+        self.kv.update((key, key) for key in keys)
+        pages = []
+        start_after = None
+        while True:
+            page = self.kv.keys('@', limit=2, start_after=start_after)
+            if not page:
+                break
+            pages.extend(page)
+            start_after = page[-1]
+        self.assertEqual(pages, expected_keys(keys, '@', False))
+
+
+if __name__ == '__main__':
+    unittest.main()